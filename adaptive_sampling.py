@@ -0,0 +1,169 @@
+import math
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.Simulation import Simulation
+from classes.RewardModels import StateDependentWeights
+from classes.State import HumanInfo
+
+# Outcome metrics tracked for every run and strategy
+OUTCOME_METRICS = ['final_health', 'final_time', 'mean_trust', 'acceptance_rate']
+
+# Default target widths of the 95% confidence intervals of the outcome metrics
+DEFAULT_TARGET_WIDTHS = {'final_health': 5.0, 'final_time': 5.0, 'mean_trust': 0.02, 'acceptance_rate': 0.05}
+
+Z_95 = 1.96
+
+
+def get_outcome_metrics(sim: Simulation) -> Dict[str, float]:
+    """
+    Computes the outcome metrics of a single simulation
+    :param sim: a simulation that has been run
+    :return: a dict with the final health, final time, mean trust and recommendation acceptance rate
+    """
+    accepted = [int(a == r) for a, r in zip(sim.action_history, sim.rec_history)]
+    return {'final_health': float(sim.health_history[-1]),
+            'final_time': float(sim.time_history[-1]),
+            'mean_trust': float(np.mean(sim.trust_history)),
+            'acceptance_rate': float(np.mean(accepted))}
+
+
+def get_strategy_key(sim: Simulation) -> str:
+    """
+    Returns the key used for a strategy in the plots: 'state_dep' or the constant health reward weight
+    """
+    if isinstance(sim.robot.reward_model, StateDependentWeights):
+        return 'state_dep'
+    info = HumanInfo(100, 100, 1., 1, 0)
+    return f'{sim.robot.reward_model.get_wh(info):.2f}'
+
+
+class RunningStatistics:
+    """
+    Welford's online algorithm for the running mean and variance of a metric
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.mean = 0.
+        self.m2 = 0.
+
+    def add(self, x: float):
+        self.n += 1
+        delta = x - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (x - self.mean)
+
+    @property
+    def std(self) -> float:
+        if self.n < 2:
+            return math.inf
+        return math.sqrt(self.m2 / (self.n - 1))
+
+    @property
+    def ci_width(self) -> float:
+        """Full width of the 95% confidence interval of the mean"""
+        if self.n < 2:
+            return math.inf
+        return 2 * Z_95 * self.std / math.sqrt(self.n)
+
+
+class SequentialSampler:
+    """
+    Decides how many participants to run for every starting condition. Participants are run in batches and each
+    condition stops once the confidence intervals of all its outcome metrics, for every strategy, are narrower
+    than the target widths. The budget left over by converged conditions goes to the ones with the widest intervals.
+    """
+
+    def __init__(self, num_conditions: int, budget: int, batch_size: int = 10,
+                 target_widths: Dict[str, float] | None = None):
+        """
+        :param num_conditions: the number of starting conditions
+        :param budget: the maximum number of participants over all starting conditions
+        :param batch_size: the number of participants added to a condition in one round
+        :param target_widths: the target width of the confidence interval for each outcome metric
+        """
+        self.num_conditions = num_conditions
+        self.budget = budget
+        self.batch_size = batch_size
+        self.target_widths = dict(DEFAULT_TARGET_WIDTHS)
+        if target_widths is not None:
+            self.target_widths.update(target_widths)
+
+        self.runs_used = [0] * num_conditions
+        # stats[condition][strategy][metric]
+        self.stats: List[Dict[str, Dict[str, RunningStatistics]]] = [{} for _ in range(num_conditions)]
+
+    def add(self, condition_idx: int, sims: List[Simulation]):
+        """
+        Adds the outcomes of one participant at a starting condition
+        :param condition_idx: the index of the starting condition
+        :param sims: the simulations of all strategies for this participant
+        """
+        self.runs_used[condition_idx] += 1
+        for sim in sims:
+            strategy_stats = self.stats[condition_idx].setdefault(
+                get_strategy_key(sim), {metric: RunningStatistics() for metric in OUTCOME_METRICS})
+            for metric, value in get_outcome_metrics(sim).items():
+                strategy_stats[metric].add(value)
+
+    def width_ratio(self, condition_idx: int) -> float:
+        """
+        Returns the largest ratio of the interval width to its target, over all strategies and metrics.
+        A ratio below one means the condition has converged
+        """
+        if len(self.stats[condition_idx]) == 0:
+            return math.inf
+        return max(stats.ci_width / self.target_widths[metric]
+                   for strategy_stats in self.stats[condition_idx].values()
+                   for metric, stats in strategy_stats.items())
+
+    def is_converged(self, condition_idx: int) -> bool:
+        return self.width_ratio(condition_idx) < 1.
+
+    @property
+    def remaining_budget(self) -> int:
+        return self.budget - sum(self.runs_used)
+
+    def allocate(self) -> Dict[int, int]:
+        """
+        Decides the number of participants to run for each condition in the next round
+        :return: a dict from condition index to the number of participants (empty when done)
+        """
+        # Rank the unconverged conditions from the widest to the narrowest intervals
+        ratios = [(self.width_ratio(i), i) for i in range(self.num_conditions) if not self.is_converged(i)]
+        ratios.sort(reverse=True)
+
+        allocation = {}
+        remaining = self.remaining_budget
+        for ratio, i in ratios:
+            if remaining <= 0:
+                break
+            n = self.runs_used[i]
+            if n < 2:
+                needed = self.batch_size
+            else:
+                # The width shrinks as 1/sqrt(n), which gives an estimate of the participants still needed
+                needed = max(1, math.ceil(n * (ratio ** 2 - 1)))
+            num_runs = min(needed, self.batch_size, remaining)
+            allocation[i] = num_runs
+            remaining -= num_runs
+
+        return allocation
+
+    def report(self, starting_conditions: List[Tuple[int, int]] | None = None) -> Dict:
+        """
+        Prints and returns the number of participants used per condition and the final interval widths
+        """
+        report = {}
+        print(f"{'Condition':>12} {'Runs':>6} {'Converged':>10} {'Width ratio':>12}")
+        for i in range(self.num_conditions):
+            label = str(i) if starting_conditions is None else str(tuple(starting_conditions[i]))
+            widths = {strategy: {metric: stats.ci_width for metric, stats in strategy_stats.items()}
+                      for strategy, strategy_stats in self.stats[i].items()}
+            report[label] = {'runs': self.runs_used[i], 'converged': self.is_converged(i),
+                             'ci_widths': widths}
+            print(f"{label:>12} {self.runs_used[i]:>6} {str(self.is_converged(i)):>10} "
+                  f"{self.width_ratio(i):>12.2f}")
+        print(f"Total runs: {sum(self.runs_used)} of a budget of {self.budget}")
+
+        return report
@@ -0,0 +1,124 @@
+"""Times the Robot's recommendation solve cell by cell and stage-parallel over a range of thread counts, and the
+stacked solve of several strategies against solving them one by one."""
+import argparse
+from time import perf_counter
+from typing import Dict, List
+from classes.SimSettings import SimSettings
+from classes.RobotModel import Robot, solve_stacked
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.RewardModels import StateDependentWeights, ConstantWeights
+from classes.State import RobotInfo
+from run_simulation import KAPPA, STATE_DEP_TRUST_PARAMS
+
+
+def time_solve(robot: Robot, info: RobotInfo, repeats: int):
+    """Returns the best time of a number of solves and the recommendation"""
+    best = float('inf')
+    recommendation = None
+    for _ in range(repeats):
+        start = perf_counter()
+        recommendation = robot.solve(info)
+        best = min(best, perf_counter() - start)
+    return best, recommendation
+
+
+def benchmark(num_sites_list: List[int], thread_counts: List[int], wh: float | None = None,
+              repeats: int = 3) -> List[Dict]:
+    """
+    :param num_sites_list: the mission lengths to solve
+    :param thread_counts: the numbers of threads of the stage-parallel solves
+    :param wh: the constant health reward weight (default: the state dependent weights)
+    :param repeats: the number of solves to take the best time of
+    :return: one row per mission length and solver
+    """
+    reward_model = StateDependentWeights() if wh is None else ConstantWeights(wh)
+    rows = []
+    for num_sites in num_sites_list:
+        settings = SimSettings(num_sites, 100, 100, 0.7, 0.7, threat_seed=1)
+        trust_model = BetaDistributionModel(list(STATE_DEP_TRUST_PARAMS), ObservedReward(), seed=1)
+        human_model = HumanModel(trust_model, BoundedRationalityDisuse(kappa=KAPPA, seed=1), reward_model)
+        info = RobotInfo(100, 100, 0.3, 0.7, 0)
+
+        robot = Robot(human_model, reward_model, settings)
+        serial_time, serial_recommendation = time_solve(robot, info, 1)
+        rows.append({'num_sites': num_sites, 'threads': 'cells', 'time': serial_time, 'speedup': 1.,
+                     'matches': True})
+        single_thread_time = None
+        for num_threads in thread_counts:
+            robot = Robot(human_model, reward_model, settings, num_threads=num_threads)
+            parallel_time, recommendation = time_solve(robot, info, repeats)
+            if single_thread_time is None:
+                single_thread_time = parallel_time
+            rows.append({'num_sites': num_sites, 'threads': num_threads, 'time': parallel_time,
+                         'speedup': serial_time / parallel_time,
+                         'thread_speedup': single_thread_time / parallel_time,
+                         'matches': recommendation == serial_recommendation})
+            robot.workspace.executor.shutdown()
+
+    return rows
+
+
+def benchmark_stacked(num_sites_list: List[int], wh_list: List[float], repeats: int = 3) -> List[Dict]:
+    """
+    :param num_sites_list: the mission lengths to solve
+    :param wh_list: the constant health reward weights of the strategies, solved with the state dependent weights
+    :param repeats: the number of solves to take the best time of
+    :return: one row per mission length
+    """
+    reward_models = [StateDependentWeights()] + [ConstantWeights(wh) for wh in wh_list]
+    rows = []
+    for num_sites in num_sites_list:
+        settings = SimSettings(num_sites, 100, 100, 0.7, 0.7, threat_seed=1)
+        trust_model = BetaDistributionModel(list(STATE_DEP_TRUST_PARAMS), ObservedReward(), seed=1)
+        human_model = HumanModel(trust_model, BoundedRationalityDisuse(kappa=KAPPA, seed=1), reward_models[0])
+        robots = [Robot(human_model, reward_model, settings, num_threads=1) for reward_model in reward_models]
+        info = RobotInfo(100, 100, 0.3, 0.7, 0)
+
+        separate_time, stacked_time = float('inf'), float('inf')
+        for _ in range(repeats):
+            start = perf_counter()
+            separate = [robot.solve(info) for robot in robots]
+            separate_time = min(separate_time, perf_counter() - start)
+            start = perf_counter()
+            stacked = solve_stacked(robots, info)
+            stacked_time = min(stacked_time, perf_counter() - start)
+        for robot in robots:
+            robot.workspace.executor.shutdown()
+        rows.append({'num_sites': num_sites, 'separate': separate_time, 'stacked': stacked_time,
+                     'speedup': separate_time / stacked_time, 'matches': separate == stacked})
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the stage-parallel recommendation solver')
+    parser.add_argument('--num-sites', type=int, nargs='+', default=[10, 20, 30])
+    parser.add_argument('--threads', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--wh', type=float, default=None,
+                        help='the constant health reward weight (default: the state dependent weights)')
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--stacked', type=float, nargs='+', default=None, metavar='WH',
+                        help='time the stacked solve of the state dependent and these constant weights instead')
+    args = parser.parse_args()
+
+    if args.stacked is not None:
+        rows = benchmark_stacked(args.num_sites, args.stacked, args.repeats)
+        print(f"{'Sites':>6} {'Separate (s)':>13} {'Stacked (s)':>12} {'Speedup':>8} {'Same':>5}")
+        for row in rows:
+            print(f"{row['num_sites']:>6} {row['separate']:>13.4f} {row['stacked']:>12.4f} {row['speedup']:>8.1f} "
+                  f"{str(row['matches']):>5}")
+        return
+
+    rows = benchmark(args.num_sites, args.threads, args.wh, args.repeats)
+    print(f"{'Sites':>6} {'Threads':>8} {'Time (s)':>9} {'vs cells':>9} {'vs 1 thread':>12} {'Same':>5}")
+    for row in rows:
+        thread_speedup = f"{row['thread_speedup']:.2f}" if 'thread_speedup' in row else '-'
+        print(f"{row['num_sites']:>6} {row['threads']:>8} {row['time']:>9.4f} {row['speedup']:>9.1f} "
+              f"{thread_speedup:>12} {str(row['matches']):>5}")
+
+
+if __name__ == "__main__":
+    main()
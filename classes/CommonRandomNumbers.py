@@ -0,0 +1,31 @@
+from numpy.random import default_rng
+
+
+class CommonRandomNumbers:
+    """
+    Per-site uniform random numbers of one participant, drawn up front from a dedicated stream.
+    Every strategy's copy of the participant reads the same numbers at the same site, so the paired differences
+    between strategies are not masked by independent sampling noise
+    """
+
+    # Streams (columns) of the uniform draws
+    DECISION = 0    # whether the recommendation is followed
+    CHOICE = 1      # the bounded rationality choice when it is not followed
+    TRUST = 2       # the trust sample
+
+    def __init__(self, num_sites: int, seed: int | None = None):
+        """
+        :param num_sites: the number of sites in the mission
+        :param seed: the seed of the participant's stream (default: None)
+        """
+        self.num_sites = num_sites
+        rng = default_rng(seed)
+        # One row per site and an extra one for the trust sample before the first site
+        self.uniforms = rng.random((num_sites + 1, 3))
+
+    def get(self, row: int, stream: int) -> float:
+        """
+        :param row: the site index (for the trust stream, the number of trust updates so far)
+        :param stream: one of DECISION, CHOICE, or TRUST
+        """
+        return self.uniforms[row, stream]
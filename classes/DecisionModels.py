@@ -1,6 +1,9 @@
+import numpy as np
 from numpy.random import default_rng
-from scipy.special import expit
 from classes.State import HumanInfo
+from classes.CommonRandomNumbers import CommonRandomNumbers
+from classes.Serialization import get_state, set_state
+from classes.SpecialFunctions import expit
 
 
 class DecisionModelBase:
@@ -13,6 +16,20 @@ class DecisionModelBase:
         :param seed: the seed for the random number generator (default: 123)
         """
         self.rng = default_rng(seed)
+        self.crn = None
+
+    def __getstate__(self):
+        return get_state(self)
+
+    def __setstate__(self, state):
+        set_state(self, state, defaults={'crn': None})
+
+    def use_common_random_numbers(self, crn: CommonRandomNumbers):
+        """
+        Draws the random numbers for choosing actions from the common random numbers of the participant
+        :param crn: the common random numbers shared by all copies of the participant
+        """
+        self.crn = crn
 
     def choose_action(self, info: HumanInfo, trust: float, **kwargs):
         """
@@ -62,6 +79,12 @@ class BoundedRationalityDisuse(DecisionModelBase):
         self.prob_0 = expit(self.kappa * (self.reward_0 - self.reward_1))
         self.prob_1 = 1 - self.prob_0        
 
+        if self.crn is not None:
+            # Inverse transform sampling, so that the same draws give the same decisions across strategies
+            if self.crn.get(info.site_idx, CommonRandomNumbers.DECISION) < trust:
+                return info.recommendation
+            return int(self.crn.get(info.site_idx, CommonRandomNumbers.CHOICE) >= self.prob_0)
+
         r = self.rng.random()
         # With probability equal to trust, return the recommended action
         if r < trust:
@@ -87,3 +110,29 @@ class BoundedRationalityDisuse(DecisionModelBase):
             prob_1 = trust + (1 - trust) * self.prob_1
 
         return prob_0, prob_1
+
+    def get_prob_of_actions_batch(self, recommendation: int, threat_level: float, trust: np.ndarray,
+                                  wh: np.ndarray):
+        """
+        Returns the probabilities for the two actions over arrays of trust and health reward weights, with the same
+        arithmetic as get_prob_of_actions. Unlike get_prob_of_actions, it does not draw from the random number
+        generator
+        :param recommendation: the recommended action
+        :param threat_level: the threat level at the site
+        :param trust: the trust of the human on the robot, broadcast against wh
+        :param wh: the health reward weights
+        :return: (prob_0, prob_1) the arrays of probabilities for choosing the two actions
+        """
+        wc = 1 - wh
+        reward_0 = -threat_level * wh * self.hl
+        reward_1 = -wc * self.tc
+        action_prob_0 = expit(self.kappa * (reward_0 - reward_1))
+        action_prob_1 = 1 - action_prob_0
+        if recommendation == 0:
+            prob_0 = trust + (1 - trust) * action_prob_0
+            prob_1 = (1 - trust) * action_prob_1
+        else:
+            prob_0 = (1 - trust) * action_prob_0
+            prob_1 = trust + (1 - trust) * action_prob_1
+
+        return prob_0, prob_1
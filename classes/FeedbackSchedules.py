@@ -0,0 +1,106 @@
+from typing import Dict
+import numpy as np
+from classes.HumanModels import HumanModel
+
+
+class FeedbackScheduleBase:
+    """
+    Base class for the schedules of the sites after which the human is asked for trust feedback. At the other
+    sites the robot's estimator only counts the outcome of the recommendation, and the trust parameters are refit
+    at the next feedback
+    """
+
+    def should_query(self, site_idx: int, human_model: HumanModel) -> bool:
+        """
+        Returns whether to ask for trust feedback after a site
+        :param site_idx: the index of the site
+        :param human_model: the robot's model of the human, before the update with the outcome of the site
+        """
+        raise NotImplementedError
+
+    def for_run(self, seed: int):
+        """Returns the schedule to use in the simulations of a run with this seed"""
+        return self
+
+
+class EverySite(FeedbackScheduleBase):
+    """Feedback after every site, as in the human subjects study"""
+
+    def should_query(self, site_idx: int, human_model: HumanModel) -> bool:
+        return True
+
+
+class EveryKSites(FeedbackScheduleBase):
+    """Feedback after every k-th site"""
+
+    def __init__(self, k: int):
+        if k < 1:
+            raise ValueError(f"k must be at least 1, got {k}")
+        self.k = k
+
+    def should_query(self, site_idx: int, human_model: HumanModel) -> bool:
+        return (site_idx + 1) % self.k == 0
+
+
+class RandomFeedback(FeedbackScheduleBase):
+    """
+    Feedback after each site with probability p. The draw of a site only depends on the seed and the site, so
+    the simulations of all the strategies of a run are asked at the same sites
+    """
+
+    def __init__(self, p: float, seed: int | None = None):
+        """
+        :param p: the probability of asking after a site
+        :param seed: the seed of the draws (default: None, the seed of the run)
+        """
+        self.p = p
+        self.seed = seed
+
+    def for_run(self, seed: int):
+        if self.seed is not None:
+            return self
+        return RandomFeedback(self.p, seed)
+
+    def should_query(self, site_idx: int, human_model: HumanModel) -> bool:
+        seed_sequence = np.random.SeedSequence(self.seed, spawn_key=(site_idx,))
+        return bool(np.random.default_rng(seed_sequence).uniform() < self.p)
+
+
+class AdaptiveFeedback(FeedbackScheduleBase):
+    """
+    Feedback when the robot's predicted trust is uncertain, measured by HumanModel.get_trust_uncertainty
+    """
+
+    def __init__(self, threshold: float, max_gap: int | None = None):
+        """
+        :param threshold: the standard deviation of the predicted trust above which to ask
+        :param max_gap: the largest number of sites in a row without feedback (default: None, no limit)
+        """
+        self.threshold = threshold
+        self.max_gap = max_gap
+
+    def should_query(self, site_idx: int, human_model: HumanModel) -> bool:
+        if self.max_gap is not None and human_model.get_sites_without_feedback() >= self.max_gap:
+            return True
+        return human_model.get_trust_uncertainty() > self.threshold
+
+
+def make_feedback_schedule(config: Dict | None) -> FeedbackScheduleBase | None:
+    """
+    Builds a schedule from a json-serializable config, e.g. {'kind': 'every_k', 'k': 3},
+    {'kind': 'random', 'p': 0.5}, or {'kind': 'adaptive', 'threshold': 0.1, 'max_gap': 4}
+    :return: the schedule, or None for feedback after every site
+    """
+    if config is None:
+        return None
+    config = dict(config)
+    kind = config.pop('kind')
+    if kind == 'every_site':
+        return EverySite()
+    if kind == 'every_k':
+        return EveryKSites(**config)
+    if kind == 'random':
+        return RandomFeedback(**config)
+    if kind == 'adaptive':
+        return AdaptiveFeedback(**config)
+    raise ValueError(f"Unknown feedback schedule {kind}")
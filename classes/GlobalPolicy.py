@@ -0,0 +1,186 @@
+from collections import OrderedDict
+import threading
+import numpy as np
+from classes.State import RobotInfo
+
+# The absolute states covered by the policies are the healths and times from 0 to these, on the 10-unit grid
+MAX_HEALTH = 100
+MAX_TIME = 100
+# The number of policies kept by a GlobalPolicyCache by default
+CACHE_SIZE = 64
+
+
+class GlobalPolicyBase:
+    """
+    Base class for the policies of a whole mission, solved in one backward pass over the absolute states instead
+    of relative to the state of a query. The values of stage s are indexed by the health and time levels reachable
+    s sites after any start state on the grid, which extend below 0 health (and beyond the time range) since the
+    robots' lookaheads do not clip them
+    """
+
+    def __init__(self, num_sites_to_go: int, max_health: int = MAX_HEALTH, max_time: int = MAX_TIME):
+        """
+        :param num_sites_to_go: the number of sites from the start states to the end of the mission
+        :param max_health: the largest start health (default: MAX_HEALTH)
+        :param max_time: the largest start time (default: MAX_TIME)
+        """
+        self.num_sites_to_go = num_sites_to_go
+        self.max_health = max_health
+        self.max_time = max_time
+        self.num_health_levels = max_health // 10 + 1
+        self.num_time_levels = max_time // 10 + 1
+        # The values and actions of every stage, from the start states (stage 0) to the end of the mission
+        self.values = [None] * (num_sites_to_go + 1)
+        self.actions = [None] * (num_sites_to_go + 1)
+
+    def get_healths(self, stage: int) -> np.ndarray:
+        """Returns the health levels of the states of a stage, from the largest down"""
+        return self.max_health - np.arange(self.num_health_levels + stage) * 10
+
+    def get_index(self, health, time):
+        """
+        Returns the (health, time) index of a start state, or None if it is not on the grid
+        """
+        raise NotImplementedError
+
+    @staticmethod
+    def get_level(value, max_value: int) -> int | None:
+        if value != int(value) or int(value) % 10 != 0 or not 0 <= value <= max_value:
+            return None
+        return int(value) // 10
+
+
+class RobotGlobalPolicy(GlobalPolicyBase):
+    """
+    The recommendations of a Robot for every start (health, time) on the grid with the same trust and reward
+    models. The stages after the current site are solved once. The current site is solved at the lookup, for the
+    threat level of the query, from the values of the next stage. The values of stage s are indexed
+    [successes, health, time] as in the Robot's value matrix, with the times increasing as in the Robot's lookahead
+    """
+
+    def __init__(self, robot, num_sites_to_go: int, prior_threat_level: float,
+                 max_health: int = MAX_HEALTH, max_time: int = MAX_TIME):
+        """
+        :param robot: the Robot whose models to solve for
+        :param num_sites_to_go: the number of sites from the start states to the end of the mission
+        :param prior_threat_level: the prior threat level of the sites after the current one
+        """
+        super().__init__(num_sites_to_go, max_health, max_time)
+        n = num_sites_to_go
+        next_values = np.zeros((n + 1, self.num_health_levels + n, self.num_time_levels + n))
+        self.values[n] = next_values
+        for stage in reversed(range(1, n)):
+            healths = self.get_healths(stage)
+            times = np.arange(self.num_time_levels + stage) * 10
+            wh = robot.reward_model.get_wh_batch(healths[:, None], times[None, :], prior_threat_level, stage)
+            value_0, value_1 = robot.get_stage_values(prior_threat_level, robot.get_stage_trust(stage)[:, None, None],
+                                                      wh, next_values)
+            next_values = np.where(value_0 > value_1, value_0, value_1)
+            self.values[stage] = next_values
+            self.actions[stage] = (value_0 <= value_1).astype(np.int8)
+
+    def get_index(self, health, time):
+        health_level = self.get_level(health, self.max_health)
+        time_level = self.get_level(time, self.max_time)
+        if health_level is None or time_level is None:
+            return None
+        return self.num_health_levels - 1 - health_level, time_level
+
+    def get_recommendation(self, robot, info: RobotInfo) -> int | None:
+        """
+        Returns the robot's recommendation at the current site, or None if the state is not on the grid
+        :param robot: a Robot with the models the policy was solved for
+        :param info: the information available to the robot when making a recommendation
+        """
+        index = self.get_index(info.health, info.time)
+        if index is None:
+            return None
+        j, k = index
+        wh = robot.reward_model.get_wh_batch(np.array([[info.health]]), np.array([[info.time]]), info.threat_level, 0)
+        value_0, value_1 = robot.get_stage_values(info.threat_level, robot.get_stage_trust(0)[:, None, None], wh,
+                                                  self.values[1][:2, j:j + 2, k:k + 2])
+        return int(value_0[0, 0, 0] <= value_1[0, 0, 0])
+
+
+class RobotOnlyGlobalPolicy(GlobalPolicyBase):
+    """
+    The actions of a RobotOnly for every state of the mission on the grid, for the threat level at the current
+    site. The values of stage s are indexed [health, time], with the healths and times decreasing
+    """
+
+    def __init__(self, robot_only, info: RobotInfo, max_health: int = MAX_HEALTH, max_time: int = MAX_TIME):
+        """
+        :param robot_only: the RobotOnly whose models to solve for
+        :param info: the information at the current site. Only the site, the threat level, and the prior threat
+                     level are used, the policy covers every health and time
+        """
+        n = robot_only.settings.num_sites - info.site_idx
+        super().__init__(n, max_health, max_time)
+        next_values = np.zeros((self.num_health_levels + n, self.num_time_levels + n))
+        self.values[n] = next_values
+        for stage in reversed(range(n)):
+            healths = self.get_healths(stage)
+            times = self.max_time - np.arange(self.num_time_levels + stage) * 10
+            wh = robot_only.rewards_model.get_wh_batch(healths[:, None], times[None, :], info.threat_level,
+                                                       info.site_idx)
+            threat_level = info.threat_level if stage == 0 else info.prior_threat_level
+            value_0, value_1 = robot_only.get_stage_values(info.threat_level, threat_level, wh, next_values)
+            next_values = np.where(value_0 >= value_1, value_0, value_1)
+            self.values[stage] = next_values
+            self.actions[stage] = (value_0 < value_1).astype(np.int8)
+
+    def get_index(self, health, time):
+        health_level = self.get_level(health, self.max_health)
+        time_level = self.get_level(time, self.max_time)
+        if health_level is None or time_level is None:
+            return None
+        return self.num_health_levels - 1 - health_level, self.num_time_levels - 1 - time_level
+
+    def get_action(self, info: RobotInfo) -> float | None:
+        """Returns the action at the current site, or None if the state is not on the grid"""
+        index = self.get_index(info.health, info.time)
+        if index is None:
+            return None
+        return float(self.actions[0][index])
+
+
+class GlobalPolicyCache:
+    """
+    An LRU cache of global policies by the keys of their model inputs, which can be shared by the robots
+    """
+
+    def __init__(self, max_size: int = CACHE_SIZE):
+        self.max_size = max_size
+        self.policies = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        # The robots of a run may share the cache from the threads of a pool
+        self.lock = threading.Lock()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['lock']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            policy = self.policies.get(key)
+            if policy is None:
+                self.misses += 1
+                return None
+            self.policies.move_to_end(key)
+            self.hits += 1
+            return policy
+
+    def put(self, key, policy):
+        with self.lock:
+            self.policies[key] = policy
+            if len(self.policies) > self.max_size:
+                self.policies.popitem(last=False)
+
+    def __len__(self):
+        return len(self.policies)
@@ -1,8 +1,10 @@
 from classes.RewardModels import RewardModelBase
 from classes.TrustModels import BetaDistributionModel
 from classes.DecisionModels import BoundedRationalityDisuse
-from classes.ParamsUpdater import Estimator
+from classes.ParamsUpdater import Estimator, ParticleEstimator
 from classes.State import HumanInfo, Observation
+from classes.CommonRandomNumbers import CommonRandomNumbers
+from classes.Serialization import get_state, set_state
 
 
 class Human:
@@ -21,12 +23,27 @@ class Human:
         self.decision_model = decision_model
         self.reward_model = reward_model
 
+    def __getstate__(self):
+        # The estimator of a human model is only needed to continue a run
+        return get_state(self, rng_attributes=(), slim_drop=('trust_model_updater',))
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=())
+
     def forward(self, info: HumanInfo, obs: Observation):
         """
         Updates the human after seeing the observation
         """
         self.update_trust(info, obs, self.reward_model.get_wh(info))
 
+    def use_common_random_numbers(self, crn: CommonRandomNumbers):
+        """
+        Draws the decisions and trust samples of this human from the common random numbers of the participant
+        :param crn: the common random numbers shared by all copies of the participant
+        """
+        self.trust_model.use_common_random_numbers(crn)
+        self.decision_model.use_common_random_numbers(crn)
+
     def update_trust(self, info: HumanInfo, obs: Observation, wh: float):
         """Update trust based on immediate observed reward
         :param info: the information available to the human at the time of decision-making
@@ -60,9 +77,48 @@ class HumanModel(Human):
     after getting trust feedback from the simulated human
     """
     def __init__(self, trust_model: BetaDistributionModel, decision_model: BoundedRationalityDisuse,
-                 reward_model: RewardModelBase):
+                 reward_model: RewardModelBase, estimator: Estimator | ParticleEstimator | None = None):
+        """
+        :param estimator: the estimator of the trust parameters (default: Estimator, the maximum likelihood estimate
+                          over the whole feedback history)
+        """
         super().__init__(trust_model, decision_model, reward_model)
-        self.trust_model_updater = Estimator()
+        self.trust_model_updater = Estimator() if estimator is None else estimator
+        self.sites_without_feedback = 0
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=(), defaults={'sites_without_feedback': 0})
 
     def update_trust_model(self, trust_feedback: float, performance: int):
         self.trust_model.parameters = self.trust_model_updater.update_model(trust_feedback, performance)
+        self.sites_without_feedback = 0
+
+    def add_performance(self, performance: int):
+        """
+        Counts the performance at a site where no trust feedback was queried, without refitting the trust parameters
+        """
+        self.trust_model_updater.add_performance(performance)
+        self.sites_without_feedback += 1
+
+    def get_sites_without_feedback(self) -> int:
+        """Returns the number of sites since the last trust feedback"""
+        return self.sites_without_feedback
+
+    def get_trust_uncertainty(self) -> float:
+        """
+        Returns the standard deviation of the predicted trust. With a particle estimator it is the spread of the
+        mean trust over the posterior of the parameters, otherwise the spread of the beta distribution of trust
+        """
+        if isinstance(self.trust_model_updater, ParticleEstimator):
+            return self.trust_model_updater.get_trust_uncertainty()
+        alpha, beta = float(self.trust_model.alpha), float(self.trust_model.beta)
+        return (alpha * beta / ((alpha + beta) ** 2 * (alpha + beta + 1))) ** 0.5
+
+    def get_parameter_uncertainty(self):
+        """
+        Returns the standard deviation of the estimated trust parameters, or None if the estimator gives point
+        estimates only
+        """
+        if isinstance(self.trust_model_updater, ParticleEstimator):
+            return self.trust_model_updater.get_uncertainty()
+        return None
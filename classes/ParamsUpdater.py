@@ -1,8 +1,10 @@
 import numpy as np
-from scipy.special import digamma, loggamma
-from scipy.optimize import minimize
-from classes.TrustModels import BetaDistributionModel
-from classes.PerformanceMetrics import ObservedReward
+from numpy.random import default_rng
+from classes.Serialization import get_state, set_state
+from classes.SpecialFunctions import loggamma, digamma, betaln
+
+# Bounds of the trust parameters [alpha0, beta0, ws, wf]
+BOUNDS = ((1, 200), (1, 200), (0.1, 200), (0.1, 200))
 
 
 class Estimator:
@@ -19,6 +21,15 @@ class Estimator:
         self.trust_feedback = []
         self.perf_history = []
 
+    def add_performance(self, performance: int):
+        """
+        Counts the performance at a site where no trust feedback was queried. The parameters are refit at the next
+        feedback
+        :param performance: the performance of the recommendation at the current trial
+        """
+        self.trust_feedback.append(None)
+        self.perf_history.append(performance)
+
     def update_model(self, trust: float, performance: int):
 
         """
@@ -27,14 +38,15 @@ class Estimator:
         :param performance: the performance of the recommendation at the current trial
         """
 
+        # The optimizer is imported on first use to keep scipy out of the import of the simulation core
+        from scipy.optimize import minimize
+
         self.trust_feedback.append(trust)
         self.perf_history.append(performance)
         x0 = np.ones((4,), dtype=float)
         fun = lambda x: self.neg_log_likelihood(x, self.trust_feedback, self.perf_history)
         grad = lambda x: self.gradients(x, self.trust_feedback, self.perf_history)
-        bnds = ((1, 200), (1, 200), (0.1, 200), (0.1, 200))
-
-        res = minimize(fun, x0, jac=grad, method='SLSQP', bounds=bnds)
+        res = minimize(fun, x0, jac=grad, method='SLSQP', bounds=BOUNDS)
         return res.x
 
     @staticmethod
@@ -52,6 +64,8 @@ class Estimator:
         for i, (t, p) in enumerate(zip(trust_history, perf_history)):
             alpha += p * ws
             beta += (1 - p) * wf
+            if t is None:
+                continue
             t = max(min(t, 0.99), 0.01)
             logl += (loggamma(alpha + beta) - loggamma(alpha) - loggamma(beta) + (alpha - 1) * np.log(t) +
                      (beta - 1) * np.log(1. - t))
@@ -74,6 +88,8 @@ class Estimator:
             # We need to add the number of successes and failures regardless of whether feedback was queried or not
             ns += perf_history[i]
             nf += (1 - perf_history[i])
+            if trust_history[i] is None:
+                continue
 
             alpha = alpha0 + ns * ws
             beta = beta0 + nf * wf
@@ -91,3 +107,100 @@ class Estimator:
             grads[3] += nf * delta_beta
 
         return -grads
+
+
+class ParticleEstimator:
+    """
+    Estimates the trust parameters with a particle filter over [alpha0, beta0, ws, wf] within BOUNDS.
+    Each trust feedback costs one likelihood update of the particles and, when the weights degenerate, a resampling
+    step, so the cost per site does not grow with the length of the history
+    """
+
+    def __init__(self, num_particles: int = 2000, jitter: float = 0.05, seed: int | None = None):
+        """
+        :param num_particles: the number of particles (default: 2000)
+        :param jitter: the standard deviation of the noise added to the log of the parameters after resampling
+        :param seed: the seed for the random number generator (default: None)
+        """
+        self.num_particles = num_particles
+        self.jitter = jitter
+        self.rng = default_rng(seed)
+        self.lower = np.array([b[0] for b in BOUNDS], dtype=float)
+        self.upper = np.array([b[1] for b in BOUNDS], dtype=float)
+
+        # Log-uniform prior within the bounds
+        self.particles = np.exp(self.rng.uniform(np.log(self.lower), np.log(self.upper),
+                                                 size=(num_particles, 4)))
+        self.log_weights = np.zeros((num_particles,), dtype=float)
+        self.num_successes = 0
+        self.num_failures = 0
+
+    def __getstate__(self):
+        return get_state(self)
+
+    def __setstate__(self, state):
+        set_state(self, state)
+
+    @property
+    def weights(self) -> np.ndarray:
+        w = np.exp(self.log_weights - self.log_weights.max())
+        return w / w.sum()
+
+    def add_performance(self, performance: int):
+        """
+        Counts the performance at a site where no trust feedback was queried
+        :param performance: the performance of the recommendation at the current trial
+        """
+        self.num_successes += performance
+        self.num_failures += (1 - performance)
+
+    def update_model(self, trust: float, performance: int):
+        """
+        Function to get the updated list of trust parameters
+        :param trust: the trust feedback given by the human after observing the outcome
+        :param performance: the performance of the recommendation at the current trial
+        """
+        self.add_performance(performance)
+
+        alpha = self.particles[:, 0] + self.num_successes * self.particles[:, 2]
+        beta = self.particles[:, 1] + self.num_failures * self.particles[:, 3]
+        t = max(min(trust, 0.99), 0.01)
+        self.log_weights += (alpha - 1) * np.log(t) + (beta - 1) * np.log(1. - t) - betaln(alpha, beta)
+        self.log_weights -= self.log_weights.max()
+
+        weights = self.weights
+        effective_sample_size = 1. / np.sum(weights ** 2)
+        if effective_sample_size < self.num_particles / 2:
+            self.resample(weights)
+
+        return self.get_estimate()
+
+    def resample(self, weights: np.ndarray):
+        """
+        Systematic resampling followed by a small jitter in log space to keep the particles diverse
+        """
+        positions = (self.rng.uniform() + np.arange(self.num_particles)) / self.num_particles
+        indices = np.minimum(np.searchsorted(np.cumsum(weights), positions), self.num_particles - 1)
+        log_particles = np.log(self.particles[indices])
+        log_particles += self.rng.normal(scale=self.jitter, size=log_particles.shape)
+        self.particles = np.clip(np.exp(log_particles), self.lower, self.upper)
+        self.log_weights = np.zeros((self.num_particles,), dtype=float)
+
+    def get_estimate(self) -> np.ndarray:
+        """Returns the posterior mean of the trust parameters"""
+        return self.weights @ self.particles
+
+    def get_uncertainty(self) -> np.ndarray:
+        """Returns the posterior standard deviation of the trust parameters"""
+        weights = self.weights
+        mean = weights @ self.particles
+        return np.sqrt(weights @ (self.particles - mean) ** 2)
+
+    def get_trust_uncertainty(self) -> float:
+        """Returns the posterior standard deviation of the mean trust at the current numbers of successes and failures"""
+        alpha = self.particles[:, 0] + self.num_successes * self.particles[:, 2]
+        beta = self.particles[:, 1] + self.num_failures * self.particles[:, 3]
+        trust_means = alpha / (alpha + beta)
+        weights = self.weights
+        mean = weights @ trust_means
+        return float(np.sqrt(weights @ (trust_means - mean) ** 2))
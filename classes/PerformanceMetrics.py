@@ -1,3 +1,4 @@
+import numpy as np
 from classes.State import HumanInfo, Observation
 
 
@@ -20,6 +21,19 @@ class PerformanceMetricBase:
         """
         raise NotImplementedError
 
+    def get_performance_batch(self, recommendation: np.ndarray, threat: np.ndarray, threat_level: np.ndarray,
+                              wh: np.ndarray) -> np.ndarray:
+        """
+        Computes the performance of the recommendations for a population of humans.
+        Classes inheriting from this base class should implement this function
+        :param recommendation: the recommendations given to the humans
+        :param threat: the presence of threats observed by the humans
+        :param threat_level: the threat levels available to the humans at the time of decision-making
+        :param wh: the health reward weights of the humans
+        :return: an integer array with the performance of each recommendation
+        """
+        raise NotImplementedError
+
 
 class ObservedReward(PerformanceMetricBase):
 
@@ -44,6 +58,14 @@ class ObservedReward(PerformanceMetricBase):
 
         return int(reward_for_recommended_action >= reward_for_other_action)
 
+    def get_performance_batch(self, recommendation: np.ndarray, threat: np.ndarray, threat_level: np.ndarray,
+                              wh: np.ndarray) -> np.ndarray:
+        wc = 1 - wh
+        reward_for_recommended_action = -wh * threat * (1 - recommendation) - wc * recommendation
+        reward_for_other_action = -wh * threat * recommendation - wc * (1 - recommendation)
+
+        return (reward_for_recommended_action >= reward_for_other_action).astype(int)
+
 
 class ImmediateExpectedReward(PerformanceMetricBase):
 
@@ -67,3 +89,11 @@ class ImmediateExpectedReward(PerformanceMetricBase):
         reward_for_other_action = -wh * info.threat_level * info.recommendation - wc * (1 - info.recommendation)
 
         return int(reward_for_recommended_action >= reward_for_other_action)
+
+    def get_performance_batch(self, recommendation: np.ndarray, threat: np.ndarray, threat_level: np.ndarray,
+                              wh: np.ndarray) -> np.ndarray:
+        wc = 1 - wh
+        reward_for_recommended_action = -wh * threat_level * (1 - recommendation) - wc * recommendation
+        reward_for_other_action = -wh * threat_level * recommendation - wc * (1 - recommendation)
+
+        return (reward_for_recommended_action >= reward_for_other_action).astype(int)
@@ -1,9 +1,16 @@
+import hashlib
 import pickle
 import os
-import pandas as pd
+from functools import lru_cache
 import numpy as np
-from scipy.special import expit
 from classes.State import HumanInfo
+from classes.SpecialFunctions import expit
+from classes.Serialization import get_state, set_state
+
+MODELS_DIRECTORY = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models'))
+MODEL_PATH = os.path.join(MODELS_DIRECTORY, 'model_hc.pkl')
+SCALER_PATH = os.path.join(MODELS_DIRECTORY, 'scaler.pkl')
+ARTIFACT_PATH = os.path.join(MODELS_DIRECTORY, 'reward_model.npz')
 
 
 class RewardModelBase:
@@ -21,6 +28,23 @@ class RewardModelBase:
         """
         raise NotImplementedError
 
+    def get_wh_batch(self, health: np.ndarray, time: np.ndarray, threat_level: float, site_idx: int) -> np.ndarray:
+        """
+        Returns the health reward weights of a grid of states, broadcasting the health against the time.
+        The default calls get_wh for every state
+        """
+        health, time = np.broadcast_arrays(health, time)
+        wh = np.empty(health.shape, dtype=float)
+        for idx in np.ndindex(health.shape):
+            wh[idx] = self.get_wh(HumanInfo(health[idx], time[idx], threat_level, -1, site_idx))
+        return wh
+
+    def get_key(self):
+        """
+        Returns a hashable key that identifies the weights given by this model, or None if they are random
+        """
+        return None
+
 
 class ConstantWeights(RewardModelBase):
 
@@ -38,35 +62,152 @@ class ConstantWeights(RewardModelBase):
 
         return self.wh
 
+    def get_wh_batch(self, health: np.ndarray, time: np.ndarray, threat_level: float, site_idx: int) -> np.ndarray:
+        return np.full(np.broadcast_shapes(np.shape(health), np.shape(time)), self.wh, dtype=float)
+
+    def get_key(self):
+        return 'constant', self.wh
+
+
+def get_artifact_hash(params: np.ndarray, mean: np.ndarray, scale: np.ndarray) -> str:
+    """
+    Returns the sha256 hash of the contents of a reward model artifact
+    """
+    data = np.concatenate([params, mean, scale]).astype('<f8')
+    return hashlib.sha256(data.tobytes()).hexdigest()
+
+
+def export_reward_model(model_path: str = MODEL_PATH, scaler_path: str = SCALER_PATH,
+                        artifact_path: str = ARTIFACT_PATH) -> str:
+    """
+    Converts the pickled statsmodels OLSResults and scikit-learn StandardScaler to a plain array artifact
+    :param model_path: The path to a pickle saved statsmodels OLSResults object
+    :param scaler_path: The path to a pickle saved scipy StandardScaler object
+    :param artifact_path: The path to save the npz artifact to
+    :return: the hash of the artifact contents
+    """
+    with open(model_path, 'rb') as f:
+        ols_results = pickle.load(f)
+    with open(scaler_path, 'rb') as f:
+        scaler = pickle.load(f)
+
+    params = np.asarray(ols_results.params, dtype=float)
+    mean = np.asarray(scaler.mean_, dtype=float)
+    scale = np.asarray(scaler.scale_, dtype=float)
+    artifact_hash = get_artifact_hash(params, mean, scale)
+    np.savez(artifact_path, params=params, mean=mean, scale=scale, sha256=np.array(artifact_hash))
+
+    return artifact_hash
+
+
+@lru_cache(maxsize=16)
+def read_artifact(artifact_path: str, mtime_ns: int):
+    """
+    Reads and checks a reward model artifact. Artifacts are cached, since every copy of a model reloads it
+    :param artifact_path: the absolute path of the artifact
+    :param mtime_ns: the modification time of the file, so that a changed file is read again
+    :return: the read-only params, mean and scale arrays and the hash
+    """
+    with np.load(artifact_path, allow_pickle=False) as artifact:
+        params = artifact['params']
+        mean = artifact['mean']
+        scale = artifact['scale']
+        artifact_hash = str(artifact['sha256'])
+    if get_artifact_hash(params, mean, scale) != artifact_hash:
+        raise ValueError(f"The contents of {artifact_path} do not match its hash")
+    for array in [params, mean, scale]:
+        array.setflags(write=False)
+    return params, mean, scale, artifact_hash
+
+
+def get_artifact_reference(artifact_path: str) -> str:
+    """Returns the path of an artifact relative to MODELS_DIRECTORY if it is in there, so that runs can be moved"""
+    artifact_path = os.path.abspath(artifact_path)
+    if os.path.dirname(artifact_path) == MODELS_DIRECTORY:
+        return os.path.basename(artifact_path)
+    return artifact_path
+
+
+def resolve_artifact_reference(reference: str) -> str:
+    return os.path.join(MODELS_DIRECTORY, reference) if not os.path.isabs(reference) else reference
+
 
 class StateDependentWeights(RewardModelBase):
 
-    def __init__(self, model_path: str | None = None, scaler_path: str | None = None, add_noise: bool = False):
+    def __init__(self, model_path: str | None = None, scaler_path: str | None = None, add_noise: bool = False,
+                 artifact_path: str | None = None, use_pickles: bool = False):
         """
+        The weights are loaded from the plain array artifact unless the pickles are asked for
         :param model_path: The path to a pickle saved statsmodels OLSResults object (default: None)
         :param scaler_path: The path to a pickle saved scipy StandardScaler object (default: None)
+        :param add_noise: whether to add noise to the weights (default: False)
+        :param artifact_path: The path to the npz artifact made by export_reward_model (default: None)
+        :param use_pickles: whether to load the pickles rather than the artifact. Implied when model_path or
+                            scaler_path is given (default: False)
         """
         super().__init__()
 
-        # load the model
-        self.model_path = model_path
-        if model_path is None:
-            self.model_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models', 'model_hc.pkl'))
-        with open(self.model_path, 'rb') as f:
-            self.ols_results = pickle.load(f)
-
-        # load the scaler
-        self.scaler_path = scaler_path
-        if scaler_path is None:
-            self.scaler_path = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'models', 'scaler.pkl'))
-        with open(self.scaler_path, 'rb') as f:
-            self.scaler = pickle.load(f)
+        self.model_path = None
+        self.scaler_path = None
+        self.artifact_path = None
+        if use_pickles or model_path is not None or scaler_path is not None:
+            self.model_path = MODEL_PATH if model_path is None else model_path
+            self.scaler_path = SCALER_PATH if scaler_path is None else scaler_path
+            self.load_pickles()
+        else:
+            self.artifact_path = ARTIFACT_PATH if artifact_path is None else artifact_path
+            self.load_artifact()
 
         self.add_noise = add_noise
         self.rng = None
         if self.add_noise:
             self.rng = np.random.default_rng(seed=None)
 
+    def load_artifact(self):
+        artifact_path = os.path.abspath(self.artifact_path)
+        self.params, self.mean, self.scale, self.hash = read_artifact(artifact_path,
+                                                                      os.stat(artifact_path).st_mtime_ns)
+
+    def load_pickles(self):
+        with open(self.model_path, 'rb') as f:
+            ols_results = pickle.load(f)
+        with open(self.scaler_path, 'rb') as f:
+            scaler = pickle.load(f)
+        self.params = np.asarray(ols_results.params, dtype=float)
+        self.mean = np.asarray(scaler.mean_, dtype=float)
+        self.scale = np.asarray(scaler.scale_, dtype=float)
+        self.hash = get_artifact_hash(self.params, self.mean, self.scale)
+
+    def __getstate__(self):
+        state = get_state(self)
+        if self.artifact_path is not None:
+            # The weights are stored by reference to the artifact. Models loaded from the pickles keep their weights,
+            # since loading the pickles needs statsmodels and scikit-learn
+            for name in ['params', 'mean', 'scale']:
+                del state[name]
+            state['artifact_path'] = get_artifact_reference(self.artifact_path)
+        return state
+
+    def __setstate__(self, state):
+        if 'ols_results' in state:
+            # Models saved before the weights were stored as plain arrays
+            state = dict(state)
+            ols_results = state.pop('ols_results')
+            scaler = state.pop('scaler')
+            state['params'] = np.asarray(ols_results.params, dtype=float)
+            state['mean'] = np.asarray(scaler.mean_, dtype=float)
+            state['scale'] = np.asarray(scaler.scale_, dtype=float)
+            state['hash'] = get_artifact_hash(state['params'], state['mean'], state['scale'])
+            state['artifact_path'] = None
+        set_state(self, state, defaults={'model_path': None, 'scaler_path': None, 'artifact_path': None})
+        if 'params' not in self.__dict__:
+            expected_hash = self.hash
+            self.artifact_path = resolve_artifact_reference(self.artifact_path)
+            self.load_artifact()
+            if self.hash != expected_hash:
+                raise ValueError(f"The reward model artifact {self.artifact_path} has changed since the model "
+                                 f"was saved")
+
     def get_wh(self, info: HumanInfo) -> float:
         """
         :param info: the information available to the human at the time of decision-making
@@ -75,9 +216,9 @@ class StateDependentWeights(RewardModelBase):
         health = info.health / 100.
         time = info.time / 100.
         x_arr = np.array([health, time], dtype=float).reshape((1, 2))
-        x_scaled = (x_arr - self.scaler.mean_) / self.scaler.scale_
+        x_scaled = (x_arr - self.mean) / self.scale
         x_scaled_with_constant = np.insert(x_scaled, 0, 1., axis=1)
-        y = x_scaled_with_constant @ self.ols_results.params
+        y = x_scaled_with_constant @ self.params
         wh = expit(y)
         wh = wh.item()
 
@@ -86,3 +227,8 @@ class StateDependentWeights(RewardModelBase):
             wh = max(0.501, wh)
 
         return wh
+
+    def get_key(self):
+        if self.add_noise:
+            return None
+        return 'state_dependent', self.hash
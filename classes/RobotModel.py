@@ -1,8 +1,55 @@
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy, deepcopy
+from time import perf_counter
+from typing import List
 import numpy as np
 from classes.RewardModels import RewardModelBase
 from classes.HumanModels import HumanModel
 from classes.SimSettings import SimSettings
 from classes.State import RobotInfo, Observation, HumanInfo
+from classes.TerminalValues import TerminalValueBase, ZeroTerminalValue
+from classes.Serialization import get_state, set_state
+from classes.GlobalPolicy import RobotGlobalPolicy, RobotOnlyGlobalPolicy
+
+
+class DPWorkspace:
+    """
+    The value buffers of two consecutive stages of the backward induction, reused from one solve to the next and
+    grown to the largest horizon seen, and the thread pool of stage-parallel solves. Both are dropped when the
+    owner is pickled or copied. The array solvers of Robot also compute the values of a stage in the dtype of the
+    buffers, the cell-by-cell solvers only store them in it
+    """
+
+    def __init__(self, dtype=np.float64):
+        self.dtype = np.dtype(dtype)
+        self.buffers = None
+        self.executor = None
+        # The number of threads the executor was created with
+        self.executor_threads = None
+
+    def get_buffers(self, horizon: int, ndim: int):
+        """
+        Returns the buffers of the current and the next stage, each at least (horizon + 1,) * ndim.
+        Only the region a solve writes to is valid, the rest holds values of earlier solves
+        """
+        size = horizon + 1
+        if self.buffers is None or self.buffers[0].ndim != ndim or self.buffers[0].shape[0] < size:
+            self.buffers = [np.zeros((size,) * ndim, dtype=self.dtype) for _ in range(2)]
+        return self.buffers
+
+    def get_executor(self, num_threads: int) -> ThreadPoolExecutor:
+        if self.executor is None or self.executor_threads != num_threads:
+            if self.executor is not None:
+                self.executor.shutdown(wait=False)
+            self.executor = ThreadPoolExecutor(max_workers=num_threads)
+            self.executor_threads = num_threads
+        return self.executor
+
+    def __getstate__(self):
+        return {'dtype': self.dtype, 'buffers': None, 'executor': None, 'executor_threads': None}
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=(), defaults={'executor_threads': None})
 
 
 class RobotOnly:
@@ -11,34 +58,123 @@ class RobotOnly:
     """
 
     def __init__(self, reward_model: RewardModelBase,
-                 settings: SimSettings):
+                 settings: SimSettings, lookahead: int | None = None,
+                 terminal_value: TerminalValueBase | None = None, dtype=np.float64):
         """
         :param reward_model: the rewards model to be used
         :param settings: the simulation settings
+        :param lookahead: the number of sites to plan over (default: None, to the end of the mission)
+        :param terminal_value: the estimate of the value of the sites beyond the lookahead (default: zero)
+        :param dtype: the dtype the values are stored in. The values of a stage are still computed in float64 and
+                      rounded when stored, so np.float32 halves the memory of the solver but does not speed it up
+                      (default: np.float64)
         """
         self.rewards_model = reward_model
         self.settings = settings
         self.num_sites = settings.num_sites
+        self.lookahead = lookahead
+        self.terminal_value = ZeroTerminalValue() if terminal_value is None else terminal_value
+        self.workspace = DPWorkspace(dtype)
+        # Optional GlobalPolicyCache of the policies of whole missions, looked up instead of solving every query
+        self.policy_cache = None
+        # Optional SurrogateRecommender that answers the queries it is confident about instead of solving them
+        self.surrogate = None
+
+    def get_horizon(self, info: RobotInfo) -> int:
+        number_of_sites_to_go = self.settings.num_sites - info.site_idx
+        if self.lookahead is None:
+            return number_of_sites_to_go
+        return min(self.lookahead, number_of_sites_to_go)
 
     def choose_action(self, info: RobotInfo):
         """
         Chooses an action based on the information available
         :param info: the information available to the robot while choosing an action
         """
-        num_sites = self.settings.num_sites
-        current_idx = info.site_idx
-        number_of_sites_to_go = num_sites - current_idx
-        value_matrix = np.zeros((
-            number_of_sites_to_go + 1,  # stages
-            number_of_sites_to_go + 1,  # possible health
-            number_of_sites_to_go + 1  # possible time
-        ))
-
-        action_matrix = np.zeros((
-            number_of_sites_to_go,
-            number_of_sites_to_go,
-            number_of_sites_to_go
-        ))
+        if self.surrogate is not None:
+            action = self.surrogate.get_action(self, info)
+            if action is not None:
+                return action
+        action = self.lookup_global_policy(info)
+        if action is not None:
+            return action
+        return self.solve(info, self.get_horizon(info))
+
+    def get_policy_key(self, info: RobotInfo):
+        """
+        Returns a hashable key of the inputs of the global policy that covers this query, or None if the query
+        has to be solved on its own (noisy reward weights, a truncated lookahead, or float32 values)
+        """
+        reward_key = self.rewards_model.get_key()
+        if (reward_key is None or self.get_horizon(info) < self.settings.num_sites - info.site_idx or
+                self.workspace.dtype != np.float64):
+            return None
+        return ('robot_only', self.settings.num_sites - info.site_idx, info.site_idx, float(info.threat_level),
+                float(info.prior_threat_level), self.settings.df, reward_key)
+
+    def lookup_global_policy(self, info: RobotInfo) -> float | None:
+        """
+        Returns the action from the global policy of the query's model inputs, solving the policy if it is not in
+        the policy cache, or None without a policy cache or a policy that covers the query
+        """
+        if self.policy_cache is None:
+            return None
+        key = self.get_policy_key(info)
+        if key is None:
+            return None
+        policy = self.policy_cache.get(key)
+        if policy is None:
+            policy = RobotOnlyGlobalPolicy(self, info)
+            self.policy_cache.put(key, policy)
+        return policy.get_action(info)
+
+    def get_stage_values(self, reward_threat_level: float, threat_level: float, wh: np.ndarray,
+                         next_values: np.ndarray):
+        """
+        Returns the values of the two actions over a block of [health, time] states of a stage, with the same
+        arithmetic as solve
+        :param reward_threat_level: the threat level of the one-step rewards
+        :param threat_level: the threat level of the transitions
+        :param wh: the health reward weights of the block
+        :param next_values: the values of the next stage, one health and time beyond the block
+        :return: (value_0, value_1) the arrays of values of the two actions
+        """
+        num_healths, num_times = wh.shape
+        wc = 1 - wh
+        reward_0 = -wh * reward_threat_level
+        reward_1 = -wc
+        value_0 = (reward_0 +
+                   self.settings.df * (threat_level * next_values[1:num_healths + 1, :num_times] +
+                                       (1 - threat_level) * next_values[:num_healths, :num_times]))
+        value_1 = (reward_1 +
+                   self.settings.df * next_values[:num_healths, 1:num_times + 1])
+        return value_0, value_1
+
+    def get_value_matrix(self, info: RobotInfo, horizon: int) -> np.ndarray:
+        """
+        Returns the values of all the states reachable within the horizon, indexed [stage, health, time]
+        """
+        value_matrix = np.zeros((horizon + 1,) * 3, dtype=self.workspace.dtype)
+        self.solve(info, horizon, value_matrix)
+        return value_matrix
+
+    def solve(self, info: RobotInfo, number_of_sites_to_go: int, value_matrix: np.ndarray | None = None) -> float:
+        """
+        Solves for the action at the current site by backward induction over the next number_of_sites_to_go sites
+        :param value_matrix: an optional array of shape (number_of_sites_to_go + 1,) * 3 to store the values of
+                             every stage in (default: None)
+        :return: the action
+        """
+        # Only the values of the current stage and the next one are kept
+        values, next_values = self.workspace.get_buffers(number_of_sites_to_go, 2)
+        next_values[:number_of_sites_to_go + 1, :number_of_sites_to_go + 1] = 0.
+        if number_of_sites_to_go < self.settings.num_sites - info.site_idx:
+            next_values[:number_of_sites_to_go + 1, :number_of_sites_to_go + 1] = \
+                self.terminal_value.get_robot_only_values(self, info, number_of_sites_to_go)
+        if value_matrix is not None:
+            value_matrix[number_of_sites_to_go] = next_values[:number_of_sites_to_go + 1,
+                                                              :number_of_sites_to_go + 1]
+        action = 0.
 
         for stage in reversed(range(number_of_sites_to_go)):
             possible_health = info.health - np.arange(stage + 1) * 10
@@ -57,45 +193,266 @@ class RobotOnly:
                         threat_level = info.threat_level
 
                     value_0 = (reward_0 +
-                               self.settings.df * (threat_level * value_matrix[stage + 1, health_idx + 1, time_idx] +
-                                                   (1 - threat_level) * value_matrix[stage + 1, health_idx, time_idx]))
+                               self.settings.df * (threat_level * next_values[health_idx + 1, time_idx] +
+                                                   (1 - threat_level) * next_values[health_idx, time_idx]))
                     value_1 = (reward_1 +
-                               self.settings.df * value_matrix[stage + 1, health_idx, time_idx + 1])
+                               self.settings.df * next_values[health_idx, time_idx + 1])
 
                     if value_0 >= value_1:
-                        value_matrix[stage, health_idx, time_idx] = value_0
-                        action_matrix[stage, health_idx, time_idx] = 0
+                        values[health_idx, time_idx] = value_0
+                        action = 0.
                     else:
-                        value_matrix[stage, health_idx, time_idx] = value_1
-                        action_matrix[stage, health_idx, time_idx] = 1
+                        values[health_idx, time_idx] = value_1
+                        action = 1.
 
-        return action_matrix[0, 0, 0]
+            if value_matrix is not None:
+                value_matrix[stage, :stage + 1, :stage + 1] = values[:stage + 1, :stage + 1]
+            values, next_values = next_values, values
+
+        # The last action chosen is the one at the current site, at stage 0
+        return action
 
 
 class Robot:
 
     def __init__(self, human_model: HumanModel,
                  reward_model: RewardModelBase,
-                 settings: SimSettings):
+                 settings: SimSettings, lookahead: int | None = None,
+                 terminal_value: TerminalValueBase | None = None, dtype=np.float64,
+                 num_threads: int | None = None):
+        """
+        :param human_model: the robot's model of the human
+        :param reward_model: the rewards model to be used
+        :param settings: the simulation settings
+        :param lookahead: the number of sites to plan over (default: None, to the end of the mission)
+        :param terminal_value: the estimate of the value of the sites beyond the lookahead (default: zero)
+        :param dtype: the dtype of the values. With num_threads, and in solve_strategies, the stages are computed in
+                      this dtype, so np.float32 halves the memory traffic of the array arithmetic but may flip a
+                      recommendation whose two values are within float32 rounding of each other. The cell-by-cell
+                      solve computes in float64 and only stores the values in this dtype (default: np.float64)
+        :param num_threads: when given, every stage is solved with array arithmetic, split over this many threads
+                            (default: None, solve cell by cell)
+        """
         self.recommendation = None
+        self.num_threads = num_threads
+        self.lookahead = lookahead
+        self.terminal_value = ZeroTerminalValue() if terminal_value is None else terminal_value
+        self.workspace = DPWorkspace(dtype)
         self.human_model = human_model
         self.reward_model = reward_model
         self.settings = settings
+        # Optional dict from the solve key of a state to its recommendation, shared to avoid repeated solves
+        self.recommendation_cache = None
+        # Optional GlobalPolicyCache of the policies of whole missions, shared to look recommendations up instead
+        # of solving every query
+        self.policy_cache = None
+        # Optional SurrogateRecommender that answers the queries it is confident about instead of solving them
+        self.surrogate = None
+        # Optional time budget of a recommendation in seconds. Without one, every recommendation is solved exactly
+        self.time_budget = None
+        # The tier that made the last recommendation ('cache', 'surrogate', 'exact', 'lookahead' or 'myopic') and
+        # its horizon
+        self.last_tier = None
+        self.last_horizon = None
+        self.tier_history = []
+
+    def __getstate__(self):
+        # The caches are shared with other robots, so they are not saved with this one
+        return get_state(self, rng_attributes=(), drop=('recommendation_cache', 'policy_cache'))
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=(),
+                  defaults={'lookahead': None, 'terminal_value': ZeroTerminalValue(), 'workspace': DPWorkspace(),
+                            'num_threads': None, 'recommendation_cache': None, 'policy_cache': None,
+                            'surrogate': None, 'time_budget': None,
+                            'last_tier': None, 'last_horizon': None, 'tier_history': []})
+
+    def get_horizon(self, info: RobotInfo) -> int:
+        """Returns the number of sites the robot plans over at this site"""
+        num_houses_to_go = self.settings.num_sites - info.site_idx
+        if self.lookahead is None:
+            return num_houses_to_go
+        return min(self.lookahead, num_houses_to_go)
+
+    def get_solve_key(self, info: RobotInfo):
+        """
+        Returns a hashable key of all the inputs that determine the recommendation at this state,
+        or None if the recommendation cannot be reused (e.g. with noisy reward weights)
+        :param info: the information available to the robot when making a recommendation
+        """
+        reward_key = self.reward_model.get_key()
+        if reward_key is None:
+            return None
+        trust_model = self.human_model.trust_model
+        decision_model = self.human_model.decision_model
+        key = (self.settings.num_sites - info.site_idx, info.health, info.time, float(info.threat_level),
+               float(info.prior_threat_level), self.settings.df,
+               float(trust_model.alpha), float(trust_model.beta),
+               float(trust_model.parameters[2]), float(trust_model.parameters[3]),
+               decision_model.kappa, decision_model.hl, decision_model.tc, reward_key)
+        if self.get_horizon(info) < self.settings.num_sites - info.site_idx:
+            key += (self.lookahead, self.terminal_value.get_key())
+        if self.workspace.dtype != np.float64:
+            key += (self.workspace.dtype.name,)
+        return key
 
-    def get_recommendation(self, info: RobotInfo):
+    def get_policy_key(self, info: RobotInfo):
+        """
+        Returns a hashable key of the inputs of the global policy that covers this query, or None if the query
+        has to be solved on its own (noisy reward weights, a truncated lookahead, or float32 values).
+        Unlike the solve key, it leaves out the health, time, and threat level at the current site
+        """
+        reward_key = self.reward_model.get_key()
+        if (reward_key is None or self.get_horizon(info) < self.settings.num_sites - info.site_idx or
+                self.workspace.dtype != np.float64):
+            return None
+        trust_model = self.human_model.trust_model
+        decision_model = self.human_model.decision_model
+        # The lookahead only uses alpha, through the preserved beta = _alpha + nf * vf of _solve, but beta is in the
+        # key too so that fixing that cannot serve a policy to robots with other failure counts
+        return ('robot', self.settings.num_sites - info.site_idx, float(info.prior_threat_level), self.settings.df,
+                float(trust_model.alpha), float(trust_model.beta),
+                float(trust_model.parameters[2]), float(trust_model.parameters[3]),
+                decision_model.kappa, decision_model.hl, decision_model.tc, reward_key)
+
+    def lookup_global_policy(self, info: RobotInfo, solve: bool = True) -> int | None:
+        """
+        Returns the recommendation from the global policy of the query's model inputs, or None without a policy
+        cache or a policy that covers the query
+        :param info: the information available to the robot when making a recommendation
+        :param solve: whether to solve the policy if it is not in the policy cache (default: True)
+        """
+        if self.policy_cache is None:
+            return None
+        key = self.get_policy_key(info)
+        if key is None:
+            return None
+        policy = self.policy_cache.get(key)
+        if policy is None:
+            if not solve:
+                return None
+            policy = RobotGlobalPolicy(self, self.settings.num_sites - info.site_idx, info.prior_threat_level)
+            self.policy_cache.put(key, policy)
+        return policy.get_recommendation(self, info)
+
+    def get_recommendation(self, info: RobotInfo, time_budget: float | None = None):
         """
         Generates a recommendation from the information the robot has
         :param info: the information available to the robot when making a recommendation
+        :param time_budget: the time in seconds within which to return (default: the robot's time_budget).
+                            Without a budget, the recommendation is always solved exactly
         """
-        num_houses_to_go = self.settings.num_sites - info.site_idx
-        value_matrix = np.zeros((num_houses_to_go + 1,  # stages
-                                 num_houses_to_go + 1,  # success/failure
-                                 num_houses_to_go + 1,  # health
-                                 num_houses_to_go + 1), dtype=float)  # time
-        action_matrix = np.zeros((num_houses_to_go,
-                                  num_houses_to_go,
-                                  num_houses_to_go,
-                                  num_houses_to_go), dtype=int)
+        if time_budget is None:
+            time_budget = self.time_budget
+        start = perf_counter()
+
+        key = None
+        if self.recommendation_cache is not None:
+            key = self.get_solve_key(info)
+            if key is not None and key in self.recommendation_cache:
+                self.recommendation = self.recommendation_cache[key]
+                self.__set_tier('cache', self.get_horizon(info), start)
+                return self.recommendation
+
+        if self.surrogate is not None:
+            recommendation = self.surrogate.get_recommendation(self, info)
+            if recommendation is not None:
+                self.recommendation = recommendation
+                self.__set_tier('surrogate', self.get_horizon(info), start)
+                return self.recommendation
+
+        if time_budget is None:
+            self.recommendation = self.solve(info)
+            self.__set_tier('exact', self.get_horizon(info), start)
+        else:
+            self.recommendation, tier, horizon = self.solve_anytime(info, start + time_budget)
+            self.__set_tier(tier, horizon, start)
+            if tier != 'exact':
+                return self.recommendation
+
+        if key is not None:
+            self.recommendation_cache[key] = self.recommendation
+
+        return self.recommendation
+
+    def __set_tier(self, tier: str, horizon: int, start: float):
+        self.last_tier = tier
+        self.last_horizon = horizon
+        self.tier_history.append((tier, horizon, perf_counter() - start))
+
+    def get_myopic_recommendation(self, info: RobotInfo) -> int:
+        """
+        Recommends to use the RARV when the threat level is above the d* = wc / wh threshold of the reward weights
+        at the current state, ignoring the future sites and the human's trust
+        """
+        wh = self.reward_model.get_wh(HumanInfo(info.health, info.time, info.threat_level, -1, info.site_idx))
+        return int(wh * info.threat_level >= 1 - wh)
+
+    def solve_anytime(self, info: RobotInfo, deadline: float):
+        """
+        Returns the best recommendation found before the deadline. Starting from the myopic recommendation,
+        lookaheads over 1, 2, 4, ... sites are solved until the robot's horizon is solved exactly or the next
+        lookahead would not finish in time
+        :param info: the information available to the robot when making a recommendation
+        :param deadline: the perf_counter time by which to return
+        :return: the recommendation, the tier that made it, and the horizon of that tier
+        """
+        num_houses_to_go = self.get_horizon(info)
+        # A global policy solved by an earlier query answers exactly at no cost
+        recommendation = self.lookup_global_policy(info, solve=False)
+        if recommendation is not None:
+            return recommendation, 'exact', num_houses_to_go
+        recommendation, tier, horizon = self.get_myopic_recommendation(info), 'myopic', 0
+
+        next_horizon = 1
+        while True:
+            start = perf_counter()
+            lookahead = self._solve(info, next_horizon, deadline)
+            if lookahead is None:
+                break
+            elapsed = perf_counter() - start
+            recommendation, horizon = lookahead, next_horizon
+            tier = 'exact' if horizon == num_houses_to_go else 'lookahead'
+            if horizon == num_houses_to_go:
+                break
+
+            next_horizon = min(2 * horizon, num_houses_to_go)
+            # The cost of a solve grows as the fourth power of its horizon
+            if perf_counter() + elapsed * (next_horizon / horizon) ** 4 > deadline:
+                break
+
+        return recommendation, tier, horizon
+
+    def solve(self, info: RobotInfo) -> int:
+        """
+        Solves for the optimal recommendation by backward induction over the remaining sites, or over the
+        lookahead when the robot has one. With a policy cache, the recommendation is looked up in the global policy
+        of the mission instead
+        :param info: the information available to the robot when making a recommendation
+        """
+        recommendation = self.lookup_global_policy(info)
+        if recommendation is not None:
+            return recommendation
+        return self._solve(info, self.get_horizon(info))
+
+    def _solve(self, info: RobotInfo, num_houses_to_go: int, deadline: float | None = None) -> int | None:
+        """
+        Solves for the optimal recommendation by backward induction over the next num_houses_to_go sites
+        :param info: the information available to the robot when making a recommendation
+        :param num_houses_to_go: the horizon of the lookahead. The sites beyond it are valued by the terminal value
+        :param deadline: the perf_counter time at which to give up (default: None)
+        :return: the recommendation, or None if the deadline passed
+        """
+        if self.num_threads is not None and self.reward_model.get_key() is not None:
+            return self._solve_parallel(info, num_houses_to_go, deadline)
+
+        # Only the values of the current stage and the next one are kept, indexed [success/failure, health, time]
+        size = num_houses_to_go + 1
+        values, next_values = self.workspace.get_buffers(num_houses_to_go, 3)
+        next_values[:size, :size, :size] = 0.
+        if num_houses_to_go < self.settings.num_sites - info.site_idx:
+            next_values[:size, :size, :size] = self.terminal_value.get_robot_values(self, info, num_houses_to_go)
+        action = 0
         current_health = info.health
         current_time = info.time
 
@@ -115,6 +472,8 @@ class Robot:
                 threat_level = info.threat_level
 
             for i, (ns, nf) in enumerate(zip(possible_successes, possible_failures)):
+                if deadline is not None and perf_counter() > deadline:
+                    return None
                 alpha = _alpha + ns * vs
                 beta = _alpha + nf * vf
                 trust = alpha / (alpha + beta)
@@ -133,13 +492,13 @@ class Robot:
                         # Future discounted value for recommending to not use the RARV
                         value_0 = (reward_0 +
                                    # Trust gain, no Health loss, no time loss
-                                   df * prob_0 * (1 - threat_level) * value_matrix[stage + 1, i, j, k] +
+                                   df * prob_0 * (1 - threat_level) * next_values[i, j, k] +
                                    # Trust gain, no Health loss, time loss
-                                   df * prob_1 * threat_level * value_matrix[stage + 1, i, j, k + 1] +
+                                   df * prob_1 * threat_level * next_values[i, j, k + 1] +
                                    # Trust loss, no Health loss, time loss
-                                   df * prob_1 * (1 - threat_level) * value_matrix[stage + 1, i + 1, j, k + 1] +
+                                   df * prob_1 * (1 - threat_level) * next_values[i + 1, j, k + 1] +
                                    # Trust loss, Health loss, no time loss
-                                   df * prob_0 * threat_level * value_matrix[stage + 1, i + 1, j + 1, k])
+                                   df * prob_0 * threat_level * next_values[i + 1, j + 1, k])
 
                         # Computations for recommending to use the RARV
                         fake_human_info.recommendation = 1
@@ -148,34 +507,155 @@ class Robot:
                         reward_1 = -wh * threat_level * prob_0 - wc * prob_1
                         value_1 = (reward_1 +
                                    # Trust gain, no Health loss, no time loss
-                                   df * prob_0 * (1 - threat_level) * value_matrix[stage + 1, i, j, k] +
+                                   df * prob_0 * (1 - threat_level) * next_values[i, j, k] +
                                    # Trust gain, no Health loss, time loss
-                                   df * prob_1 * threat_level * value_matrix[stage + 1, i, j, k + 1] +
+                                   df * prob_1 * threat_level * next_values[i, j, k + 1] +
                                    # Trust loss, no Health loss, time loss
-                                   df * prob_1 * (1 - threat_level) * value_matrix[stage + 1, i + 1, j, k + 1] +
+                                   df * prob_1 * (1 - threat_level) * next_values[i + 1, j, k + 1] +
                                    # Trust loss, Health loss, no time loss
-                                   df * prob_0 * threat_level * value_matrix[stage + 1, i + 1, j + 1, k])
+                                   df * prob_0 * threat_level * next_values[i + 1, j + 1, k])
 
                         if value_0 > value_1:
-                            value_matrix[stage, i, j, k] = value_0
-                            action_matrix[stage, i, j, k] = 0
+                            values[i, j, k] = value_0
+                            action = 0
                         else:
-                            value_matrix[stage, i, j, k] = value_1
-                            action_matrix[stage, i, j, k] = 1
+                            values[i, j, k] = value_1
+                            action = 1
 
-        self.recommendation = action_matrix[0, 0, 0, 0]
-        return self.recommendation
+            values, next_values = next_values, values
+
+        # The last action chosen is the one at the current site, at stage 0
+        return action
+
+    def _solve_parallel(self, info: RobotInfo, num_houses_to_go: int, deadline: float | None = None) -> int | None:
+        """
+        The same backward induction as _solve, with every stage computed as arrays. The trust rows of a stage are
+        split into slabs that are solved in parallel threads, since the cells of a stage only depend on the next
+        stage. The arithmetic is done in the same order as in _solve, so the recommendations are identical
+        """
+        size = num_houses_to_go + 1
+        values, next_values = self.workspace.get_buffers(num_houses_to_go, 3)
+        next_values[:size, :size, :size] = 0.
+        if num_houses_to_go < self.settings.num_sites - info.site_idx:
+            next_values[:size, :size, :size] = self.terminal_value.get_robot_values(self, info, num_houses_to_go)
+        executor = self.workspace.get_executor(self.num_threads)
+        dtype = self.workspace.dtype
+        action = 0
+
+        for stage in reversed(range(num_houses_to_go)):
+            if deadline is not None and perf_counter() > deadline:
+                return None
+            n = stage + 1
+            # The inputs of the stage are cast to the dtype of the workspace, so that the stage is computed in it
+            trust = self.get_stage_trust(stage).astype(dtype)[:, None, None]
+            possible_healths = info.health - np.arange(n) * 10
+            possible_times = info.time + np.arange(n) * 10
+
+            threat_level = info.prior_threat_level
+            if stage == 0:
+                threat_level = info.threat_level
+            wh = self.reward_model.get_wh_batch(possible_healths[:, None], possible_times[None, :], threat_level,
+                                                stage).astype(dtype)
+            threat_level = dtype.type(threat_level)
+
+            def solve_slab(start: int, end: int):
+                value_0, value_1 = self.get_stage_values(threat_level, trust[start:end], wh,
+                                                         next_values[start:end + 1, :n + 1, :n + 1])
+                values[start:end, :n, :n] = np.where(value_0 > value_1, value_0, value_1)
+                return int(value_0[0, 0, 0] <= value_1[0, 0, 0])
+
+            num_slabs = min(self.num_threads, n)
+            bounds = np.linspace(0, n, num_slabs + 1).astype(int)
+            # Waiting for all the slabs is the barrier between stages
+            actions = list(executor.map(solve_slab, bounds[:-1], bounds[1:]))
+            action = actions[0]
+            values, next_values = next_values, values
+
+        return action
+
+    def solve_strategies(self, info: RobotInfo, reward_models: List[RewardModelBase],
+                         trust_parameters: List | None = None) -> List[int]:
+        """
+        Solves the recommendations of several strategies at the same state together, see solve_stacked
+        :param info: the information available to the robot when making a recommendation
+        :param reward_models: the reward model of every strategy
+        :param trust_parameters: the trust parameters [alpha0, beta0, ws, wf] of every strategy, applied to the
+                                 successes and failures seen so far. None, or a None entry, keeps the parameters of
+                                 this robot's trust model (default: None)
+        :return: the recommendation of every strategy, the same as solve would give
+        """
+        if trust_parameters is None:
+            trust_parameters = [None] * len(reward_models)
+        if len(trust_parameters) != len(reward_models):
+            raise ValueError("There must be one set of trust parameters per reward model")
+        robots = []
+        for reward_model, parameters in zip(reward_models, trust_parameters):
+            robot = copy(self)
+            robot.reward_model = reward_model
+            if parameters is not None:
+                trust_model = deepcopy(self.human_model.trust_model)
+                trust_model.update_parameters(parameters)
+                robot.human_model = HumanModel(trust_model, self.human_model.decision_model,
+                                               self.human_model.reward_model, self.human_model.trust_model_updater)
+            robots.append(robot)
+        return solve_stacked(robots, info)
+
+    def get_stage_trust(self, stage: int) -> np.ndarray:
+        """Returns the trust of the human model after each number of successes of a stage of the lookahead"""
+        trust_model = self.human_model.trust_model
+        possible_successes = np.arange(stage + 1)
+        possible_failures = stage - possible_successes
+        _alpha = trust_model.alpha
+        vs = trust_model.parameters[2]
+        vf = trust_model.parameters[3]
+        alpha = _alpha + possible_successes * vs
+        beta = _alpha + possible_failures * vf
+        return alpha / (alpha + beta)
+
+    def get_stage_values(self, threat_level: float, trust: np.ndarray, wh: np.ndarray, next_values: np.ndarray):
+        """
+        Returns the values of recommending not to use and to use the RARV over a block of states of a stage,
+        with the same arithmetic as _solve. The arrays may have leading axes, e.g. the strategies of solve_stacked
+        :param threat_level: the threat level at the sites of the stage
+        :param trust: the trust of the rows of the block, of shape (..., rows, 1, 1)
+        :param wh: the health reward weights of the block's [health, time] cells, of shape (..., healths, times)
+        :param next_values: the values of the next stage, one row, health and time beyond the block
+        :return: (value_0, value_1) the arrays of values of the two recommendations
+        """
+        decision_model = self.human_model.decision_model
+        df = self.settings.df
+        num_rows, num_healths, num_times = trust.shape[-3], wh.shape[-2], wh.shape[-1]
+        wc = 1 - wh
+        # The values of the next stage for the four outcomes, as in _solve
+        v_stay = next_values[..., :num_rows, :num_healths, :num_times]
+        v_time = next_values[..., :num_rows, :num_healths, 1:num_times + 1]
+        v_loss_time = next_values[..., 1:num_rows + 1, :num_healths, 1:num_times + 1]
+        v_loss_health = next_values[..., 1:num_rows + 1, 1:num_healths + 1, :num_times]
+        stage_values = []
+        for recommendation in [0, 1]:
+            prob_0, prob_1 = decision_model.get_prob_of_actions_batch(recommendation, threat_level, trust, wh)
+            reward = -wh * threat_level * prob_0 - wc * prob_1
+            stage_values.append(reward +
+                                df * prob_0 * (1 - threat_level) * v_stay +
+                                df * prob_1 * threat_level * v_time +
+                                df * prob_1 * (1 - threat_level) * v_loss_time +
+                                df * prob_0 * threat_level * v_loss_health)
+        return stage_values[0], stage_values[1]
 
     def forward(self, info: RobotInfo, obs: Observation):
         """Updates the robot model after seeing the observations.
-        The observations must include the trust feedback received from the human"""
+        Without trust feedback in the observations, only the performance is counted and the trust parameters are
+        refit at the next feedback"""
         # Steps: 1. Update human model
         #        2. Update human trust model
         fake_human_info = HumanInfo(info.health, info.time, info.threat_level, self.recommendation, info.site_idx)
         wh = self.reward_model.get_wh(fake_human_info)
         self.human_model.update_trust(fake_human_info, obs, wh)
         perf = self.human_model.trust_model.performance_metric.get_performance(fake_human_info, obs, wh)
-        self.human_model.update_trust_model(obs.trust_feedback, perf)
+        if obs.trust_feedback is None:
+            self.human_model.add_performance(perf)
+        else:
+            self.human_model.update_trust_model(obs.trust_feedback, perf)
 
         if obs.threat == 1:
             if obs.action_chosen == 0:
@@ -184,3 +664,55 @@ class Robot:
         if obs.action_chosen == 1:
             info.time -= 10
             info.time = max(0, info.time)           # Make sure it is not negative
+
+
+def solve_stacked(robots: List[Robot], info: RobotInfo) -> List[int]:
+    """
+    Solves the recommendations of several robots at the same state in one backward induction, with the robots along
+    a leading strategy axis of the value arrays. The robots may differ in their reward models, trust models and
+    terminal values, and share the settings, the horizon and the decision model parameters. The states, threat
+    levels and buffers of a stage are shared by all the strategies, and the arithmetic is that of _solve, so the
+    recommendations are identical to solving every robot on its own
+    :param robots: the robots of the strategies
+    :param info: the information available to the robots when making a recommendation
+    :return: the recommendation of every robot
+    """
+    robot = robots[0]
+    horizon = robot.get_horizon(info)
+    decision_params = lambda r: (r.human_model.decision_model.kappa, r.human_model.decision_model.hl,
+                                 r.human_model.decision_model.tc)
+    for other in robots:
+        if other.reward_model.get_key() is None:
+            raise ValueError("Reward models with noisy weights cannot be solved together")
+        if (other.get_horizon(info) != horizon or other.settings.df != robot.settings.df or
+                other.workspace.dtype != robot.workspace.dtype or decision_params(other) != decision_params(robot)):
+            raise ValueError("The robots must share the horizon, discount factor, dtype and decision model")
+
+    size = horizon + 1
+    dtype = robot.workspace.dtype
+    next_values = np.zeros((len(robots), size, size, size), dtype=dtype)
+    values = np.zeros_like(next_values)
+    if horizon < robot.settings.num_sites - info.site_idx:
+        for s, other in enumerate(robots):
+            next_values[s] = other.terminal_value.get_robot_values(other, info, horizon)
+    actions = [0] * len(robots)
+
+    for stage in reversed(range(horizon)):
+        n = stage + 1
+        trust = np.stack([other.get_stage_trust(stage) for other in robots]).astype(dtype)[:, :, None, None]
+        possible_healths = info.health - np.arange(n) * 10
+        possible_times = info.time + np.arange(n) * 10
+
+        threat_level = info.prior_threat_level
+        if stage == 0:
+            threat_level = info.threat_level
+        wh = np.stack([other.reward_model.get_wh_batch(possible_healths[:, None], possible_times[None, :],
+                                                       threat_level, stage) for other in robots]).astype(dtype)[:, None]
+        threat_level = dtype.type(threat_level)
+
+        value_0, value_1 = robot.get_stage_values(threat_level, trust, wh, next_values[:, :n + 1, :n + 1, :n + 1])
+        values[:, :n, :n, :n] = np.where(value_0 > value_1, value_0, value_1)
+        actions = [int(v_0 <= v_1) for v_0, v_1 in zip(value_0[:, 0, 0, 0], value_1[:, 0, 0, 0])]
+        values, next_values = next_values, values
+
+    return actions
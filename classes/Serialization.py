@@ -0,0 +1,110 @@
+"""Helpers for the explicit pickled state of the simulation classes.
+
+Every state carries a version number. Random number generators are stored as the plain dict of their bit generator
+state instead of the Generator object, and can be left out altogether within slim_state(), e.g. when saving the
+results of a run that will not be continued:
+
+    with slim_state():
+        data = pickle.dumps(sim_runner)
+"""
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterable
+import numpy as np
+
+# The version of the pickled state of all the classes
+STATE_VERSION = 1
+
+_options = threading.local()
+
+
+@contextmanager
+def slim_state():
+    """
+    Within the context, pickled objects leave out what is only needed to continue a run: random number generator
+    states, shared caches and the state of the trust parameter estimators. Loaded objects get fresh generators
+    """
+    previous = is_slim()
+    _options.slim = True
+    try:
+        yield
+    finally:
+        _options.slim = previous
+
+
+def is_slim() -> bool:
+    return getattr(_options, 'slim', False)
+
+
+def pack_rng(rng: np.random.Generator | None) -> Dict | None:
+    if rng is None:
+        return None
+    if is_slim():
+        return {'bit_generator': None}
+    return {'bit_generator': type(rng.bit_generator).__name__, 'state': rng.bit_generator.state}
+
+
+def unpack_rng(state) -> np.random.Generator | None:
+    """
+    Rebuilds a generator from a packed state, or a fresh one if the state was left out.
+    Generators pickled as objects are returned as they are
+    """
+    if state is None or isinstance(state, np.random.Generator):
+        return state
+    if state['bit_generator'] is None:
+        return np.random.default_rng()
+    bit_generator = getattr(np.random, state['bit_generator'])()
+    bit_generator.state = state['state']
+    return np.random.Generator(bit_generator)
+
+
+def to_builtin(values):
+    """Converts a list of numpy scalars to a list of python scalars"""
+    return [v.item() if isinstance(v, np.generic) else v for v in values]
+
+
+def get_state(obj, rng_attributes: Iterable[str] = ('rng',), slim_drop: Iterable[str] = (),
+              drop: Iterable[str] = ()) -> Dict:
+    """
+    Returns the versioned state of an object from its __dict__
+    :param obj: the object
+    :param rng_attributes: the attributes that hold random number generators
+    :param slim_drop: the attributes set to None within slim_state()
+    :param drop: the attributes that are always set to None (e.g. shared caches)
+    """
+    state = dict(obj.__dict__)
+    for name in rng_attributes:
+        if name in state:
+            state[name] = pack_rng(state[name])
+    for name in drop:
+        if name in state:
+            state[name] = None
+    if is_slim():
+        for name in slim_drop:
+            if name in state:
+                state[name] = None
+    state['version'] = STATE_VERSION
+    return state
+
+
+def set_state(obj, state: Dict, rng_attributes: Iterable[str] = ('rng',), defaults: Dict | None = None):
+    """
+    Restores an object from a state of get_state, or from the __dict__ of a pickle made before the states were
+    versioned (version 0)
+    :param obj: the object
+    :param state: the pickled state
+    :param rng_attributes: the attributes that hold random number generators
+    :param defaults: the values of the attributes that older versions do not have
+    """
+    state = dict(state)
+    version = state.pop('version', 0)
+    if version > STATE_VERSION:
+        raise ValueError(f"{type(obj).__name__} was saved with state version {version}, "
+                         f"newer than the supported version {STATE_VERSION}")
+    for name in rng_attributes:
+        if name in state:
+            state[name] = unpack_rng(state[name])
+    if defaults is not None:
+        for name, value in defaults.items():
+            state.setdefault(name, value)
+    obj.__dict__.update(state)
@@ -5,12 +5,25 @@ from classes.RobotModel import Robot
 from classes.State import HumanInfo, RobotInfo, Observation
 from classes.SimSettings import SimSettings
 from classes.ThreatSetter import SmartThreatChooser
+from classes.Surrogate import SurrogateRecommender
+from classes.FeedbackSchedules import FeedbackScheduleBase
+from classes.Serialization import get_state, set_state, is_slim, to_builtin
 
 
 class Simulation:
     """Class for a single simulation"""
 
-    def __init__(self, settings: SimSettings, robot: Robot, human: Human, choose_smartly: bool = True):
+    def __init__(self, settings: SimSettings, robot: Robot, human: Human, choose_smartly: bool = True,
+                 seed: int | None = None, surrogate: SurrogateRecommender | None = None,
+                 feedback_schedule: FeedbackScheduleBase | None = None):
+        """
+        :param surrogate: when given, the robot takes the recommendations the surrogate is confident about from it
+                          and solves the others exactly (default: None, solve every recommendation)
+        :param feedback_schedule: the schedule of the sites after which the robot gets the human's trust feedback
+                                  (default: None, after every site)
+        """
+        if surrogate is not None:
+            robot.surrogate = surrogate
         self.settings = settings
         self.robot = robot
         self.human = human
@@ -22,14 +35,57 @@ class Simulation:
         self.trust_history = []
         self.threat_history = []
         self.threat_level_history = []
-        self.smc = SmartThreatChooser()
-        # self.rng = default_rng(seed=123)
-        self.rng = default_rng()
+        self.rng = default_rng(seed)
+        self.smc = SmartThreatChooser(self.rng.integers(2 ** 32))
         self.choose_smartly = choose_smartly
+        self.feedback_schedule = feedback_schedule
+        # Whether the robot got the trust feedback at each site. The trust history has the samples of all sites
+        self.feedback_history = []
+
+    def __getstate__(self):
+        state = get_state(self)
+        if is_slim():
+            for name in ['health_history', 'time_history', 'action_history', 'rec_history', 'trust_history',
+                         'feedback_history', 'threat_history', 'threat_level_history']:
+                state[name] = to_builtin(state[name])
+        return state
+
+    def __setstate__(self, state):
+        set_state(self, state, defaults={'feedback_schedule': None, 'feedback_history': []})
 
     def update_settings(self, settings: SimSettings):
         self.settings = settings
 
+    def choose_threat(self, site_idx: int, health: int, time: int):
+        """
+        Returns the threat and the threat level at a site. When choosing smartly, half of the sites get a threat
+        level between the d* of the two strategies
+        :param site_idx: the index of the site
+        :param health: the health remaining when reaching the site
+        :param time: the time remaining when reaching the site
+        """
+        temp_human_info = HumanInfo(health, time, 0, 0, site_idx)
+        wh = self.robot.reward_model.get_wh(temp_human_info)
+        threat = self.settings.threat_setter.threats[site_idx]
+        threat_level = self.settings.threat_setter.after_scan[site_idx]
+        if self.choose_smartly and self.rng.uniform() < 0.5:
+            threat, threat_level = self.smc.choose_threat_intelligently(0.8062, wh)
+
+        return threat, threat_level
+
+    def get_history(self):
+        """
+        Returns the histories of the simulation as a dict of lists
+        """
+        return {'health': list(self.health_history),
+                'time': list(self.time_history),
+                'threat': [int(t) for t in self.threat_history],
+                'threat_level': [float(d) for d in self.threat_level_history],
+                'recommendation': [int(r) for r in self.rec_history],
+                'action': [int(a) for a in self.action_history],
+                'trust': [float(t) for t in self.trust_history],
+                'feedback': [bool(f) for f in self.feedback_history]}
+
     def run(self):
         """
         Runs a simulation of the ISR mission for all sites
@@ -37,17 +93,10 @@ class Simulation:
         # Health and time are quantities remaining and decrease as the simulation goes on
         health = self.settings.start_health
         time = self.settings.start_time
-        after_scan = self.settings.threat_setter.after_scan
-        threats = self.settings.threat_setter.threats
         prior = self.settings.d
 
         for site_idx in range(self.settings.num_sites):
-            temp_human_info = HumanInfo(health, time, 0, 0, site_idx)
-            wh = self.robot.reward_model.get_wh(temp_human_info)
-            threat = threats[site_idx]
-            threat_level = after_scan[site_idx]
-            if self.choose_smartly and self.rng.uniform() < 0.5:
-                threat, threat_level = self.smc.choose_threat_intelligently(0.8062, wh)
+            threat, threat_level = self.choose_threat(site_idx, health, time)
 
             self.threat_history.append(threat)
             self.threat_level_history.append(threat_level)
@@ -68,8 +117,11 @@ class Simulation:
             # Get the trust sample
             trust_fb = self.human.get_trust_sample()
 
-            # Add it to the observation
-            obs.add_trust_feedback(trust_fb)
+            # Add it to the observation if the robot asks for it at this site
+            queried = (self.feedback_schedule is None or
+                       self.feedback_schedule.should_query(site_idx, self.robot.human_model))
+            if queried:
+                obs.add_trust_feedback(trust_fb)
 
             # Update the robot's model of the human
             self.robot.forward(robot_info, obs)
@@ -84,3 +136,4 @@ class Simulation:
             self.rec_history.append(rec)
             self.action_history.append(action)
             self.trust_history.append(trust_fb)
+            self.feedback_history.append(queried)
@@ -0,0 +1,37 @@
+# scipy.special is imported on first use to keep scipy out of the import of the simulation core, and the module is
+# kept so that the calls in the solvers and the estimators do not repeat the import
+_special = None
+
+
+def get_special():
+    """Returns the scipy.special module, imported on the first call"""
+    global _special
+    if _special is None:
+        import scipy.special
+        _special = scipy.special
+    return _special
+
+
+def expit(x):
+    """The logistic function"""
+    return get_special().expit(x)
+
+
+def loggamma(x):
+    """The log of the gamma function"""
+    return get_special().loggamma(x)
+
+
+def digamma(x):
+    """The derivative of the log of the gamma function"""
+    return get_special().digamma(x)
+
+
+def betaln(a, b):
+    """The log of the beta function"""
+    return get_special().betaln(a, b)
+
+
+def betaincinv(a, b, y):
+    """The inverse of the regularized incomplete beta function"""
+    return get_special().betaincinv(a, b, y)
@@ -0,0 +1,354 @@
+import hashlib
+import os
+from functools import lru_cache
+from typing import Dict, List
+import numpy as np
+from classes.RewardModels import ConstantWeights, StateDependentWeights, get_artifact_reference, \
+    resolve_artifact_reference
+from classes.State import HumanInfo, RobotInfo
+from classes.Serialization import get_state, set_state
+
+# The inputs of the surrogates of the two robots
+ROBOT_FEATURES = ['sites_to_go', 'health', 'time', 'threat_level', 'prior_threat_level', 'discount_factor',
+                  'alpha', 'vs', 'vf', 'wh', 'state_dependent', 'myopic_margin']
+ROBOT_ONLY_FEATURES = ['sites_to_go', 'health', 'time', 'threat_level', 'prior_threat_level', 'discount_factor',
+                       'wh', 'state_dependent', 'myopic_margin']
+# Queries with a smaller probability of the predicted action are solved exactly
+CONFIDENCE_THRESHOLD = 0.9
+
+
+class GradientBoostedTrees:
+    """
+    A binary classifier of gradient boosted regression trees on the log loss. The trees are complete binary trees
+    of a fixed depth stored as arrays, so that all of them are evaluated together. Splits are searched over the
+    quantile bins of the features. A sample goes right at a node if its feature is larger than the threshold
+    """
+
+    def __init__(self, num_trees: int = 100, depth: int = 5, learning_rate: float = 0.2, num_bins: int = 32,
+                 min_samples_leaf: int = 10, l2: float = 1.):
+        """
+        :param num_trees: the number of trees
+        :param depth: the depth of every tree
+        :param learning_rate: the factor of the leaf values
+        :param num_bins: the number of quantile bins of every feature that splits are searched over
+        :param min_samples_leaf: the smallest number of training samples on either side of a split
+        :param l2: the L2 regularization of the leaf values
+        """
+        self.num_trees = num_trees
+        self.depth = depth
+        self.learning_rate = learning_rate
+        self.num_bins = num_bins
+        self.min_samples_leaf = min_samples_leaf
+        self.l2 = l2
+        self.base_margin = 0.
+        # The split of node i of tree t is features[t, i], thresholds[t, i]. Its children are 2i + 1 and 2i + 2
+        self.features = np.zeros((0, 2 ** depth - 1), dtype=np.int64)
+        self.thresholds = np.zeros((0, 2 ** depth - 1))
+        self.leaves = np.zeros((0, 2 ** depth))
+
+    def fit(self, x: np.ndarray, y: np.ndarray):
+        """
+        :param x: the features of the samples, of shape (num_samples, num_features)
+        :param y: the labels of the samples, 0 or 1
+        """
+        x = np.asarray(x, dtype=float)
+        y = np.asarray(y, dtype=float)
+        num_samples, num_features = x.shape
+        quantiles = np.linspace(0, 1, self.num_bins + 1)[1:-1]
+        edges = [np.unique(np.quantile(x[:, f], quantiles)) for f in range(num_features)]
+        num_bins = max(len(e) for e in edges) + 1
+        # The bin of a value is the number of edges below it, so bin > k if and only if the value > edges[k]
+        binned = np.stack([np.searchsorted(edges[f], x[:, f], side='left') for f in range(num_features)], axis=1)
+
+        mean = np.clip(y.mean(), 1e-6, 1 - 1e-6)
+        self.base_margin = float(np.log(mean / (1 - mean)))
+        margin = np.full(num_samples, self.base_margin)
+        self.features = np.zeros((self.num_trees, 2 ** self.depth - 1), dtype=np.int64)
+        self.thresholds = np.full((self.num_trees, 2 ** self.depth - 1), np.inf)
+        self.leaves = np.zeros((self.num_trees, 2 ** self.depth))
+        samples = np.arange(num_samples)
+
+        for t in range(self.num_trees):
+            p = 1 / (1 + np.exp(-margin))
+            g = p - y
+            h = p * (1 - p)
+            node = np.zeros(num_samples, dtype=np.int64)
+            for level in range(self.depth):
+                num_nodes = 2 ** level
+                total_g = np.bincount(node, g, minlength=num_nodes)[:, None]
+                total_h = np.bincount(node, h, minlength=num_nodes)[:, None]
+                total_count = np.bincount(node, minlength=num_nodes)[:, None]
+                best_gain = np.zeros(num_nodes)
+                best_feature = np.zeros(num_nodes, dtype=np.int64)
+                # Nodes without a split send all their samples left
+                best_bin = np.full(num_nodes, num_bins)
+                for f in range(num_features):
+                    idx = node * num_bins + binned[:, f]
+                    size = num_nodes * num_bins
+                    left_g = np.cumsum(np.bincount(idx, g, minlength=size).reshape(num_nodes, num_bins), axis=1)
+                    left_h = np.cumsum(np.bincount(idx, h, minlength=size).reshape(num_nodes, num_bins), axis=1)
+                    left_count = np.cumsum(np.bincount(idx, minlength=size).reshape(num_nodes, num_bins), axis=1)
+                    right_g, right_h = total_g - left_g, total_h - left_h
+                    gain = (left_g ** 2 / (left_h + self.l2) + right_g ** 2 / (right_h + self.l2) -
+                            total_g ** 2 / (total_h + self.l2))
+                    gain[(left_count < self.min_samples_leaf) |
+                         (total_count - left_count < self.min_samples_leaf)] = -np.inf
+                    gain[:, len(edges[f]):] = -np.inf
+                    k = np.argmax(gain, axis=1)
+                    node_gain = gain[np.arange(num_nodes), k]
+                    better = node_gain > best_gain
+                    best_gain[better] = node_gain[better]
+                    best_feature[better] = f
+                    best_bin[better] = k[better]
+
+                for i in range(num_nodes):
+                    heap_idx = num_nodes - 1 + i
+                    self.features[t, heap_idx] = best_feature[i]
+                    if best_bin[i] < num_bins:
+                        self.thresholds[t, heap_idx] = edges[best_feature[i]][best_bin[i]]
+                go_right = binned[samples, best_feature[node]] > best_bin[node]
+                node = 2 * node + go_right
+
+            num_leaves = 2 ** self.depth
+            leaf_g = np.bincount(node, g, minlength=num_leaves)
+            leaf_h = np.bincount(node, h, minlength=num_leaves)
+            self.leaves[t] = -self.learning_rate * leaf_g / (leaf_h + self.l2)
+            margin += self.leaves[t][node]
+
+        return self
+
+    def get_margin(self, x: np.ndarray) -> np.ndarray:
+        """Returns the log odds of label 1 of every sample"""
+        x = np.atleast_2d(np.asarray(x, dtype=float))
+        trees = np.arange(self.features.shape[0])
+        rows = np.arange(x.shape[0])[:, None]
+        node = np.zeros((x.shape[0], trees.shape[0]), dtype=np.int64)
+        for _ in range(self.depth):
+            node = 2 * node + 1 + (x[rows, self.features[trees, node]] > self.thresholds[trees, node])
+        return self.base_margin + self.leaves[trees, node - (2 ** self.depth - 1)].sum(axis=1)
+
+    def predict_proba(self, x: np.ndarray) -> np.ndarray:
+        """Returns the probability of label 1 of every sample"""
+        return 1 / (1 + np.exp(-self.get_margin(x)))
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        return {'depth': np.array(self.depth), 'base_margin': np.array(self.base_margin),
+                'features': self.features, 'thresholds': self.thresholds, 'leaves': self.leaves}
+
+    @classmethod
+    def from_arrays(cls, arrays: Dict[str, np.ndarray]):
+        features = arrays['features']
+        model = cls(num_trees=features.shape[0], depth=int(arrays['depth']))
+        model.base_margin = float(arrays['base_margin'])
+        model.features = features
+        model.thresholds = arrays['thresholds']
+        model.leaves = arrays['leaves']
+        return model
+
+
+def get_reward_features(reward_model, info: RobotInfo):
+    """Returns the health reward weight at the current state and whether the weights are state dependent"""
+    wh = reward_model.get_wh(HumanInfo(info.health, info.time, info.threat_level, -1, info.site_idx))
+    return wh, float(isinstance(reward_model, StateDependentWeights))
+
+
+def get_robot_features(robot, info: RobotInfo) -> np.ndarray:
+    """Returns the ROBOT_FEATURES of a Robot's query"""
+    wh, state_dependent = get_reward_features(robot.reward_model, info)
+    trust_model = robot.human_model.trust_model
+    return np.array([robot.settings.num_sites - info.site_idx, info.health, info.time, info.threat_level,
+                     info.prior_threat_level, robot.settings.df, trust_model.alpha, trust_model.parameters[2],
+                     trust_model.parameters[3], wh, state_dependent, wh * info.threat_level - (1 - wh)])
+
+
+def get_robot_only_features(robot_only, info: RobotInfo) -> np.ndarray:
+    """Returns the ROBOT_ONLY_FEATURES of a RobotOnly's query"""
+    wh, state_dependent = get_reward_features(robot_only.rewards_model, info)
+    return np.array([robot_only.settings.num_sites - info.site_idx, info.health, info.time, info.threat_level,
+                     info.prior_threat_level, robot_only.settings.df, wh, state_dependent,
+                     wh * info.threat_level - (1 - wh)])
+
+
+def is_trained_solver(robot) -> bool:
+    """Whether a Robot or RobotOnly solves like the training queries, to the end of the mission in float64"""
+    return robot.lookahead is None and robot.workspace.dtype == np.float64
+
+
+def get_surrogate_hash(arrays: Dict[str, np.ndarray]) -> str:
+    """Returns the sha256 hash of the arrays of a surrogate artifact"""
+    digest = hashlib.sha256()
+    for name in sorted(arrays):
+        digest.update(name.encode())
+        digest.update(np.ascontiguousarray(arrays[name]).tobytes())
+    return digest.hexdigest()
+
+
+@lru_cache(maxsize=16)
+def read_surrogate(artifact_path: str, mtime_ns: int):
+    """
+    Reads and checks a surrogate artifact. Artifacts are cached, since every copy of a robot reloads it
+    :param artifact_path: the absolute path of the artifact
+    :param mtime_ns: the modification time of the file, so that a changed file is read again
+    :return: the arrays of the artifact and its hash
+    """
+    with np.load(artifact_path, allow_pickle=False) as artifact:
+        arrays = {name: artifact[name] for name in artifact.files if name != 'sha256'}
+        artifact_hash = str(artifact['sha256'])
+    if get_surrogate_hash(arrays) != artifact_hash:
+        raise ValueError(f"The contents of {artifact_path} do not match its hash")
+    for array in arrays.values():
+        array.setflags(write=False)
+    return arrays, artifact_hash
+
+
+class SurrogateRecommender:
+    """
+    Predicts the exact recommendations of a Robot (kind 'robot') or actions of a RobotOnly (kind 'robot_only')
+    with a GradientBoostedTrees classifier. Queries where the probability of the predicted answer is below the
+    threshold, whose features are outside the range of the training queries, or whose robots or models the surrogate
+    was not trained for, are left to the exact solver
+    """
+
+    def __init__(self, model: GradientBoostedTrees, kind: str, threshold: float = CONFIDENCE_THRESHOLD,
+                 decision_params: List[float] | None = None, reward_hash: str | None = None,
+                 feature_min: np.ndarray | None = None, feature_max: np.ndarray | None = None):
+        """
+        :param model: the fitted classifier
+        :param kind: 'robot' or 'robot_only'
+        :param threshold: the smallest probability of the predicted answer to use it (default: CONFIDENCE_THRESHOLD)
+        :param decision_params: the [kappa, hl, tc] of the human models the Robot surrogate was trained with
+        :param reward_hash: the hash of the state dependent reward model it was trained with
+        :param feature_min: the smallest value of every feature of the training queries (default: None, no bound)
+        :param feature_max: the largest value of every feature of the training queries (default: None, no bound)
+        """
+        if kind not in ('robot', 'robot_only'):
+            raise ValueError(f"Unknown surrogate kind {kind}")
+        self.model = model
+        self.kind = kind
+        self.threshold = threshold
+        self.decision_params = None if decision_params is None else [float(p) for p in decision_params]
+        self.reward_hash = reward_hash
+        self.feature_min = None if feature_min is None else np.asarray(feature_min, dtype=float)
+        self.feature_max = None if feature_max is None else np.asarray(feature_max, dtype=float)
+        self.artifact_path = None
+        self.hash = None
+
+    def __getstate__(self):
+        # A surrogate read from an artifact is saved as a reference to it
+        if self.artifact_path is None:
+            return get_state(self, rng_attributes=())
+        return get_state(self, rng_attributes=(), drop=('model',))
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=(), defaults={'feature_min': None, 'feature_max': None})
+        if self.model is None:
+            expected_hash = self.hash
+            self.artifact_path = resolve_artifact_reference(self.artifact_path)
+            self.__load_model()
+            if self.hash != expected_hash:
+                raise ValueError(f"The surrogate artifact {self.artifact_path} has changed since it was saved")
+
+    def __load_model(self):
+        arrays, self.hash = read_surrogate(self.artifact_path, os.stat(self.artifact_path).st_mtime_ns)
+        self.model = GradientBoostedTrees.from_arrays(arrays)
+
+    @classmethod
+    def load(cls, artifact_path: str, threshold: float | None = None):
+        """
+        Loads a surrogate saved with save
+        :param threshold: overrides the saved confidence threshold (default: None)
+        """
+        artifact_path = os.path.abspath(artifact_path)
+        arrays, artifact_hash = read_surrogate(artifact_path, os.stat(artifact_path).st_mtime_ns)
+        reward_hash = str(arrays['reward_hash'])
+        surrogate = cls(GradientBoostedTrees.from_arrays(arrays), str(arrays['kind']),
+                        float(arrays['threshold']) if threshold is None else threshold,
+                        list(arrays['decision_params']) if arrays['decision_params'].size > 0 else None,
+                        reward_hash if reward_hash != '' else None,
+                        arrays.get('feature_min'), arrays.get('feature_max'))
+        surrogate.artifact_path = get_artifact_reference(artifact_path)
+        surrogate.hash = artifact_hash
+        return surrogate
+
+    def save(self, artifact_path: str) -> str:
+        """Saves the surrogate to a npz artifact and returns the hash of its contents"""
+        arrays = self.model.to_arrays()
+        arrays.update({'kind': np.array(self.kind), 'threshold': np.array(self.threshold),
+                       'decision_params': np.array(self.decision_params or [], dtype=float),
+                       'reward_hash': np.array(self.reward_hash or '')})
+        if self.feature_min is not None:
+            arrays.update({'feature_min': self.feature_min, 'feature_max': self.feature_max})
+        artifact_hash = get_surrogate_hash(arrays)
+        np.savez(artifact_path, sha256=np.array(artifact_hash), **arrays)
+        return artifact_hash
+
+    def is_applicable(self, reward_model, decision_model=None) -> bool:
+        """Whether the surrogate was trained for these models"""
+        if isinstance(reward_model, StateDependentWeights):
+            if reward_model.add_noise or reward_model.hash != self.reward_hash:
+                return False
+        elif not isinstance(reward_model, ConstantWeights):
+            return False
+        if decision_model is not None and self.decision_params is not None:
+            return [decision_model.kappa, decision_model.hl, decision_model.tc] == self.decision_params
+        return True
+
+    def is_in_range(self, x: np.ndarray) -> np.ndarray:
+        """
+        Returns whether the features of every query are within the range of the training queries, where the trees do
+        not extrapolate
+        """
+        x = np.atleast_2d(x)
+        if self.feature_min is None:
+            return np.ones(x.shape[0], dtype=bool)
+        return np.all((x >= self.feature_min) & (x <= self.feature_max), axis=1)
+
+    def predict(self, features: np.ndarray) -> int | None:
+        """
+        Returns the predicted answer, or None if the features are out of the training range or the probability of the
+        answer is below the threshold
+        """
+        if not self.is_in_range(features)[0]:
+            return None
+        p = float(self.model.predict_proba(features)[0])
+        if max(p, 1 - p) < self.threshold:
+            return None
+        return int(p >= 0.5)
+
+    def get_recommendation(self, robot, info: RobotInfo) -> int | None:
+        """Returns a Robot's recommendation, or None if it is left to the exact solver"""
+        if self.kind != 'robot' or not is_trained_solver(robot) or \
+                not self.is_applicable(robot.reward_model, robot.human_model.decision_model):
+            return None
+        return self.predict(get_robot_features(robot, info))
+
+    def get_action(self, robot_only, info: RobotInfo) -> float | None:
+        """Returns a RobotOnly's action, or None if it is left to the exact solver"""
+        if self.kind != 'robot_only' or not is_trained_solver(robot_only) or \
+                not self.is_applicable(robot_only.rewards_model):
+            return None
+        action = self.predict(get_robot_only_features(robot_only, info))
+        return None if action is None else float(action)
+
+    def evaluate(self, x: np.ndarray, y: np.ndarray, thresholds: List[float] | None = None) -> List[Dict]:
+        """
+        Measures the disagreement with the exact answers
+        :param x: the features of the queries
+        :param y: the exact answers
+        :param thresholds: the confidence thresholds to report (default: the surrogate's threshold)
+        :return: one row per threshold with the coverage (the fraction of queries answered by the surrogate, which
+                 are in the training range and at least as confident as the threshold) and
+                 the disagreement of the surrogate alone and of the surrogate with the exact fallback
+        """
+        p = self.model.predict_proba(x)
+        predicted = (p >= 0.5).astype(int)
+        confidence = np.maximum(p, 1 - p)
+        in_range = self.is_in_range(x)
+        y = np.asarray(y).astype(int)
+        rows = []
+        for threshold in [self.threshold] if thresholds is None else thresholds:
+            covered = (confidence >= threshold) & in_range
+            rows.append({'threshold': threshold, 'coverage': float(covered.mean()),
+                         'disagreement': float(np.mean(predicted != y)),
+                         'disagreement_with_fallback': float(np.mean((predicted != y) & covered))})
+        return rows
@@ -0,0 +1,166 @@
+import hashlib
+import json
+from typing import Dict, Tuple
+import numpy as np
+from classes.State import HumanInfo, RobotInfo
+
+
+class TerminalValueBase:
+    """
+    Base class for the estimate of the value of the sites beyond the horizon of a truncated lookahead.
+    State (j, k) at the horizon is j health losses and k time losses after the current state
+    """
+
+    def get_robot_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        """
+        Returns the values at the horizon of a Robot's lookahead
+        :param robot: the Robot that is planning
+        :param info: the information available to the robot at the current site
+        :param horizon: the number of sites in the lookahead
+        :return: an array of shape (horizon + 1,) * 3 indexed as the Robot's value matrix [trust, health, time]
+        """
+        raise NotImplementedError
+
+    def get_robot_only_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        """
+        Returns the values at the horizon of a RobotOnly's lookahead
+        :return: an array of shape (horizon + 1,) * 2 indexed as the RobotOnly's value matrix [health, time]
+        """
+        raise NotImplementedError
+
+    def get_key(self):
+        """Returns a hashable key of the estimate, for the solve keys of the robots"""
+        raise NotImplementedError
+
+
+class ZeroTerminalValue(TerminalValueBase):
+    """The sites beyond the horizon are worth nothing, as if the mission ended there"""
+
+    def get_robot_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        return np.zeros((horizon + 1,) * 3)
+
+    def get_robot_only_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        return np.zeros((horizon + 1,) * 2)
+
+    def get_key(self):
+        return 'zero',
+
+
+class MyopicTerminalValue(TerminalValueBase):
+    """
+    Every site beyond the horizon is worth the expected reward of the best recommendation at the prior threat level,
+    with the reward weights and trust of the state at the horizon
+    """
+
+    @staticmethod
+    def get_num_sites_left(robot, info: RobotInfo, horizon: int) -> int:
+        return robot.settings.num_sites - info.site_idx - horizon
+
+    @staticmethod
+    def get_discounted_sum(df: float, num_sites_left: int) -> float:
+        """The discounted number of sites left, sum_{n < num_sites_left} df^n"""
+        return float(sum(df ** n for n in range(num_sites_left)))
+
+    def get_robot_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        values = np.zeros((horizon + 1,) * 3)
+        num_sites_left = self.get_num_sites_left(robot, info, horizon)
+        if num_sites_left <= 0:
+            return values
+
+        scale = self.get_discounted_sum(robot.settings.df, num_sites_left)
+        threat_level = info.prior_threat_level
+        trust_model = robot.human_model.trust_model
+        decision_model = robot.human_model.decision_model
+        for i in range(horizon + 1):
+            # The trust of trust index i, as in the Robot's lookahead
+            alpha = trust_model.alpha + i * trust_model.parameters[2]
+            beta = trust_model.alpha + (horizon - i) * trust_model.parameters[3]
+            trust = alpha / (alpha + beta)
+            for j in range(horizon + 1):
+                for k in range(horizon + 1):
+                    human_info = HumanInfo(info.health - 10 * j, info.time - 10 * k, threat_level, -1,
+                                           info.site_idx + horizon)
+                    wh = robot.reward_model.get_wh(human_info)
+                    rewards = []
+                    for recommendation in [0, 1]:
+                        human_info.recommendation = recommendation
+                        prob_0, prob_1 = decision_model.get_prob_of_actions(human_info, trust, wh=wh)
+                        rewards.append(-wh * threat_level * prob_0 - (1 - wh) * prob_1)
+                    values[i, j, k] = scale * max(rewards)
+
+        return values
+
+    def get_robot_only_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        values = np.zeros((horizon + 1,) * 2)
+        num_sites_left = self.get_num_sites_left(robot, info, horizon)
+        if num_sites_left <= 0:
+            return values
+
+        scale = self.get_discounted_sum(robot.settings.df, num_sites_left)
+        for j in range(horizon + 1):
+            for k in range(horizon + 1):
+                human_info = HumanInfo(info.health - 10 * j, info.time - 10 * k, info.prior_threat_level, -1,
+                                       info.site_idx + horizon)
+                wh = robot.rewards_model.get_wh(human_info)
+                values[j, k] = scale * max(-wh * info.prior_threat_level, -(1 - wh))
+
+        return values
+
+    def get_key(self):
+        return 'myopic',
+
+
+class TableTerminalValue(TerminalValueBase):
+    """
+    Looks the values up in a precomputed table from (sites left, health, time) to the value of the state.
+    The values do not depend on trust. States that are not in the table are worth the default value
+    """
+
+    def __init__(self, table: Dict[Tuple[int, int, int], float], default: float = 0.):
+        """
+        :param table: a dict from (number of sites left, health, time) to the value of the state
+        :param default: the value of the states that are not in the table (default: 0)
+        """
+        self.table = {(int(n), int(h), int(t)): float(v) for (n, h, t), v in table.items()}
+        self.default = default
+        items = sorted(self.table.items())
+        self.hash = hashlib.sha256(json.dumps([items, default]).encode()).hexdigest()
+
+    @classmethod
+    def from_robot_only(cls, robot_only, start_health: int, start_time: int, prior_threat_level: float):
+        """
+        Builds the table from the exact values of a full-horizon RobotOnly mission, which are the values of
+        every state reachable from the start state when every recommendation is followed
+        :param robot_only: the RobotOnly with the reward model and settings to tabulate
+        """
+        num_sites = robot_only.settings.num_sites
+        info = RobotInfo(start_health, start_time, prior_threat_level, prior_threat_level, 0)
+        value_matrix = robot_only.get_value_matrix(info, num_sites)
+        table = {}
+        for stage in range(1, num_sites + 1):
+            for j in range(stage + 1):
+                for k in range(stage + 1):
+                    table[(num_sites - stage, start_health - 10 * j, start_time - 10 * k)] = \
+                        value_matrix[stage, j, k]
+        return cls(table)
+
+    def get_value(self, num_sites_left: int, health: int, time: int) -> float:
+        if num_sites_left <= 0:
+            return 0.
+        return self.table.get((num_sites_left, int(health), int(time)), self.default)
+
+    def get_robot_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        num_sites_left = robot.settings.num_sites - info.site_idx - horizon
+        values = np.array([[self.get_value(num_sites_left, info.health - 10 * j, info.time - 10 * k)
+                            for k in range(horizon + 1)]
+                           for j in range(horizon + 1)])
+        return np.broadcast_to(values, (horizon + 1,) * 3).copy()
+
+    def get_robot_only_values(self, robot, info: RobotInfo, horizon: int) -> np.ndarray:
+        num_sites_left = robot.settings.num_sites - info.site_idx - horizon
+        return np.array([[self.get_value(num_sites_left, info.health - 10 * j, info.time - 10 * k)
+                          for k in range(horizon + 1)]
+                         for j in range(horizon + 1)])
+
+    def get_key(self):
+        return 'table', self.hash
@@ -1,5 +1,6 @@
 import numpy as np
 from numpy.random import default_rng
+from classes.Serialization import get_state, set_state
 
 
 class ThreatSetter:
@@ -25,6 +26,17 @@ class ThreatSetter:
 
         self.seed = seed
 
+    def __getstate__(self):
+        state = get_state(self)
+        # The repeated prior is rebuilt from the single one
+        del state['prior']
+        return state
+
+    def __setstate__(self, state):
+        set_state(self, state)
+        if 'prior' not in self.__dict__:
+            self.prior = np.ones((self.N,), dtype=float) * self.prior_single
+
     def set_threats(self):
         """
         Sets all threat levels (prior levels, after scan levels, threat presence)
@@ -76,6 +88,12 @@ class SmartThreatChooser:
     def __init__(self, seed: int | None = None):
         self.rng = default_rng(seed)
 
+    def __getstate__(self):
+        return get_state(self)
+
+    def __setstate__(self, state):
+        set_state(self, state)
+
     def choose_threat_intelligently(self, wh_const: float, wh_state_dep: float):
         """
         Chooses threats and threat levels intelligently to showcase the difference between
@@ -95,6 +113,23 @@ class SmartThreatChooser:
 
         return threat, threat_level
 
+    def choose_scenario(self, threats, threat_levels, wh_state_dep, wh_const: float = 0.8062):
+        """
+        Decides the threats and threat levels of all the sites before a mission. Half of the sites, on average,
+        get a threat level between the d* of the two strategies instead of the one of the threat setter
+        :param threats: the threats of the threat setter
+        :param threat_levels: the after scan threat levels of the threat setter
+        :param wh_state_dep: the health reward weight of the state dependent strategy at every site
+        :param wh_const: the health reward weight of the constant strategy
+        :return: the arrays of the threats and threat levels of the sites
+        """
+        threats = np.array(threats, dtype=int)
+        threat_levels = np.array(threat_levels, dtype=float)
+        for i, wh in enumerate(wh_state_dep):
+            if self.rng.uniform() < 0.5:
+                threats[i], threat_levels[i] = self.choose_threat_intelligently(wh_const, wh)
+        return threats, threat_levels
+
 
 if __name__ == "__main__":
     main()
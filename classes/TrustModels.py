@@ -1,7 +1,11 @@
 from typing import List
+import numpy as np
 from numpy.random import default_rng
 from classes.PerformanceMetrics import PerformanceMetricBase
 from classes.State import HumanInfo, Observation
+from classes.CommonRandomNumbers import CommonRandomNumbers
+from classes.Serialization import get_state, set_state
+from classes.SpecialFunctions import betaincinv
 
 
 class TrustModelBase:
@@ -23,34 +27,244 @@ class TrustModelBase:
         raise NotImplementedError
 
 
+class PopulationBetaModel(TrustModelBase):
+    """
+    Beta distribution trust models of a population of M humans. The parameters, the success and failure counts,
+    and alpha and beta are stored as (M,) arrays, so that all the humans are updated and sampled in one call
+    """
+
+    def __init__(self, parameters, performance_metric: PerformanceMetricBase, seed: int | None = None):
+        """
+        :param parameters: an (M, 4) array with the trust parameters [alpha0, beta0, ws, wf] of every human
+        :param performance_metric: the performance metric used by all the humans
+        :param seed (optional): the seed to start the random number generator (default: None)
+        """
+        super().__init__()
+        self.parameters = np.array(parameters, dtype=float).reshape((-1, 4))
+        self.size = self.parameters.shape[0]
+        self.performance_metric = performance_metric
+        self.rng = default_rng(seed=seed)
+        self.crn: List[CommonRandomNumbers | None] = [None] * self.size
+
+        self.num_successes = np.zeros((self.size,), dtype=int)
+        self.num_failures = np.zeros((self.size,), dtype=int)
+        self.num_updates = np.zeros((self.size,), dtype=int)
+        self.performance_history = np.zeros((self.size, 16), dtype=int)
+
+        self.alpha = self.parameters[:, 0].copy()
+        self.beta = self.parameters[:, 1].copy()
+
+        self.trust_mean = self.alpha / (self.alpha + self.beta)
+        self.trust_sampled = self.sample_trust()
+
+    def __getstate__(self):
+        return get_state(self)
+
+    def __setstate__(self, state):
+        set_state(self, state)
+
+    def __get_indices(self, indices) -> np.ndarray:
+        if indices is None:
+            return np.arange(self.size)
+        return np.asarray(indices, dtype=int).reshape((-1,))
+
+    def use_common_random_numbers(self, crn: CommonRandomNumbers, index: int):
+        """
+        Draws the trust samples of a human from the common random numbers of the participant
+        :param crn: the common random numbers shared by all copies of the participant
+        :param index: the index of the human in the population
+        """
+        self.crn[index] = crn
+        self.trust_sampled[index] = self.sample_trust([index])[0]
+
+    def sample_trust(self, indices=None) -> np.ndarray:
+        """
+        Samples trust from the current beta distributions of the humans
+        :param indices: the indices of the humans to sample for (default: all)
+        """
+        indices = self.__get_indices(indices)
+        alpha = self.alpha[indices]
+        beta = self.beta[indices]
+        uses_crn = np.array([self.crn[i] is not None for i in indices], dtype=bool)
+        if not uses_crn.any():
+            return self.rng.beta(alpha, beta)
+
+        samples = np.zeros((len(indices),), dtype=float)
+        if not uses_crn.all():
+            samples[~uses_crn] = self.rng.beta(alpha[~uses_crn], beta[~uses_crn])
+        # With common random numbers, the sample is the quantile of the uniform draw for the number of updates
+        u = np.array([self.crn[i].get(min(self.num_updates[i], self.crn[i].num_sites), CommonRandomNumbers.TRUST)
+                      for i in indices[uses_crn]])
+        samples[uses_crn] = betaincinv(alpha[uses_crn], beta[uses_crn], u)
+        return samples
+
+    def update_trust(self, info: HumanInfo, obs: Observation, wh):
+        """
+        Updates the trust of all the humans. The fields of info and obs, and wh, are (M,) arrays
+        :param info: the information available to the humans at the time of decision-making
+        :param obs: the observations of the outcomes of action selection
+        :param wh: the health reward weights of the humans
+        """
+        self.update_trust_batch(info.recommendation, obs.threat, info.threat_level, wh)
+
+    def update_trust_batch(self, recommendation, threat, threat_level, wh, indices=None):
+        """
+        Updates the trust of the humans after their observations
+        :param recommendation: the recommendations given to the humans
+        :param threat: the presence of threats observed by the humans
+        :param threat_level: the threat levels available to the humans at the time of decision-making
+        :param wh: the health reward weights of the humans
+        :param indices: the indices of the humans to update (default: all)
+        """
+        performance = self.performance_metric.get_performance_batch(np.asarray(recommendation),
+                                                                    np.asarray(threat),
+                                                                    np.asarray(threat_level),
+                                                                    np.asarray(wh))
+        self.add_performance(performance, indices)
+
+    def add_performance(self, performance, indices=None):
+        """
+        Updates the trust of the humans given the performance of the recommendations
+        :param performance: the performance (0 or 1) of the recommendation given to each human
+        :param indices: the indices of the humans to update (default: all)
+        """
+        indices = self.__get_indices(indices)
+        performance = np.asarray(performance, dtype=int).reshape((-1,))
+
+        if self.num_updates[indices].max() >= self.performance_history.shape[1]:
+            self.performance_history = np.concatenate([self.performance_history,
+                                                       np.zeros_like(self.performance_history)], axis=1)
+        self.performance_history[indices, self.num_updates[indices]] = performance
+        self.num_updates[indices] += 1
+
+        self.num_successes[indices] += performance
+        self.num_failures[indices] += (1 - performance)
+        self.__update_distributions(indices)
+
+    def update_parameters(self, new_parameters, indices=None):
+        """
+        Sets new trust parameters and recomputes the beta distributions
+        :param new_parameters: the new parameters, (4,) or (len(indices), 4)
+        :param indices: the indices of the humans to update (default: all)
+        """
+        indices = self.__get_indices(indices)
+        self.parameters[indices] = new_parameters
+        self.__update_distributions(indices)
+
+    def __update_distributions(self, indices: np.ndarray):
+        parameters = self.parameters[indices]
+        self.alpha[indices] = parameters[:, 0] + self.num_successes[indices] * parameters[:, 2]
+        self.beta[indices] = parameters[:, 1] + self.num_failures[indices] * parameters[:, 3]
+
+        self.trust_mean[indices] = self.alpha[indices] / (self.alpha[indices] + self.beta[indices])
+        self.trust_sampled[indices] = self.sample_trust(indices)
+
+    def get_view(self, index: int):
+        """Returns the trust model of a single human of the population"""
+        return BetaDistributionModel(None, self.performance_metric, population=self, index=index)
+
+
 class BetaDistributionModel(TrustModelBase):
     """
     Maintains and updates parameters of a beta distribution to model trust.
     Uses the complete performance history to update trust
     Guo et al. (2021) - Modeling and Predicting Trust Dynamics in Human–Robot Teaming: A Bayesian Inference Approach
+    The state is stored in a PopulationBetaModel, of which this is a view of a single human
     """
 
-    def __init__(self, parameters: List[float], performance_metric: PerformanceMetricBase,
-                 seed: int | None = None):
+    def __init__(self, parameters: List[float] | None, performance_metric: PerformanceMetricBase,
+                 seed: int | None = None, population: PopulationBetaModel | None = None, index: int = 0):
         """
         Initializes the class
-        :param parameters: a dict with keys alpha0, beta0, vs, vf and corresponding values
-        :param seed (optional): the seed to start the random number generator (default: 123)
+        :param parameters: a list with the values of alpha0, beta0, vs, vf
+        :param seed (optional): the seed to start the random number generator (default: None)
+        :param population (optional): the population that stores this model. If None, a population of one is created
+        :param index: the index of this human in the population (default: 0)
         """
         super().__init__()
-        self.parameters = parameters
-        self.rng = default_rng(seed=seed)
+        if population is None:
+            population = PopulationBetaModel([parameters], performance_metric, seed=seed)
+        self.population = population
+        self.index = index
 
-        self.performance_history = []
-        self.num_successes = 0
-        self.num_failures = 0
-        self.performance_metric = performance_metric
+    def __setstate__(self, state):
+        if 'population' not in state:
+            # Models saved before the state was stored in a population
+            population = PopulationBetaModel([state['parameters']], state['performance_metric'])
+            for performance in state['performance_history']:
+                population.add_performance([performance])
+            # Restore the saved values, which may differ from the replayed ones if the parameters were re-estimated
+            for key in ['alpha', 'beta', 'trust_mean', 'trust_sampled', 'num_successes', 'num_failures']:
+                getattr(population, key)[0] = state[key]
+            population.rng = state['rng']
+            state = {'population': population, 'index': 0}
+        set_state(self, state, rng_attributes=())
 
-        self.alpha = self.parameters[0]
-        self.beta = self.parameters[1]
+    def __getstate__(self):
+        return get_state(self, rng_attributes=())
 
-        self.trust_mean = self.alpha / (self.alpha + self.beta)
-        self.trust_sampled = self.rng.beta(self.alpha, self.beta)
+    @property
+    def parameters(self) -> np.ndarray:
+        return self.population.parameters[self.index]
+
+    @parameters.setter
+    def parameters(self, new_parameters):
+        # Only the parameters are changed. The distribution is recomputed at the next update
+        self.population.parameters[self.index] = new_parameters
+
+    @property
+    def alpha(self) -> float:
+        return self.population.alpha[self.index]
+
+    @property
+    def beta(self) -> float:
+        return self.population.beta[self.index]
+
+    @property
+    def trust_mean(self) -> float:
+        return self.population.trust_mean[self.index]
+
+    @property
+    def trust_sampled(self) -> float:
+        return self.population.trust_sampled[self.index]
+
+    @property
+    def num_successes(self) -> int:
+        return self.population.num_successes[self.index]
+
+    @property
+    def num_failures(self) -> int:
+        return self.population.num_failures[self.index]
+
+    @property
+    def performance_history(self) -> List[int]:
+        return self.population.performance_history[self.index, :self.population.num_updates[self.index]].tolist()
+
+    @property
+    def performance_metric(self) -> PerformanceMetricBase:
+        return self.population.performance_metric
+
+    @property
+    def rng(self):
+        return self.population.rng
+
+    @property
+    def crn(self) -> CommonRandomNumbers | None:
+        return self.population.crn[self.index]
+
+    def use_common_random_numbers(self, crn: CommonRandomNumbers):
+        """
+        Draws the trust samples from the common random numbers of the participant and resamples the current trust
+        :param crn: the common random numbers shared by all copies of the participant
+        """
+        self.population.use_common_random_numbers(crn, self.index)
+
+    def sample_trust(self) -> float:
+        """
+        Samples trust from the current beta distribution. With common random numbers, the sample is the quantile
+        of the uniform draw for the number of updates made so far
+        """
+        return self.population.sample_trust([self.index])[0]
 
     def update_trust(self, info: HumanInfo, obs: Observation, wh: float):
         """
@@ -61,21 +275,10 @@ class BetaDistributionModel(TrustModelBase):
         :param wh: the health reward weight of the human
         """
         performance = self.performance_metric.get_performance(info, obs, wh)
-        self.num_successes += performance
-        self.num_failures += (1 - performance)
-        self.performance_history.append(performance)
-        self.alpha = self.parameters[0] + self.num_successes * self.parameters[2]
-        self.beta = self.parameters[1] + self.num_failures * self.parameters[3]
-
-        self.trust_mean = self.alpha / (self.alpha + self.beta)
-        self.trust_sampled = self.rng.beta(self.alpha, self.beta)
+        self.population.add_performance([performance], [self.index])
 
     def update_parameters(self, new_parameters: List[float]):
-        self.parameters = new_parameters
-        self.alpha = self.parameters[0] + self.num_successes * self.parameters[2]
-        self.beta = self.parameters[1] + self.num_failures * self.parameters[3]
-        self.trust_mean = self.alpha / (self.alpha + self.beta)
-        self.trust_sampled = self.rng.beta(self.alpha, self.beta)
+        self.population.update_parameters(new_parameters, [self.index])
 
     def get_performance(self, info: HumanInfo, obs: Observation, wh: float):
         return self.performance_metric.get_performance(info, obs, wh)
@@ -7,6 +7,7 @@ from classes.State import RobotInfo
 from classes.Simulation import SimSettings
 from classes.RewardModels import ConstantWeights, StateDependentWeights
 from classes.RobotModel import RobotOnly
+from classes.GlobalPolicy import GlobalPolicyCache
 from dash import Input, Output
 
 num_sites = 5
@@ -26,6 +27,11 @@ const_robot = RobotOnly(const_reward_model, settings)
 state_dep_reward_model = StateDependentWeights()
 state_dep_robot = RobotOnly(state_dep_reward_model, settings)
 
+# The sliders move the start state, which the global policies of the robots cover without solving again
+policy_cache = GlobalPolicyCache()
+const_robot.policy_cache = policy_cache
+state_dep_robot.policy_cache = policy_cache
+
 
 # Function to update the recommendations after changing the value of d_hat
 @app.callback(
@@ -7,6 +7,7 @@ from classes.State import RobotInfo, HumanInfo
 from classes.Simulation import SimSettings
 from classes.RewardModels import ConstantWeights, StateDependentWeights
 from classes.RobotModel import Robot
+from classes.GlobalPolicy import GlobalPolicyCache
 from classes.HumanModels import Human, HumanModel
 from classes.PerformanceMetrics import ObservedReward
 from classes.TrustModels import BetaDistributionModel
@@ -48,6 +49,11 @@ robot2 = Robot(human_model, state_dep_reward_model, settings)
 const_robot = Robot(human_model, const_reward_model, settings)
 state_dep_robot = Robot(human_model, state_dep_reward_model, settings)
 
+# The sliders move the start state, which the global policies of the robots cover without solving again
+policy_cache = GlobalPolicyCache()
+const_robot.policy_cache = policy_cache
+state_dep_robot.policy_cache = policy_cache
+
 
 # Function to update the recommendations after changing the value of d_hat
 @app.callback(
@@ -0,0 +1,563 @@
+"""Checks a faster replacement of a solver or estimator against the reference implementation on many seeded inputs:
+
+    python equivalence_harness.py generate --target recommendation --num-cases 2000 --seed 1 --out cases.jsonl
+    python equivalence_harness.py compare --target recommendation --candidate my_module:fast_recommendation \\
+        --cases cases.jsonl
+
+The targets are Robot.get_recommendation ('recommendation'), RobotOnly.choose_action ('robot_only'),
+Estimator.update_model ('estimator') and Simulation.run of all the strategies of a SimRunner ('simulation'). A
+candidate is a function with the signature of the method it replaces, e.g. candidate(robot, info) for a
+recommendation, so that a method of a subclass can be given too.
+
+The inputs are random but seeded, and include the edge cases of health and time 0 and the bounds of the trust
+parameters, or are recorded from real runs (see Recorder and the record command). With --freeze, the outputs and
+times of the reference are saved with the inputs, and a later compare checks the candidate against them instead of
+the current code, so that a solver optimized in place can still be checked against the behavior before the change.
+"""
+import argparse
+import importlib
+import json
+from contextlib import contextmanager
+from time import perf_counter
+from typing import Callable, Dict, List, Tuple
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.Simulation import Simulation
+from classes.RobotModel import Robot, RobotOnly
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.RewardModels import RewardModelBase, ConstantWeights, StateDependentWeights
+from classes.ParamsUpdater import Estimator, BOUNDS
+from classes.State import RobotInfo
+from run_simulation import SimRunner, KAPPA
+
+# The reference implementations, taken before a Recorder or a candidate replaces them
+REFERENCES = {
+    'recommendation': Robot.get_recommendation,
+    'robot_only': RobotOnly.choose_action,
+    'estimator': Estimator.update_model,
+    'simulation': Simulation.run,
+}
+TARGETS = list(REFERENCES.keys())
+# The probability of drawing an edge value of an input instead of a uniform one
+EDGE_PROBABILITY = 0.2
+
+_state_dependent_weights = None
+
+
+def get_reward_model(wh: float | None) -> RewardModelBase:
+    """Returns the constant weights wh, or the state dependent weights if wh is None"""
+    global _state_dependent_weights
+    if wh is not None:
+        return ConstantWeights(wh)
+    # The weights are loaded once and shared, they have no state without noise
+    if _state_dependent_weights is None:
+        _state_dependent_weights = StateDependentWeights()
+    return _state_dependent_weights
+
+
+def get_wh(reward_model: RewardModelBase) -> float | None:
+    """Returns the constant weight of a reward model, None for the state dependent weights"""
+    if isinstance(reward_model, ConstantWeights):
+        return float(reward_model.wh)
+    return None
+
+
+@contextmanager
+def replace_method(cls, name: str, function: Callable):
+    """Replaces a method of a class within the block"""
+    original = cls.__dict__[name]
+    setattr(cls, name, function)
+    try:
+        yield
+    finally:
+        setattr(cls, name, original)
+
+
+# Random inputs
+
+def pick(rng: np.random.Generator, edges: List[float], low: float, high: float) -> float:
+    """Returns one of the edge values with probability EDGE_PROBABILITY, else a uniform value in [low, high)"""
+    if rng.uniform() < EDGE_PROBABILITY:
+        return float(edges[rng.integers(len(edges))])
+    return float(rng.uniform(low, high))
+
+
+def pick_level(rng: np.random.Generator, low: int = 0) -> int:
+    """Returns a health or time level, a multiple of 10 as in a mission or, rarely, any integer"""
+    if rng.uniform() < EDGE_PROBABILITY:
+        return int([low, 100][rng.integers(2)])
+    if rng.uniform() < 0.1:
+        return int(rng.integers(low, 101))
+    return int(rng.integers(low // 10, 11)) * 10
+
+
+def pick_wh(rng: np.random.Generator) -> float | None:
+    """Returns a constant health weight, or None for the state dependent weights"""
+    if rng.uniform() < 0.3:
+        return None
+    return pick(rng, [0., 1., 0.8062], 0., 1.)
+
+
+def generate_recommendation_inputs(rng: np.random.Generator, max_sites: int) -> Dict:
+    num_sites = int(rng.integers(1, max_sites + 1))
+    site_idx = int(rng.integers(num_sites))
+    num_successes = int(rng.integers(site_idx + 1))
+    return {'num_sites': num_sites, 'site_idx': site_idx, 'health': pick_level(rng), 'time': pick_level(rng),
+            'threat_level': pick(rng, [0., 1.], 0., 1.), 'prior_threat_level': pick(rng, [0., 1.], 0., 1.),
+            'discount_factor': pick(rng, [0., 1.], 0., 1.),
+            'trust_params': [pick(rng, list(bounds), *bounds) for bounds in BOUNDS],
+            'num_successes': num_successes, 'num_failures': site_idx - num_successes,
+            'kappa': pick(rng, [KAPPA], 0.01, 1.), 'hl': 10., 'tc': 10., 'wh': pick_wh(rng)}
+
+
+def generate_robot_only_inputs(rng: np.random.Generator, max_sites: int) -> Dict:
+    num_sites = int(rng.integers(1, max_sites + 1))
+    return {'num_sites': num_sites, 'site_idx': int(rng.integers(num_sites)), 'health': pick_level(rng),
+            'time': pick_level(rng), 'threat_level': pick(rng, [0., 1.], 0., 1.),
+            'prior_threat_level': pick(rng, [0., 1.], 0., 1.), 'discount_factor': pick(rng, [0., 1.], 0., 1.),
+            'wh': pick_wh(rng)}
+
+
+def generate_estimator_inputs(rng: np.random.Generator, max_sites: int) -> Dict:
+    def feedback():
+        trust = None if rng.uniform() < 0.3 else pick(rng, [0., 1.], 0., 1.)
+        return [trust, int(rng.integers(2))]
+
+    history = [feedback() for _ in range(rng.integers(max_sites))]
+    updates = [feedback() for _ in range(rng.integers(1, 4))]
+    # At least one update refits the parameters
+    if updates[-1][0] is None:
+        updates[-1][0] = pick(rng, [0., 1.], 0., 1.)
+    return {'history': history, 'updates': updates}
+
+
+def generate_simulation_inputs(rng: np.random.Generator, max_sites: int) -> Dict:
+    num_sites = int(rng.integers(1, max_sites + 1))
+    prior_threat_level = pick(rng, [0., 1.], 0., 1.)
+    settings = SimSettings(num_sites, 100, 100, prior_threat_level, 0.7, threat_seed=int(rng.integers(2 ** 32)))
+    return {'num_sites': num_sites, 'start_health': pick_level(rng, 10), 'start_time': pick_level(rng, 10),
+            'prior_threat_level': prior_threat_level, 'discount_factor': pick(rng, [1.], 0., 1.),
+            'threats': [int(t) for t in settings.threat_setter.threats],
+            'after_scan': [float(d) for d in settings.threat_setter.after_scan],
+            'wh_const': [pick(rng, [0.8062, 1.], 0.5, 1.) for _ in range(rng.integers(1, 3))],
+            'seed': int(rng.integers(2 ** 32)), 'kappa': pick(rng, [KAPPA], 0.01, 1.)}
+
+
+GENERATORS = {
+    'recommendation': generate_recommendation_inputs,
+    'robot_only': generate_robot_only_inputs,
+    'estimator': generate_estimator_inputs,
+    'simulation': generate_simulation_inputs,
+}
+
+
+def generate_cases(target: str, num_cases: int, seed: int | None = None, max_sites: int | None = None) -> List[Dict]:
+    """
+    Returns random inputs of a target
+    :param num_cases: the number of inputs
+    :param seed: the seed of the inputs (default: None)
+    :param max_sites: the largest number of sites of a mission, or of a feedback history (default: 3 for
+                      simulations, 6 otherwise)
+    """
+    if max_sites is None:
+        max_sites = 3 if target == 'simulation' else 6
+    rng = np.random.default_rng(seed)
+    return [{'target': target, 'inputs': GENERATORS[target](rng, max_sites)} for _ in range(num_cases)]
+
+
+# Building the objects of the inputs
+
+def get_settings(inputs: Dict) -> SimSettings:
+    return SimSettings(inputs['num_sites'], inputs.get('start_health', 100), inputs.get('start_time', 100),
+                       inputs['prior_threat_level'], inputs['discount_factor'], threat_seed=0)
+
+
+def get_robot_info(inputs: Dict) -> RobotInfo:
+    return RobotInfo(inputs['health'], inputs['time'], inputs['threat_level'], inputs['prior_threat_level'],
+                     inputs['site_idx'])
+
+
+def build_robot(inputs: Dict) -> Robot:
+    trust_model = BetaDistributionModel(list(inputs['trust_params']), ObservedReward(), seed=0)
+    # alpha and beta only depend on the numbers of successes and failures, not on their order
+    for performance in [1] * inputs['num_successes'] + [0] * inputs['num_failures']:
+        trust_model.population.add_performance([performance])
+    decision_model = BoundedRationalityDisuse(kappa=inputs['kappa'], hl=inputs['hl'], tc=inputs['tc'], seed=0)
+    reward_model = get_reward_model(inputs['wh'])
+    human_model = HumanModel(trust_model, decision_model, reward_model)
+    return Robot(human_model, reward_model, get_settings(inputs))
+
+
+def build_estimator(inputs: Dict) -> Estimator:
+    estimator = Estimator()
+    estimator.trust_feedback = [trust for trust, _ in inputs['history']]
+    estimator.perf_history = [performance for _, performance in inputs['history']]
+    return estimator
+
+
+def build_sim_runner(inputs: Dict) -> SimRunner:
+    settings = get_settings(inputs)
+    settings.threat_setter.threats = np.array(inputs['threats'], dtype=int)
+    settings.threat_setter.after_scan = np.array(inputs['after_scan'], dtype=float)
+    return SimRunner(settings, list(inputs['wh_const']), seed=inputs['seed'], kappa=inputs['kappa'],
+                     estimator=inputs.get('estimator', 'optimizer'),
+                     state_dep_trust_params=inputs.get('state_dep_trust_params'),
+                     const_trust_params=inputs.get('const_trust_params'),
+                     common_random_numbers=inputs.get('common_random_numbers', False))
+
+
+def run_case(target: str, function: Callable, inputs: Dict) -> Tuple[Dict, float]:
+    """
+    Runs an implementation of a target on one input
+    :param function: the reference of the target or a candidate with its signature
+    :return: the outputs and the time spent in the implementation in seconds
+    """
+    if target == 'recommendation':
+        robot, info = build_robot(inputs), get_robot_info(inputs)
+        start = perf_counter()
+        action = function(robot, info)
+        return {'action': int(action)}, perf_counter() - start
+
+    if target == 'robot_only':
+        robot = RobotOnly(get_reward_model(inputs['wh']), get_settings(inputs))
+        info = get_robot_info(inputs)
+        start = perf_counter()
+        action = function(robot, info)
+        return {'action': int(action)}, perf_counter() - start
+
+    if target == 'estimator':
+        estimator = build_estimator(inputs)
+        params, seconds = [], 0.
+        for trust, performance in inputs['updates']:
+            if trust is None:
+                estimator.add_performance(performance)
+                params.append(None)
+                continue
+            start = perf_counter()
+            x = function(estimator, trust, performance)
+            seconds += perf_counter() - start
+            params.append([float(v) for v in x])
+        return {'params': params}, seconds
+
+    if target == 'simulation':
+        sim_runner = build_sim_runner(inputs)
+        with replace_method(Simulation, 'run', function):
+            start = perf_counter()
+            sim_runner.run()
+            seconds = perf_counter() - start
+        return {'results': sim_runner.get_results()}, seconds
+
+    raise ValueError(f"Unknown target {target}")
+
+
+# Comparing the outputs
+
+def get_deviation(expected, actual) -> float:
+    return float(np.max(np.abs(np.asarray(actual, dtype=float) - np.asarray(expected, dtype=float)), initial=0.))
+
+
+def is_close(expected, actual, rtol: float, atol: float) -> bool:
+    return bool(np.allclose(np.asarray(actual, dtype=float), np.asarray(expected, dtype=float), rtol=rtol, atol=atol))
+
+
+def compare_outputs(target: str, expected: Dict, actual: Dict, rtol: float = 1e-6,
+                    atol: float = 1e-8) -> Dict:
+    """
+    Compares the outputs of the candidate to those of the reference
+    :return: whether they match, the number of actions (and recommendations) that differ, and the largest absolute
+             deviation of the values
+    """
+    if target in ('recommendation', 'robot_only'):
+        mismatches = int(expected['action'] != actual['action'])
+        return {'match': mismatches == 0, 'action_mismatches': mismatches, 'max_deviation': 0.}
+
+    if target == 'estimator':
+        match, deviation = len(expected['params']) == len(actual['params']), 0.
+        for x_expected, x_actual in zip(expected['params'], actual['params']):
+            if x_expected is None or x_actual is None:
+                match &= x_expected is None and x_actual is None
+                continue
+            deviation = max(deviation, get_deviation(x_expected, x_actual))
+            match &= is_close(x_expected, x_actual, rtol, atol)
+        return {'match': match, 'action_mismatches': 0, 'max_deviation': deviation}
+
+    if target == 'simulation':
+        expected, actual = expected['results'], actual['results']
+        match, mismatches, deviation = expected.keys() == actual.keys(), 0, 0.
+        for key in expected.keys() & actual.keys():
+            for name, values in expected[key].items():
+                other = actual[key].get(name)
+                if other is None or len(other) != len(values):
+                    match = False
+                    continue
+                if name in ('trust', 'threat_level'):
+                    deviation = max(deviation, get_deviation(values, other))
+                    match &= is_close(values, other, rtol, atol)
+                    continue
+                differences = sum(a != b for a, b in zip(values, other))
+                if name in ('action', 'recommendation'):
+                    mismatches += differences
+                match &= differences == 0
+        return {'match': match, 'action_mismatches': mismatches, 'max_deviation': deviation}
+
+    raise ValueError(f"Unknown target {target}")
+
+
+def freeze(cases: List[Dict]) -> List[Dict]:
+    """Adds the outputs and the time of the reference to every case"""
+    warmed_up = set()
+    for case in cases:
+        if case['target'] not in warmed_up:
+            # Run once untimed, as in compare
+            run_case(case['target'], REFERENCES[case['target']], case['inputs'])
+            warmed_up.add(case['target'])
+        case['expected'], case['seconds'] = run_case(case['target'], REFERENCES[case['target']], case['inputs'])
+    return cases
+
+
+def compare(target: str, candidate: Callable, cases: List[Dict], recompute: bool = False, rtol: float = 1e-6,
+            atol: float = 1e-8, max_failures: int = 10) -> Dict:
+    """
+    Runs the reference and the candidate side by side on the cases of a target
+    :param candidate: a function with the signature of the method of the target
+    :param cases: the cases, the cases of other targets are left out
+    :param recompute: whether to run the reference on the frozen cases too, instead of taking their saved outputs
+                      (default: False)
+    :param max_failures: the number of mismatching cases to return (default: 10)
+    :return: the report, with the numbers of cases, mismatching cases and mismatching actions, the largest
+             deviation, the times of the reference and the candidate, the speedup, and the first mismatching cases
+    """
+    reference = REFERENCES[target]
+    target_cases = [case for case in cases if case['target'] == target]
+    if len(target_cases) > 0:
+        # Both run once untimed, so that imports and first-call costs are not counted
+        run_case(target, reference, target_cases[0]['inputs'])
+        run_case(target, candidate, target_cases[0]['inputs'])
+    report = {'target': target, 'num_cases': 0, 'mismatches': 0, 'action_mismatches': 0, 'max_deviation': 0.,
+              'reference_time': 0., 'candidate_time': 0., 'failures': []}
+    for i, case in enumerate(cases):
+        if case['target'] != target:
+            continue
+        if 'expected' in case and not recompute:
+            expected, reference_time = case['expected'], case['seconds']
+        else:
+            expected, reference_time = run_case(target, reference, case['inputs'])
+        actual, candidate_time = run_case(target, candidate, case['inputs'])
+        result = compare_outputs(target, expected, actual, rtol, atol)
+
+        report['num_cases'] += 1
+        report['reference_time'] += reference_time
+        report['candidate_time'] += candidate_time
+        report['action_mismatches'] += result['action_mismatches']
+        report['max_deviation'] = max(report['max_deviation'], result['max_deviation'])
+        if not result['match']:
+            report['mismatches'] += 1
+            if len(report['failures']) < max_failures:
+                report['failures'].append({'case': i, 'inputs': case['inputs'], 'expected': expected,
+                                           'actual': actual})
+    report['speedup'] = report['reference_time'] / max(report['candidate_time'], 1e-12)
+    return report
+
+
+# Recording the inputs of real runs
+
+class Recorder:
+    """
+    Records the inputs of the targets called by the code run within it, e.g.
+        with Recorder() as recorder:
+            sim_runner.run()
+        save_cases('recorded.jsonl', freeze(recorder.cases))
+    Calls that the harness cannot rebuild (robots with a lookahead or noisy reward weights, runs with a surrogate or
+    a feedback schedule) are not recorded
+    """
+
+    def __init__(self, targets: List[str] | None = None):
+        self.targets = TARGETS if targets is None else targets
+        self.cases = []
+        self.replaced = []
+
+    def add(self, target: str, inputs: Dict | None):
+        if inputs is not None:
+            self.cases.append({'target': target, 'inputs': inputs})
+
+    def __enter__(self):
+        recorder = self
+
+        def get_recommendation(robot, info, *args, **kwargs):
+            recorder.add('recommendation', get_recommendation_inputs(robot, info))
+            return REFERENCES['recommendation'](robot, info, *args, **kwargs)
+
+        def choose_action(robot, info):
+            recorder.add('robot_only', get_robot_only_inputs(robot, info))
+            return REFERENCES['robot_only'](robot, info)
+
+        def update_model(estimator, trust, performance):
+            recorder.add('estimator', {'history': [[t, p] for t, p in zip(estimator.trust_feedback,
+                                                                            estimator.perf_history)],
+                                       'updates': [[float(trust), int(performance)]]})
+            return REFERENCES['estimator'](estimator, trust, performance)
+
+        sim_runner_run = SimRunner.run
+
+        def run(sim_runner, *args, **kwargs):
+            recorder.add('simulation', get_simulation_inputs(sim_runner))
+            return sim_runner_run(sim_runner, *args, **kwargs)
+
+        methods = {'recommendation': (Robot, 'get_recommendation', get_recommendation),
+                   'robot_only': (RobotOnly, 'choose_action', choose_action),
+                   'estimator': (Estimator, 'update_model', update_model),
+                   'simulation': (SimRunner, 'run', run)}
+        for target in self.targets:
+            cls, name, function = methods[target]
+            self.replaced.append((cls, name, cls.__dict__[name]))
+            setattr(cls, name, function)
+        return self
+
+    def __exit__(self, *args):
+        for cls, name, original in reversed(self.replaced):
+            setattr(cls, name, original)
+        self.replaced = []
+
+
+def get_recommendation_inputs(robot: Robot, info: RobotInfo) -> Dict | None:
+    if robot.lookahead is not None or robot.workspace.dtype != np.float64 or robot.reward_model.get_key() is None:
+        return None
+    trust_model = robot.human_model.trust_model
+    decision_model = robot.human_model.decision_model
+    return {'num_sites': robot.settings.num_sites, 'site_idx': int(info.site_idx), 'health': int(info.health),
+            'time': int(info.time), 'threat_level': float(info.threat_level),
+            'prior_threat_level': float(info.prior_threat_level), 'discount_factor': float(robot.settings.df),
+            'trust_params': [float(x) for x in trust_model.parameters],
+            'num_successes': int(trust_model.num_successes), 'num_failures': int(trust_model.num_failures),
+            'kappa': float(decision_model.kappa), 'hl': float(decision_model.hl), 'tc': float(decision_model.tc),
+            'wh': get_wh(robot.reward_model)}
+
+
+def get_robot_only_inputs(robot: RobotOnly, info: RobotInfo) -> Dict | None:
+    if robot.lookahead is not None or robot.workspace.dtype != np.float64 or robot.rewards_model.get_key() is None:
+        return None
+    return {'num_sites': robot.settings.num_sites, 'site_idx': int(info.site_idx), 'health': int(info.health),
+            'time': int(info.time), 'threat_level': float(info.threat_level),
+            'prior_threat_level': float(info.prior_threat_level), 'discount_factor': float(robot.settings.df),
+            'wh': get_wh(robot.rewards_model)}
+
+
+def get_simulation_inputs(sim_runner: SimRunner) -> Dict | None:
+    if sim_runner.surrogate is not None or sim_runner.feedback_schedule is not None or \
+            sim_runner.scenario != 'adaptive':
+        return None
+    settings = sim_runner.sim_settings
+    return {'num_sites': settings.num_sites, 'start_health': int(settings.start_health),
+            'start_time': int(settings.start_time), 'prior_threat_level': float(settings.d),
+            'discount_factor': float(settings.df), 'threats': [int(t) for t in settings.threat_setter.threats],
+            'after_scan': [float(d) for d in settings.threat_setter.after_scan],
+            'wh_const': [float(wh) for wh in sim_runner.wh_const], 'seed': int(sim_runner.seed),
+            'kappa': float(sim_runner.kappa), 'estimator': sim_runner.estimator,
+            'state_dep_trust_params': list(sim_runner.state_dep_trust_params),
+            'const_trust_params': list(sim_runner.const_trust_params),
+            'common_random_numbers': sim_runner.common_random_numbers}
+
+
+def record_runs(num_runs: int, num_sites: int, seed: int | None = None) -> List[Dict]:
+    """Records the inputs of num_runs SimRunners from random starting conditions"""
+    rng = np.random.default_rng(seed)
+    with Recorder() as recorder:
+        for _ in range(num_runs):
+            start_health, start_time = pick_level(rng, 10), pick_level(rng, 10)
+            settings = SimSettings(num_sites, start_health, start_time, 0.7, 0.7,
+                                   threat_seed=int(rng.integers(2 ** 32)))
+            SimRunner(settings, [0.8062], seed=int(rng.integers(2 ** 32))).run()
+    return recorder.cases
+
+
+def save_cases(file: str, cases: List[Dict]):
+    with open(file, 'w') as f:
+        for case in cases:
+            f.write(json.dumps(case) + '\n')
+
+
+def load_cases(file: str) -> List[Dict]:
+    with open(file, 'r') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def load_candidate(name: str) -> Callable:
+    """Returns the function of a name such as 'module:function' or 'module:Class.method'"""
+    module_name, _, attributes = name.partition(':')
+    if attributes == '':
+        raise ValueError(f"The candidate {name} must be given as module:function")
+    function = importlib.import_module(module_name)
+    for attribute in attributes.split('.'):
+        function = getattr(function, attribute)
+    return function
+
+
+def print_report(report: Dict):
+    print(f"{report['target']}: {report['num_cases']} cases, {report['mismatches']} mismatching, "
+          f"{report['action_mismatches']} actions differ, max deviation {report['max_deviation']:.3g}")
+    print(f"Reference {report['reference_time']:.3f} s, candidate {report['candidate_time']:.3f} s, "
+          f"speedup {report['speedup']:.2f}x")
+    for failure in report['failures']:
+        print(f"Case {failure['case']}: {json.dumps(failure['inputs'])}")
+        print(f"    expected {json.dumps(failure['expected'])}")
+        print(f"    actual   {json.dumps(failure['actual'])}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Check a candidate implementation against the reference')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    generate_parser = subparsers.add_parser('generate', help='generate random inputs of a target')
+    generate_parser.add_argument('--target', choices=TARGETS, required=True)
+    generate_parser.add_argument('--num-cases', type=int, default=1000)
+    generate_parser.add_argument('--seed', type=int, default=None)
+    generate_parser.add_argument('--max-sites', type=int, default=None)
+    generate_parser.add_argument('--out', required=True, help='the JSONL file of the cases')
+    generate_parser.add_argument('--freeze', action='store_true', help='save the outputs of the reference too')
+
+    record_parser = subparsers.add_parser('record', help='record the inputs of the targets in real runs')
+    record_parser.add_argument('--num-runs', type=int, default=3)
+    record_parser.add_argument('--num-sites', type=int, default=5)
+    record_parser.add_argument('--seed', type=int, default=None)
+    record_parser.add_argument('--out', required=True, help='the JSONL file of the cases')
+    record_parser.add_argument('--freeze', action='store_true', help='save the outputs of the reference too')
+
+    compare_parser = subparsers.add_parser('compare', help='compare a candidate to the reference')
+    compare_parser.add_argument('--target', choices=TARGETS, required=True)
+    compare_parser.add_argument('--candidate', required=True, help='the candidate, as module:function')
+    compare_parser.add_argument('--cases', default=None, help='a JSONL file of cases (default: random cases)')
+    compare_parser.add_argument('--num-cases', type=int, default=1000, help='the number of random cases')
+    compare_parser.add_argument('--seed', type=int, default=None, help='the seed of the random cases')
+    compare_parser.add_argument('--max-sites', type=int, default=None)
+    compare_parser.add_argument('--recompute', action='store_true',
+                                help='run the reference on frozen cases instead of taking their saved outputs')
+    compare_parser.add_argument('--rtol', type=float, default=1e-6)
+    compare_parser.add_argument('--atol', type=float, default=1e-8)
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        if args.cases is not None:
+            cases = load_cases(args.cases)
+        else:
+            cases = generate_cases(args.target, args.num_cases, args.seed, args.max_sites)
+        report = compare(args.target, load_candidate(args.candidate), cases, args.recompute, args.rtol, args.atol)
+        print_report(report)
+        if report['mismatches'] > 0:
+            raise SystemExit(1)
+        return
+
+    if args.command == 'generate':
+        cases = generate_cases(args.target, args.num_cases, args.seed, args.max_sites)
+    else:
+        cases = record_runs(args.num_runs, args.num_sites, args.seed)
+    if args.freeze:
+        freeze(cases)
+    save_cases(args.out, cases)
+    print(f"Saved {len(cases)} cases to {args.out}")
+
+
+if __name__ == "__main__":
+    main()
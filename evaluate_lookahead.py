@@ -0,0 +1,120 @@
+"""Measures how often a truncated lookahead recommends something else than the full-horizon plan.
+
+For every lookahead H and terminal value, random states of a mission are solved both ways by the Robot and the
+RobotOnly, and the disagreement rate and the speedup are reported.
+"""
+import argparse
+from time import perf_counter
+from typing import Dict, List
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.RobotModel import Robot, RobotOnly
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.RewardModels import RewardModelBase, StateDependentWeights, ConstantWeights
+from classes.State import RobotInfo
+from classes.TerminalValues import TerminalValueBase, ZeroTerminalValue, MyopicTerminalValue, TableTerminalValue
+from run_simulation import KAPPA, CONST_TRUST_PARAMS
+
+
+def get_terminal_values(reward_model: RewardModelBase, settings: SimSettings) -> Dict[str, TerminalValueBase]:
+    robot_only = RobotOnly(reward_model, settings)
+    table = TableTerminalValue.from_robot_only(robot_only, settings.start_health, settings.start_time, settings.d)
+    return {'zero': ZeroTerminalValue(), 'myopic': MyopicTerminalValue(), 'table': table}
+
+
+def sample_states(settings: SimSettings, num_states: int, min_sites_left: int, rng: np.random.Generator):
+    """Samples states of the mission with at least min_sites_left sites to go, and the trust parameters there"""
+    states = []
+    for _ in range(num_states):
+        site_idx = int(rng.integers(settings.num_sites - min_sites_left + 1))
+        health = settings.start_health - 10 * int(rng.integers(site_idx + 1))
+        time = settings.start_time - 10 * int(rng.integers(site_idx + 1))
+        info = RobotInfo(health, time, float(rng.uniform()), settings.d, site_idx)
+        parameters = list(np.array(CONST_TRUST_PARAMS) * rng.uniform(0.5, 1.5, size=4))
+        states.append((info, parameters))
+    return states
+
+
+def get_robot(parameters: List[float], reward_model: RewardModelBase, settings: SimSettings, seed: int, **kwargs):
+    trust_model = BetaDistributionModel(parameters, ObservedReward(), seed=seed)
+    decision_model = BoundedRationalityDisuse(kappa=KAPPA, seed=seed)
+    human_model = HumanModel(trust_model, decision_model, reward_model)
+    return Robot(human_model, reward_model, settings, **kwargs)
+
+
+def evaluate_lookahead(reward_model: RewardModelBase, settings: SimSettings, horizons: List[int],
+                       num_states: int = 50, seed: int | None = None) -> List[Dict]:
+    """
+    :param reward_model: the reward model of the robots
+    :param settings: the settings of the mission
+    :param horizons: the lookaheads to evaluate
+    :param num_states: the number of random states per lookahead
+    :param seed: the seed of the random states
+    :return: one row per robot, lookahead, and terminal value with the disagreement rate and the speedup
+    """
+    rng = np.random.default_rng(seed)
+    terminal_values = get_terminal_values(reward_model, settings)
+    rows = []
+    for horizon in horizons:
+        states = sample_states(settings, num_states, horizon + 1, rng)
+        full_robot_only = RobotOnly(reward_model, settings)
+        full = []
+        for info, parameters in states:
+            robot = get_robot(parameters, reward_model, settings, seed=0)
+            start = perf_counter()
+            recommendation = robot.solve(info)
+            robot_time = perf_counter() - start
+            start = perf_counter()
+            action = full_robot_only.choose_action(info)
+            full.append((recommendation, robot_time, action, perf_counter() - start))
+
+        for name, terminal_value in terminal_values.items():
+            robot_only = RobotOnly(reward_model, settings, lookahead=horizon, terminal_value=terminal_value)
+            robot_disagree, robot_only_disagree = 0, 0
+            robot_time, robot_only_time = 0., 0.
+            for (info, parameters), (full_rec, full_robot_time, full_action, full_robot_only_time) in \
+                    zip(states, full):
+                robot = get_robot(parameters, reward_model, settings, seed=0, lookahead=horizon,
+                                  terminal_value=terminal_value)
+                start = perf_counter()
+                robot_disagree += int(robot.solve(info) != full_rec)
+                robot_time += perf_counter() - start
+                start = perf_counter()
+                robot_only_disagree += int(robot_only.choose_action(info) != full_action)
+                robot_only_time += perf_counter() - start
+
+            rows.append({'robot': 'Robot', 'lookahead': horizon, 'terminal_value': name,
+                         'disagreement': robot_disagree / num_states,
+                         'speedup': sum(f[1] for f in full) / robot_time})
+            rows.append({'robot': 'RobotOnly', 'lookahead': horizon, 'terminal_value': name,
+                         'disagreement': robot_only_disagree / num_states,
+                         'speedup': sum(f[3] for f in full) / robot_only_time})
+
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Evaluate truncated lookaheads against the full-horizon plan')
+    parser.add_argument('--num-sites', type=int, default=10)
+    parser.add_argument('--horizons', type=int, nargs='+', default=[1, 2, 3, 5])
+    parser.add_argument('--num-states', type=int, default=50, help='the number of random states per lookahead')
+    parser.add_argument('--wh', type=float, default=None,
+                        help='the constant health reward weight (default: the state dependent weights)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    settings = SimSettings(args.num_sites, 100, 100, 0.7, 0.7)
+    reward_model = StateDependentWeights() if args.wh is None else ConstantWeights(args.wh)
+    rows = evaluate_lookahead(reward_model, settings, args.horizons, args.num_states, args.seed)
+
+    print(f"{'Robot':>10} {'H':>4} {'Terminal':>9} {'Disagree':>9} {'Speedup':>8}")
+    for row in rows:
+        print(f"{row['robot']:>10} {row['lookahead']:>4} {row['terminal_value']:>9} "
+              f"{row['disagreement']:>9.1%} {row['speedup']:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,28 +1,63 @@
+from __future__ import annotations
 from time import perf_counter
 import sys
 import os
 import os.path as path
-from typing import Dict
+from typing import Dict, TYPE_CHECKING
 import pickle
-from tqdm import tqdm
-import matplotlib.pyplot as plt
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
 import numpy as np
-import pandas as pd
-import seaborn as sns
 from classes.SimSettings import SimSettings
 from classes.Simulation import Simulation
 from classes.RewardModels import StateDependentWeights
 from classes.State import HumanInfo
-from run_simulation import SimRunner
+from classes.GlobalPolicy import GlobalPolicyCache
+from run_simulation import SimRunner, KAPPA
+from adaptive_sampling import SequentialSampler
+from run_manifest import RunManifest, atomic_pickle_dump, get_config_hash
+from run_catalog import RunCatalog
+from telemetry import EventLog, Heartbeat
 
-sns.set_theme(context='talk', style='white')
+if TYPE_CHECKING:
+    import matplotlib.pyplot as plt
 
 NUM_SITES = 10
 PRIOR_THREAT_LEVEL = 0.7
 DISCOUNT_FACTOR = 0.7
 NUM_PARTICIPANTS_PER_INITIAL = 100
+# Number of participants added to a starting condition in one round of the adaptive design
+BATCH_SIZE = 10
 # WH_CONST = [0.7, 0.8, 0.87, 0.95]
 WH_CONST = [0.8062]
+# Replay the same per-site random numbers for the human in every strategy
+COMMON_RANDOM_NUMBERS = False
+# 'adaptive' to choose the smart threats from the state dependent robot's state during its run, or 'upfront' to
+# choose them before the run so that all the strategies of a participant can run at the same time
+SCENARIO = 'adaptive'
+# The estimator of the trust parameters of the robots, 'optimizer' or 'particle', see SimRunner
+ESTIMATOR = 'optimizer'
+MANIFEST_FILE = 'manifest.json'
+# The JSONL event log of the runs, see telemetry.py
+EVENTS_FILE = 'events.jsonl'
+# The SQLite catalog of the summaries of the runs, see run_catalog.py
+CATALOG_FILE = 'catalog.sqlite'
+
+_theme_set = False
+
+
+def get_pyplot():
+    """
+    Imports matplotlib and seaborn on first use and sets the plotting theme,
+    so that running simulations does not pay for the plotting imports
+    """
+    global _theme_set
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    if not _theme_set:
+        sns.set_theme(context='talk', style='white')
+        _theme_set = True
+    return plt
 
 
 class ExperimentDesign:
@@ -31,24 +66,159 @@ class ExperimentDesign:
     and reward weights for the robot
     """
 
-    def __init__(self, starting_conditions):
+    def __init__(self, starting_conditions, seed: int | None = None, num_workers: int | None = None):
+        """
+        :param starting_conditions: a list of (health, time) tuples to start the simulations from
+        :param seed: the seed from which the seeds of all the runs are derived (default: None)
+        :param num_workers: the number of processes to run the strategies of a participant in at the same time
+                            (default: None, run them one after another)
+        """
         self.starting_conditions = starting_conditions
+        self.seed = seed
+        self.num_workers = num_workers
+        self.executor = None
+        self.manifest = None
         self.health_bins = np.arange(0, 110, 10)
         self.time_bins = np.arange(0, 110, 10)
+        # The robots of all the runs start from the same models at the first site, so one global policy
+        # covers every starting condition there
+        self.policy_cache = GlobalPolicyCache()
+        self.event_log = None
+        self.progress = None
+        self.catalog = None
+
+    def __load_manifest(self, resume: bool):
+        """
+        Loads the manifest of the runs if resuming or starts a new one
+        """
+        self.manifest = RunManifest(path.join('data', MANIFEST_FILE), self.seed, resume=resume)
+        self.manifest.save()
+        if self.catalog is None:
+            self.catalog = RunCatalog(path.join('data', CATALOG_FILE))
 
-    def run_and_save_sims(self):
-        for i, starting_condition in enumerate(self.starting_conditions):
-            start_health, start_time = starting_condition
-            for j in tqdm(range(NUM_PARTICIPANTS_PER_INITIAL)):
+    @contextmanager
+    def __track_sweep(self, total: int):
+        """
+        Logs the start and finish of a sweep of total runs to the event log, with heartbeats in between
+        """
+        self.event_log = EventLog(path.join('data', EVENTS_FILE))
+        self.progress = {'total': total, 'finished': 0, 'failed': 0}
+        self.event_log.emit('sweep_start', total=total, base_seed=self.manifest.base_seed)
+        if self.num_workers is not None:
+            self.executor = ProcessPoolExecutor(max_workers=self.num_workers)
+        try:
+            with Heartbeat(self.event_log, lambda: dict(self.progress)):
+                yield
+        finally:
+            if self.executor is not None:
+                self.executor.shutdown()
+                self.executor = None
+        self.event_log.emit('sweep_finish', **self.progress)
+
+    def run_and_save_sims(self, resume: bool = False):
+        """
+        Runs and saves NUM_PARTICIPANTS_PER_INITIAL participants for every starting condition
+        :param resume: whether to skip the runs completed in a previous (interrupted) call (default: False)
+        """
+        from tqdm import tqdm
+
+        self.__load_manifest(resume)
+        tasks = {(i, j) for i in range(len(self.starting_conditions)) for j in range(NUM_PARTICIPANTS_PER_INITIAL)
+                 if not (resume and self.manifest.is_complete(i, j))}
+        with self.__track_sweep(len(tasks)):
+            for i, starting_condition in enumerate(self.starting_conditions):
+                for j in tqdm(range(NUM_PARTICIPANTS_PER_INITIAL)):
+                    if (i, j) in tasks:
+                        self.__run_and_save_single(i, j)
+
+    def run_and_save_sims_adaptive(self, target_widths: Dict[str, float] | None = None,
+                                   batch_size: int = BATCH_SIZE, budget: int | None = None,
+                                   resume: bool = False):
+        """
+        Runs participants in batches for each starting condition until the confidence intervals of the outcome
+        metrics (final health, final time, mean trust, acceptance rate) are narrower than the target widths
+        :param target_widths: the target width of the 95% confidence interval for each metric
+        :param batch_size: the number of participants added to a condition in one round
+        :param budget: the total number of participants over all conditions
+                       (default: NUM_PARTICIPANTS_PER_INITIAL for every condition)
+        :param resume: whether to reuse the runs completed in a previous (interrupted) call (default: False)
+        :return: the report of the number of participants used per condition
+        """
+        if budget is None:
+            budget = NUM_PARTICIPANTS_PER_INITIAL * len(self.starting_conditions)
+        sampler = SequentialSampler(len(self.starting_conditions), budget, batch_size, target_widths)
+
+        self.__load_manifest(resume)
+        completed = set()
+        if resume:
+            for task in self.manifest.completed_tasks():
+                i, j = task['condition'], task['participant']
+                if i >= len(self.starting_conditions):
+                    continue
+                with open(task['path'], 'rb') as f:
+                    sim_runner = pickle.load(f)['sim_runner']
+                sampler.add(i, [sim_runner.state_dep_sim] + sim_runner.const_sims)
+                completed.add((i, j))
+
+        from tqdm import tqdm
+
+        allocation = sampler.allocate()
+        # The total is the most runs the budget allows, the sampler may stop earlier
+        with self.__track_sweep(max(budget - len(completed), 0)):
+            while len(allocation) > 0:
+                for i, num_runs in allocation.items():
+                    for _ in tqdm(range(num_runs), desc=f'Condition {i}'):
+                        j = 0
+                        while (i, j) in completed:
+                            j += 1
+                        sim_runner = self.__run_and_save_single(i, j)
+                        completed.add((i, j))
+                        sims = [sim_runner.state_dep_sim]
+                        sims.extend(sim_runner.const_sims)
+                        sampler.add(i, sims)
+                allocation = sampler.allocate()
+
+        return sampler.report(self.starting_conditions)
+
+    def __run_and_save_single(self, i: int, j: int):
+        """
+        Runs and saves the simulations of participant j at starting condition i.
+        The output is written atomically and its status recorded in the manifest
+        """
+        starting_condition = self.starting_conditions[i]
+        start_health, start_time = starting_condition
+        file = path.join('data', f'run_{i}_{j}.pkl')
+        seed = self.manifest.start(i, j, starting_condition, file)
+        config = {'num_sites': NUM_SITES, 'starting_condition': list(starting_condition),
+                  'prior_threat_level': PRIOR_THREAT_LEVEL, 'discount_factor': DISCOUNT_FACTOR, 'wh_const': WH_CONST,
+                  'common_random_numbers': COMMON_RANDOM_NUMBERS, 'kappa': KAPPA, 'estimator': ESTIMATOR}
+        # Only an upfront scenario is in the configuration, so that the hashes of the adaptive runs do not change
+        if SCENARIO != 'adaptive':
+            config['scenario'] = SCENARIO
+        config_hash = get_config_hash(config)
+        try:
+            with self.event_log.task(f'{i}_{j}', seed, config_hash, condition=i, participant=j) as timer:
+                threat_seed, runner_seed = [int(s) for s in np.random.SeedSequence(seed).generate_state(2)]
                 settings = SimSettings(NUM_SITES, start_health, start_time,
                                        PRIOR_THREAT_LEVEL, DISCOUNT_FACTOR,
-                                       threat_seed=None)
-                sim_runner = SimRunner(settings, wh_const=WH_CONST)
-                sim_runner.run()
-                file = path.join('data', f'run_{i}_{j}.pkl')
-                data = {'sim_runner': sim_runner, 'starting_condition': starting_condition}
-                with open(file, 'wb') as f:
-                    pickle.dump(data, f)
+                                       threat_seed=threat_seed)
+                sim_runner = SimRunner(settings, wh_const=WH_CONST, seed=runner_seed,
+                                       common_random_numbers=COMMON_RANDOM_NUMBERS, kappa=KAPPA,
+                                       estimator=ESTIMATOR, policy_cache=self.policy_cache, scenario=SCENARIO)
+                sim_runner.run(timer, self.executor)
+                data = {'sim_runner': sim_runner, 'starting_condition': starting_condition, 'seed': seed}
+                with timer.phase('save'):
+                    sha256 = atomic_pickle_dump(data, file, slim=True)
+                    self.catalog.add_run(f'{i}_{j}', sim_runner, file, seed=seed, config_hash=config_hash,
+                                         sha256=sha256, condition=i, participant=j)
+        except BaseException as e:
+            self.progress['failed'] += 1
+            self.manifest.fail(i, j, e)
+            raise
+        self.progress['finished'] += 1
+        self.manifest.finish(i, j, sha256)
+
+        return sim_runner
 
     def __get_state_counts(self, sim: Simulation, counts: Dict, key: str):
         """
@@ -87,6 +257,7 @@ class ExperimentDesign:
         """
         Plots the states visited in the simulation as a heatmap
         """
+        plt = get_pyplot()
         if dir_path is None:
             dir_path = './data/'
         files = os.listdir(dir_path)
@@ -94,7 +265,7 @@ class ExperimentDesign:
         figs = {}
         counts = {}
         for file in files:
-            if 'csv' in file:
+            if not file.endswith('.pkl'):
                 continue
             filepath = path.join(dir_path, file)
             with open(filepath, 'rb') as f:
@@ -204,6 +375,7 @@ class ExperimentDesign:
 
     @staticmethod
     def __plot_health_helper(health_data: Dict, ax: plt.Axes):
+        import seaborn as sns
         palette = sns.color_palette('deep')
         markers = ['o', 'v', 's', 'P', 'X', '*']
         lw = 2
@@ -255,6 +427,7 @@ class ExperimentDesign:
 
     @staticmethod
     def __plot_time_helper(time_data: Dict, ax: plt.Axes):
+        import seaborn as sns
         palette = sns.color_palette('deep')
         markers = ['o', 'v', 's', 'P', 'X', '*']
         lw = 2
@@ -276,6 +449,7 @@ class ExperimentDesign:
 
     @staticmethod
     def __plot_trust_helper(trust_data: Dict, ax: plt.Axes):
+        import seaborn as sns
         palette = sns.color_palette('deep')
         markers = ['o', 'v', 's', 'P', 'X', '*']
         lw = 2
@@ -299,13 +473,14 @@ class ExperimentDesign:
         """
         Plots the trust feedback given for the robot using different strategies
         """
+        plt = get_pyplot()
         if dir_path is None:
             dir_path = './data/'
         files = os.listdir(dir_path)
         fig, ax = plt.subplots(figsize=(13, 9))
         trust_data = {}
         for file in files:
-            if 'csv' in file:
+            if not file.endswith('.pkl'):
                 continue
             filepath = path.join(dir_path, file)
             with open(filepath, 'rb') as f:
@@ -323,6 +498,7 @@ class ExperimentDesign:
         """
         Plots the trust feedback given for the robot using different strategies
         """
+        plt = get_pyplot()
         if dir_path is None:
             dir_path = './data/'
         files = os.listdir(dir_path)
@@ -330,7 +506,7 @@ class ExperimentDesign:
         health_data = {}
         time_data = {}
         for file in files:
-            if 'csv' in file:
+            if not file.endswith('.pkl'):
                 continue
             filepath = path.join(dir_path, file)
             with open(filepath, 'rb') as f:
@@ -355,6 +531,7 @@ class ExperimentDesign:
         """
         Plots the trust dynamics separately for each initial condition
         """
+        plt = get_pyplot()
         if dir_path is None:
             dir_path = './data/'
         files = os.listdir(dir_path)
@@ -362,7 +539,7 @@ class ExperimentDesign:
         initial_conditions_indices = set()
         participant_indices = set()
         for file in files:
-            if 'csv' in file:
+            if not file.endswith('.pkl'):
                 continue
             details = file.strip('.pkl').split('_')
             idx1 = int(details[1])
@@ -376,6 +553,9 @@ class ExperimentDesign:
             trust_data[i] = {}
             for j in sorted(participant_indices):
                 filename = f'{dir_path}run_{i}_{j}.pkl'
+                # The adaptive design runs a different number of participants per condition
+                if not path.exists(filename):
+                    continue
                 with open(filename, 'rb') as f:
                     data = pickle.load(f)
                 sim_runner = data['sim_runner']
@@ -407,6 +587,15 @@ class ExperimentDesign:
 
         plt.show()
 
+    @staticmethod
+    def render_figures(dir_path: str | None = None, out_dir: str = './figures/', **kwargs) -> Dict:
+        """
+        Renders all the figures of the plot methods to files in out_dir without opening any windows, skipping the
+        figures whose data have not changed since the last render. See render_figures.render_all for the kwargs
+        """
+        from render_figures import render_all
+        return render_all('./data/' if dir_path is None else dir_path, out_dir, **kwargs)
+
     @staticmethod
     def __initialize_data():
         """
@@ -481,7 +670,7 @@ class ExperimentDesign:
         initial_conditions_indices = set()
         participant_indices = set()
         for file in files:
-            if 'csv' in file:
+            if not file.endswith('.pkl'):
                 continue
             details = file.strip('.pkl').split('_')
             idx1 = int(details[1])
@@ -495,6 +684,9 @@ class ExperimentDesign:
         for i in sorted(initial_conditions_indices):
             for j in sorted(participant_indices):
                 filename = f'{dir_path}run_{i}_{j}.pkl'
+                # The adaptive design runs a different number of participants per condition
+                if not path.exists(filename):
+                    continue
                 with open(filename, 'rb') as f:
                     data = pickle.load(f)
                 sim_runner = data['sim_runner']
@@ -512,6 +704,7 @@ class ExperimentDesign:
                     wh_consts[k] = const_stores[k]['wh'][0]
 
         # Convert to pandas dataframe and save to csv
+        import pandas as pd
         with pd.ExcelWriter('data/csv/sims.xlsx') as writer:
             df = pd.DataFrame(state_dep_store)
             df.to_excel(writer, sheet_name='state_dep', index=False)
@@ -527,10 +720,13 @@ def main():
                            (40, 100), (40, 70), (40, 40)]
     runner = ExperimentDesign(starting_conditions)
     runner.run_and_save_sims()
+    # runner.run_and_save_sims(resume=True)
+    # runner.run_and_save_sims_adaptive()
     # runner.plot_states_visited()
     # runner.plot_trust()
     # runner.plot_health_and_time()
     # runner.plot_trust_separate()
+    # runner.render_figures()
     # runner.convert_to_excel()
 
 
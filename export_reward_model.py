@@ -0,0 +1,18 @@
+"""Converts the pickled state dependent reward model to the plain array artifact loaded by StateDependentWeights"""
+import argparse
+from classes.RewardModels import export_reward_model, MODEL_PATH, SCALER_PATH, ARTIFACT_PATH
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Export the state dependent reward model to a npz artifact')
+    parser.add_argument('--model', default=MODEL_PATH, help='the pickle of the statsmodels OLSResults')
+    parser.add_argument('--scaler', default=SCALER_PATH, help='the pickle of the scikit-learn StandardScaler')
+    parser.add_argument('--out', default=ARTIFACT_PATH, help='the path of the artifact')
+    args = parser.parse_args()
+
+    artifact_hash = export_reward_model(args.model, args.scaler, args.out)
+    print(f"Saved {args.out} (sha256 {artifact_hash})")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,530 @@
+"""Runs simulations over a declarative grid of parameters.
+
+A sweep spec is a json file such as
+    {
+        "base_seed": 1,
+        "num_participants": 20,
+        "fixed": {"num_sites": 5},
+        "grid": {"kappa": [0.1, 0.2], "starting_condition": [[100, 100], [70, 40]]}
+    }
+Every combination of the grid values, applied on top of DEFAULT_CONFIG and the fixed values, is run for every
+participant. Participant j gets the same seed in every configuration, so configurations are compared on the same
+humans and threats.
+"""
+import argparse
+import hashlib
+import itertools
+import json
+import os
+import os.path as path
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from copy import deepcopy
+from dataclasses import dataclass
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.State import RobotInfo
+from classes.Surrogate import SurrogateRecommender
+from classes.FeedbackSchedules import make_feedback_schedule
+from run_simulation import SimRunner, KAPPA, STATE_DEP_TRUST_PARAMS, CONST_TRUST_PARAMS
+from run_manifest import atomic_pickle_dump, atomic_write_bytes, get_config_hash
+from shared_results import SharedResults, read_record, load_block
+from telemetry import EventLog, Heartbeat, PhaseTimer
+
+DEFAULT_CONFIG = {
+    'num_sites': 10,
+    'starting_condition': [100, 100],
+    'prior_threat_level': 0.7,
+    'discount_factor': 0.7,
+    'wh_const': [0.8062],
+    'kappa': KAPPA,
+    'state_dep_trust_params': STATE_DEP_TRUST_PARAMS,
+    'const_trust_params': CONST_TRUST_PARAMS,
+    'common_random_numbers': False,
+    'estimator': 'optimizer',
+}
+# Parameters that are only in a configuration when they are set, so that the hashes of the configurations
+# without them do not change. 'surrogate' is the path of a surrogate recommender artifact of the robots and
+# 'feedback_schedule' the config of a trust feedback schedule, e.g. {"kind": "every_k", "k": 3}. 'scenario' is
+# 'adaptive' or 'upfront', see SimRunner
+OPTIONAL_CONFIG = {
+    'surrogate': None,
+    'feedback_schedule': None,
+    'scenario': 'adaptive',
+}
+# The number of finished tasks of a shared memory sweep after which its block is cached again
+BLOCK_SAVE_INTERVAL = 100
+
+
+class SweepTask:
+    """A single participant run with one configuration"""
+
+    def __init__(self, config: Dict, participant_idx: int, seed: int):
+        self.config = config
+        self.participant_idx = participant_idx
+        self.seed = seed
+        self.threat_seed, self.runner_seed = [int(s) for s in np.random.SeedSequence(seed).generate_state(2)]
+        self.hash = get_config_hash({'config': config, 'seed': seed})
+
+    def get_settings(self) -> SimSettings:
+        start_health, start_time = self.config['starting_condition']
+        return SimSettings(self.config['num_sites'], start_health, start_time,
+                           self.config['prior_threat_level'], self.config['discount_factor'],
+                           threat_seed=self.threat_seed)
+
+    def get_scenario_key(self):
+        """Tasks with the same scenario key have the same threats and threat levels"""
+        return self.config['num_sites'], self.config['prior_threat_level'], self.threat_seed
+
+    def get_sim_runner(self, settings: SimSettings | None = None, recommendation_cache: Dict | None = None):
+        if settings is None:
+            settings = self.get_settings()
+        surrogate = self.config.get('surrogate')
+        if surrogate is not None:
+            surrogate = SurrogateRecommender.load(surrogate)
+        return SimRunner(settings, wh_const=self.config['wh_const'], seed=self.runner_seed,
+                         common_random_numbers=self.config['common_random_numbers'],
+                         kappa=self.config['kappa'],
+                         state_dep_trust_params=self.config['state_dep_trust_params'],
+                         const_trust_params=self.config['const_trust_params'],
+                         recommendation_cache=recommendation_cache,
+                         surrogate=surrogate,
+                         estimator=self.config['estimator'],
+                         feedback_schedule=make_feedback_schedule(self.config.get('feedback_schedule')),
+                         scenario=self.config.get('scenario', OPTIONAL_CONFIG['scenario']))
+
+
+class SweepSpec:
+    """
+    A grid of parameters to sweep over
+    """
+
+    def __init__(self, grid: Dict[str, List], num_participants: int, base_seed: int | None = None,
+                 fixed: Dict | None = None):
+        """
+        :param grid: a dict from a parameter name (a key of DEFAULT_CONFIG or OPTIONAL_CONFIG) to the list of values to sweep over
+        :param num_participants: the number of participants to run for every configuration
+        :param base_seed: the seed from which all the participant seeds are derived (default: None)
+        :param fixed: parameter values that override DEFAULT_CONFIG for all configurations (default: None)
+        """
+        self.grid = grid
+        self.num_participants = num_participants
+        self.base_seed = np.random.SeedSequence(base_seed).entropy
+        self.fixed = {} if fixed is None else fixed
+        for key in list(self.grid.keys()) + list(self.fixed.keys()):
+            if key not in DEFAULT_CONFIG and key not in OPTIONAL_CONFIG:
+                raise ValueError(f"Unknown sweep parameter {key}")
+
+    @classmethod
+    def from_json(cls, file: str):
+        with open(file, 'r') as f:
+            spec = json.load(f)
+        return cls(spec['grid'], spec['num_participants'], spec.get('base_seed'), spec.get('fixed'))
+
+    def to_dict(self) -> Dict:
+        return {'grid': self.grid, 'num_participants': self.num_participants, 'base_seed': self.base_seed,
+                'fixed': self.fixed}
+
+    def get_configs(self) -> List[Dict]:
+        """Returns the full configuration of every point of the grid"""
+        configs = []
+        keys = list(self.grid.keys())
+        for values in itertools.product(*[self.grid[key] for key in keys]):
+            config = deepcopy(DEFAULT_CONFIG)
+            config.update(deepcopy(self.fixed))
+            config.update(dict(zip(keys, deepcopy(values))))
+            configs.append(config)
+
+        return configs
+
+    def get_seed(self, participant_idx: int) -> int:
+        seed_sequence = np.random.SeedSequence(self.base_seed, spawn_key=(participant_idx,))
+        return int(seed_sequence.generate_state(1, dtype=np.uint64)[0])
+
+    def expand(self) -> List[SweepTask]:
+        """Expands the grid into one task per configuration and participant"""
+        return [SweepTask(config, j, self.get_seed(j))
+                for config in self.get_configs()
+                for j in range(self.num_participants)]
+
+    def get_hash(self) -> str:
+        return get_config_hash(self.to_dict())
+
+    def get_shard(self, shard_index: int, shard_count: int) -> List[SweepTask]:
+        """
+        Returns the tasks of one shard. Duplicate configurations are assigned once, and the unique tasks are dealt
+        round-robin in the order of expand(), so every machine computes the same partition without coordination
+        """
+        if not 0 <= shard_index < shard_count:
+            raise ValueError(f"Shard index {shard_index} is out of range for {shard_count} shards")
+        unique_tasks = {}
+        for task in self.expand():
+            unique_tasks.setdefault(task.hash, task)
+        return list(unique_tasks.values())[shard_index::shard_count]
+
+
+def get_first_site_requests(task: SweepTask, settings: SimSettings):
+    """
+    Returns the solve keys and infos of the recommendations of all the robots of a task at the first site
+    """
+    sim_runner = task.get_sim_runner(deepcopy(settings))
+    sim_runner.init_sim()
+    # The threat level at the first site of all strategies is the one chosen in the state dependent simulation
+    _, threat_level = deepcopy(sim_runner.state_dep_sim).choose_threat(0, settings.start_health,
+                                                                       settings.start_time)
+    info = RobotInfo(settings.start_health, settings.start_time, threat_level, settings.d, 0)
+    requests = []
+    for robot in [sim_runner.state_dep_robot] + sim_runner.const_robots:
+        key = robot.get_solve_key(info)
+        if key is not None:
+            requests.append((key, robot, info))
+
+    return requests
+
+
+def solve_request(request):
+    _, robot, info = request
+    return robot.solve(info)
+
+
+@dataclass
+class TaskPayload:
+    """The inputs of a sweep task in a worker"""
+    task: SweepTask
+    # The settings of the task, with the shared scenario
+    settings: SimSettings
+    # The shared first-site recommendations of the task's robots
+    recommendation_cache: Dict
+    # The JSONL event log of the tasks, or None
+    event_file: str | None = None
+    # The handle of the SharedResults block to write the histories to, and the index of the task in it, or None to
+    # return the histories
+    shared_results: Tuple | None = None
+    index: int | None = None
+
+
+def run_task(payload: TaskPayload):
+    """
+    Runs one sweep task in a worker. With a SharedResults block, the histories are written to it and only the
+    strategies are returned, see SweepScheduler.get_result
+    """
+    task = payload.task
+    if payload.event_file is None:
+        tracker = nullcontext(PhaseTimer())
+    else:
+        tracker = EventLog(payload.event_file).task(task.hash, task.seed, get_config_hash(task.config),
+                                                    participant=task.participant_idx)
+    with tracker as timer:
+        sim_runner = task.get_sim_runner(payload.settings, recommendation_cache=dict(payload.recommendation_cache))
+        sim_runner.run(timer)
+    if payload.shared_results is not None:
+        with SharedResults.attach(payload.shared_results) as shared_results:
+            strategies = shared_results.write(payload.index, sim_runner.get_results())
+        return {'hash': task.hash, 'index': payload.index, 'strategies': strategies}
+    return {'hash': task.hash, 'config': task.config, 'participant': task.participant_idx, 'seed': task.seed,
+            'results': sim_runner.get_results()}
+
+
+class SweepScheduler:
+    """
+    Runs the tasks of a sweep across local worker processes. Shared work is done once: duplicate configurations
+    are run once, the threats of a scenario are generated once, and the first-site recommendations shared by
+    several tasks are solved once. Results are cached on disk by the hash of each task's full configuration.
+    The workers write the histories of their runs to a block of shared memory, so that only small completion
+    messages are pickled back, and the block is cached in one write every BLOCK_SAVE_INTERVAL finished tasks and
+    when the sweep ends or fails, so that a rerun after a crash only runs the tasks that were not done. Without
+    shared memory every result is pickled to the cache as soon as it is done.
+    """
+
+    def __init__(self, spec: SweepSpec, cache_dir: str = 'sweep_cache', num_workers: int | None = None,
+                 event_file: str | None = None, shared_memory: bool = True, cache: bool = True):
+        """
+        :param spec: the sweep spec
+        :param cache_dir: the directory of the result cache (default: sweep_cache)
+        :param num_workers: the number of worker processes (default: the number of CPUs)
+        :param event_file: the JSONL event log of the tasks, see telemetry.py (default: None, no log)
+        :param shared_memory: whether the workers return the histories through shared memory instead of pickling
+                              them (default: True)
+        :param cache: whether to load and save the results in the cache directory (default: True)
+        """
+        self.spec = spec
+        self.cache_dir = cache_dir
+        self.num_workers = num_workers
+        self.event_file = event_file
+        self.shared_memory = shared_memory
+        self.cache = cache
+        # The cached blocks of shared memory sweeps, from a task hash to the block file and the task's entry
+        self.blocks = None
+        if cache:
+            os.makedirs(cache_dir, exist_ok=True)
+
+    def get_cache_file(self, task: SweepTask) -> str:
+        return path.join(self.cache_dir, f'{task.hash}.pkl')
+
+    def load_blocks(self) -> Dict[str, Tuple[str, Dict]]:
+        """Returns the entries of the tasks of the cached blocks, from their index files"""
+        blocks = {}
+        for file in sorted(os.listdir(self.cache_dir)):
+            if file.startswith('block_') and file.endswith('.json'):
+                with open(path.join(self.cache_dir, file), 'r') as f:
+                    index = json.load(f)
+                block_file = path.join(self.cache_dir, file[:-len('.json')] + '.npy')
+                for task_hash, entry in index.items():
+                    blocks[task_hash] = (block_file, entry)
+        return blocks
+
+    def load_cached(self, task: SweepTask):
+        if not self.cache:
+            return None
+        file = self.get_cache_file(task)
+        if path.exists(file):
+            try:
+                with open(file, 'rb') as f:
+                    return pickle.load(f)
+            except (EOFError, pickle.UnpicklingError):
+                return None
+
+        if self.blocks is None:
+            self.blocks = self.load_blocks()
+        if task.hash not in self.blocks:
+            return None
+        block_file, entry = self.blocks[task.hash]
+        return {'hash': task.hash, 'config': task.config, 'participant': task.participant_idx, 'seed': task.seed,
+                'results': read_record(load_block(block_file), entry['index'], entry['strategies'])}
+
+    def save_block(self, pending: List[SweepTask], messages: List[Dict], shared_results: SharedResults):
+        """
+        Caches the block of a sweep in one write, with an index of the slots of the tasks of messages. The index is
+        written last, so it never holds a task that its block does not, and a block saved again replaces the last one
+        """
+        name = 'block_' + hashlib.sha256(' '.join(task.hash for task in pending).encode()).hexdigest()[:16]
+        shared_results.save(path.join(self.cache_dir, f'{name}.npy'))
+        index = {message['hash']: {'index': message['index'], 'strategies': message['strategies']}
+                 for message in messages}
+        atomic_write_bytes(path.join(self.cache_dir, f'{name}.json'), json.dumps(index).encode())
+
+    @staticmethod
+    def get_result(task: SweepTask, message: Dict, shared_results: SharedResults | None) -> Dict:
+        """Returns the result of a task from the message of its worker, reading the histories from shared memory"""
+        if shared_results is None:
+            return message
+        return {'hash': task.hash, 'config': task.config, 'participant': task.participant_idx, 'seed': task.seed,
+                'results': shared_results.read(message['index'], message['strategies'])}
+
+    def run(self, tasks: List[SweepTask] | None = None) -> List[Dict]:
+        """
+        Runs the tasks (default: all the tasks of the spec) and returns their results in order
+        """
+        if tasks is None:
+            tasks = self.spec.expand()
+
+        # Identical configurations are run once
+        unique_tasks = {}
+        for task in tasks:
+            unique_tasks.setdefault(task.hash, task)
+
+        results = {}
+        pending = []
+        for task_hash, task in unique_tasks.items():
+            cached = self.load_cached(task)
+            if cached is not None:
+                results[task_hash] = cached
+            else:
+                pending.append(task)
+        print(f"{len(tasks)} tasks, {len(unique_tasks)} unique, {len(results)} cached, {len(pending)} to run")
+        event_log = None if self.event_file is None else EventLog(self.event_file)
+        progress = {'total': len(pending), 'finished': 0, 'cached': len(results)}
+        if event_log is not None:
+            event_log.emit('sweep_start', total=len(pending), cached=len(results), spec_hash=self.spec.get_hash())
+
+        if len(pending) > 0:
+            from tqdm import tqdm
+
+            # The threats of a scenario are generated once and shared
+            scenarios = {}
+            for task in pending:
+                key = task.get_scenario_key()
+                if key not in scenarios:
+                    scenarios[key] = task.get_settings().threat_setter
+            settings_list = []
+            for task in pending:
+                settings = task.get_settings()
+                settings.threat_setter = scenarios[task.get_scenario_key()]
+                settings_list.append(settings)
+
+            # Recommendations at the first site that are shared by several tasks are solved once
+            requests = {}
+            task_keys = []
+            for task, settings in zip(pending, settings_list):
+                keys = []
+                for key, robot, info in get_first_site_requests(task, settings):
+                    requests.setdefault(key, (key, robot, info))
+                    keys.append(key)
+                task_keys.append(keys)
+
+            shared_results = None
+            if self.shared_memory:
+                shared_results = SharedResults(len(pending), max(len(task.config['wh_const']) + 1 for task in pending),
+                                               max(task.config['num_sites'] for task in pending))
+            with ProcessPoolExecutor(max_workers=self.num_workers) as executor, shared_results or nullcontext():
+                requests = list(requests.values())
+                recommendations = dict(zip([r[0] for r in requests],
+                                           executor.map(solve_request, requests)))
+                print(f"Solved {len(requests)} unique first-site recommendations "
+                      f"for {sum(len(keys) for keys in task_keys)} robots")
+
+                handle = None if shared_results is None else shared_results.handle
+                payloads = [TaskPayload(task, settings, {key: recommendations[key] for key in keys}, self.event_file,
+                                        shared_results=handle, index=i)
+                            for i, (task, settings, keys) in enumerate(zip(pending, settings_list, task_keys))]
+                heartbeat = nullcontext() if event_log is None else Heartbeat(event_log, lambda: dict(progress))
+                messages = []
+                saved = 0
+                try:
+                    with heartbeat:
+                        for task, message in tqdm(zip(pending, executor.map(run_task, payloads)), total=len(pending)):
+                            result = self.get_result(task, message, shared_results)
+                            if self.cache and shared_results is None:
+                                atomic_pickle_dump(result, self.get_cache_file(task))
+                            messages.append(message)
+                            results[task.hash] = result
+                            progress['finished'] += 1
+                            if self.cache and shared_results is not None and \
+                                    len(messages) - saved >= BLOCK_SAVE_INTERVAL:
+                                self.save_block(pending, messages, shared_results)
+                                saved = len(messages)
+                finally:
+                    # The tasks that finished before a failure or an interrupt are kept
+                    if self.cache and shared_results is not None and len(messages) > saved:
+                        self.save_block(pending, messages, shared_results)
+
+        if event_log is not None:
+            event_log.emit('sweep_finish', **progress)
+        return [results[task.hash] for task in tasks]
+
+
+def get_shard_file(directory: str, shard_index: int, shard_count: int) -> str:
+    return path.join(directory, f'shard_{shard_index:04d}_of_{shard_count:04d}.pkl')
+
+
+def get_shard_event_file(event_file: str, shard_index: int, shard_count: int) -> str:
+    """
+    Returns the event log of one shard, e.g. events_shard_0003_of_0008.jsonl for events.jsonl. The shards of a sweep
+    share a cache directory, and telemetry.summarize reads the log of a single sweep
+    """
+    root, ext = path.splitext(event_file)
+    return f'{root}_shard_{shard_index:04d}_of_{shard_count:04d}{ext}'
+
+
+def run_shard(spec: SweepSpec, shard_index: int, shard_count: int, out_dir: str, cache_dir: str = 'sweep_cache',
+              num_workers: int | None = None, event_file: str | None = None, shared_memory: bool = True,
+              cache: bool = True) -> str:
+    """
+    Runs one shard of a sweep and saves it to a self-describing file in out_dir. The other arguments are those of
+    SweepScheduler
+    :return: the path of the shard file
+    """
+    tasks = spec.get_shard(shard_index, shard_count)
+    scheduler = SweepScheduler(spec, cache_dir=cache_dir, num_workers=num_workers, event_file=event_file,
+                               shared_memory=shared_memory, cache=cache)
+    results = scheduler.run(tasks)
+    os.makedirs(out_dir, exist_ok=True)
+    file = get_shard_file(out_dir, shard_index, shard_count)
+    atomic_pickle_dump({'spec': spec.to_dict(), 'spec_hash': spec.get_hash(),
+                        'shard_index': shard_index, 'shard_count': shard_count,
+                        'task_hashes': [task.hash for task in tasks], 'results': results}, file)
+    return file
+
+
+def merge_shards(spec: SweepSpec, files: List[str]) -> Dict:
+    """
+    Combines the shard files of a sweep into the dataset that an unsharded run would produce.
+    Raises a ValueError if a shard belongs to another spec, if a shard or a task is missing or duplicated, or if
+    a result was run with a seed other than the one the spec assigns to its participant
+    """
+    spec_hash = spec.get_hash()
+    shard_count = None
+    shard_indices = set()
+    results = {}
+    for file in files:
+        with open(file, 'rb') as f:
+            shard = pickle.load(f)
+        if shard['spec_hash'] != spec_hash:
+            raise ValueError(f"{file} belongs to a different sweep spec")
+        if shard_count is None:
+            shard_count = shard['shard_count']
+        elif shard['shard_count'] != shard_count:
+            raise ValueError(f"{file} was run with {shard['shard_count']} shards instead of {shard_count}")
+        if shard['shard_index'] in shard_indices:
+            raise ValueError(f"Shard {shard['shard_index']} is duplicated")
+        shard_indices.add(shard['shard_index'])
+
+        expected = [task.hash for task in spec.get_shard(shard['shard_index'], shard_count)]
+        if shard['task_hashes'] != expected:
+            raise ValueError(f"{file} does not hold the tasks of shard {shard['shard_index']}")
+        for result in shard['results']:
+            if result['hash'] in results:
+                raise ValueError(f"Task {result['hash']} is duplicated")
+            if result['seed'] != spec.get_seed(result['participant']):
+                raise ValueError(f"Task {result['hash']} was run with seed {result['seed']} instead of "
+                                 f"{spec.get_seed(result['participant'])}")
+            results[result['hash']] = result
+
+    if shard_count is None:
+        raise ValueError("No shards to merge")
+    missing_shards = sorted(set(range(shard_count)) - shard_indices)
+    if len(missing_shards) > 0:
+        raise ValueError(f"Shards {missing_shards} are missing")
+    tasks = spec.expand()
+    missing_tasks = [task.hash for task in tasks if task.hash not in results]
+    if len(missing_tasks) > 0:
+        raise ValueError(f"{len(missing_tasks)} tasks are missing")
+
+    return {'spec': spec.to_dict(), 'results': [results[task.hash] for task in tasks]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run a parameter sweep')
+    parser.add_argument('spec', help='the json file of the sweep spec')
+    parser.add_argument('--out', default=None,
+                        help='the file to save the results to (default: sweep_results.pkl), '
+                             'or the directory of the shard files when running a shard (default: shards)')
+    parser.add_argument('--cache-dir', default='sweep_cache', help='the directory of the result cache')
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes')
+    parser.add_argument('--shard-index', type=int, default=None, help='the shard to run')
+    parser.add_argument('--shard-count', type=int, default=None, help='the number of shards of the sweep')
+    parser.add_argument('--merge', nargs='+', default=None, metavar='SHARD', help='the shard files to merge')
+    parser.add_argument('--events', default=None,
+                        help='the JSONL event log of the tasks (default: events.jsonl in the cache directory). A '
+                             'shard writes to its own log, e.g. events_shard_0003_of_0008.jsonl')
+    parser.add_argument('--no-shared-memory', action='store_true',
+                        help='pickle the histories back from the workers instead of sharing memory')
+    parser.add_argument('--no-cache', action='store_true', help='neither load nor save the cached results')
+    args = parser.parse_args()
+    event_file = args.events or path.join(args.cache_dir, 'events.jsonl')
+
+    spec = SweepSpec.from_json(args.spec)
+    if args.merge is not None:
+        atomic_pickle_dump(merge_shards(spec, args.merge), args.out or 'sweep_results.pkl')
+    elif args.shard_index is not None or args.shard_count is not None:
+        if args.shard_index is None or args.shard_count is None:
+            parser.error("--shard-index and --shard-count must be given together")
+        with open(args.spec, 'r') as f:
+            if json.load(f).get('base_seed') is None:
+                parser.error("A sharded sweep needs a base_seed in its spec so that all shards use the same seeds")
+        file = run_shard(spec, args.shard_index, args.shard_count, args.out or 'shards',
+                         cache_dir=args.cache_dir, num_workers=args.workers,
+                         event_file=get_shard_event_file(event_file, args.shard_index, args.shard_count),
+                         shared_memory=not args.no_shared_memory, cache=not args.no_cache)
+        print(f"Saved shard {args.shard_index} of {args.shard_count} to {file}")
+    else:
+        scheduler = SweepScheduler(spec, cache_dir=args.cache_dir, num_workers=args.workers, event_file=event_file,
+                                   shared_memory=not args.no_shared_memory, cache=not args.no_cache)
+        results = scheduler.run()
+        atomic_pickle_dump({'spec': spec.to_dict(), 'results': results}, args.out or 'sweep_results.pkl')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""Replays simulated humans against a running recommendation server and measures its throughput.
+
+    python recommendation-server/server.py --workers 4 &
+    python recommendation-server/load_generator.py --sessions 32 --concurrency 16
+
+Run both from the root of the repository, where the data of the trust parameters is.
+"""
+import _context
+import argparse
+import asyncio
+import json
+from time import perf_counter
+from typing import Dict, List
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.State import HumanInfo, Observation
+from run_simulation import SimRunner
+
+
+class Client:
+    """A minimal keep-alive HTTP/JSON client"""
+
+    def __init__(self, host: str, port: int):
+        self.host = host
+        self.port = port
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+
+    async def close(self):
+        self.writer.close()
+        await self.writer.wait_closed()
+
+    async def request(self, method: str, target: str, body: Dict | None = None) -> Dict:
+        data = b'' if body is None else json.dumps(body).encode()
+        self.writer.write(f"{method} {target} HTTP/1.1\r\nHost: {self.host}\r\n"
+                          f"Content-Type: application/json\r\nContent-Length: {len(data)}\r\n\r\n".encode() + data)
+        await self.writer.drain()
+        status = int((await self.reader.readline()).decode().split(' ')[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, value = line.decode().split(':', 1)
+            headers[name.strip().lower()] = value.strip()
+        response = json.loads(await self.reader.readexactly(int(headers['content-length'])))
+        if status != 200:
+            raise RuntimeError(f"{method} {target} failed with {status}: {response['error']}")
+        return response
+
+
+async def run_participant(client: Client, settings: SimSettings, strategy: str | float, seed: int,
+                          time_budget: float | None, latencies: List[float]):
+    """
+    Runs one simulated human through a mission, getting every recommendation from the server
+    """
+    sim_runner = SimRunner(settings, wh_const=[], seed=seed)
+    sim_runner.init_humans()
+    human = sim_runner.state_dep_human
+
+    session = await client.request('POST', '/sessions', {
+        'strategy': strategy, 'num_sites': settings.num_sites, 'start_health': settings.start_health,
+        'start_time': settings.start_time, 'prior_threat_level': settings.d, 'discount_factor': settings.df,
+        'seed': seed, 'time_budget': time_budget})
+    session_id = session['session_id']
+    health, time = settings.start_health, settings.start_time
+    for site_idx in range(settings.num_sites):
+        threat = int(settings.threat_setter.threats[site_idx])
+        threat_level = float(settings.threat_setter.after_scan[site_idx])
+
+        start = perf_counter()
+        rec = (await client.request('POST', f'/sessions/{session_id}/recommendation',
+                                    {'threat_level': threat_level}))['recommendation']
+        latencies.append(perf_counter() - start)
+
+        human_info = HumanInfo(health, time, threat_level, rec, site_idx)
+        action = int(human.choose_action(human_info))
+        obs = Observation(threat, action)
+        human.forward(human_info, obs)
+        state = await client.request('POST', f'/sessions/{session_id}/observation',
+                                     {'threat': threat, 'action': action,
+                                      'trust_feedback': float(human.get_trust_sample())})
+        health, time = state['health'], state['time']
+
+    await client.request('DELETE', f'/sessions/{session_id}')
+
+
+async def run_load(host: str, port: int, num_sessions: int, concurrency: int, settings_list: List[SimSettings],
+                   strategies: List[str | float], seed: int | None, time_budget: float | None = None):
+    seeds = np.random.SeedSequence(seed).generate_state(num_sessions)
+    queue = asyncio.Queue()
+    for i in range(num_sessions):
+        queue.put_nowait(i)
+    latencies = []
+
+    async def worker():
+        client = Client(host, port)
+        await client.connect()
+        try:
+            while not queue.empty():
+                i = queue.get_nowait()
+                await run_participant(client, settings_list[i % len(settings_list)],
+                                      strategies[i % len(strategies)], int(seeds[i]), time_budget, latencies)
+        finally:
+            await client.close()
+
+    start = perf_counter()
+    await asyncio.gather(*[worker() for _ in range(concurrency)])
+    elapsed = perf_counter() - start
+
+    client = Client(host, port)
+    await client.connect()
+    metrics = await client.request('GET', '/metrics')
+    await client.close()
+
+    ms = np.array(latencies) * 1000
+    print(f"{num_sessions} sessions, {len(latencies)} recommendations in {elapsed:.2f} s "
+          f"({len(latencies) / elapsed:.1f} recommendations/s)")
+    print(f"Client latency: p50 {np.percentile(ms, 50):.1f} ms, p95 {np.percentile(ms, 95):.1f} ms, "
+          f"p99 {np.percentile(ms, 99):.1f} ms")
+    print(f"Server: {metrics['batches']} batches of {metrics['mean_batch_size']:.1f} requests on average, "
+          f"{metrics['solves']} solves, {metrics['cache_hits']} cache hits, "
+          f"max queue depth {metrics['max_queue_depth']}, tiers {metrics['tiers']}")
+    return {'elapsed': elapsed, 'recommendations': len(latencies), 'server': metrics}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Measure the throughput of the recommendation server')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--sessions', type=int, default=32, help='the number of simulated participants')
+    parser.add_argument('--concurrency', type=int, default=16, help='the number of participants at the same time')
+    parser.add_argument('--num-sites', type=int, default=10)
+    parser.add_argument('--scenarios', type=int, default=4,
+                        help='the number of distinct threat scenarios shared by the participants')
+    parser.add_argument('--strategies', nargs='+', default=['state_dep', '0.8062'])
+    parser.add_argument('--time-budget', type=float, default=None,
+                        help='the time budget of every recommendation in seconds (default: solve exactly)')
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    settings_list = [SimSettings(args.num_sites, 100, 100, 0.7, 0.7, threat_seed=rng.integers(2 ** 32))
+                     for _ in range(args.scenarios)]
+    strategies = [s if s == 'state_dep' else float(s) for s in args.strategies]
+    asyncio.run(run_load(args.host, args.port, args.sessions, args.concurrency, settings_list, strategies,
+                         args.seed, args.time_budget))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,474 @@
+"""A local HTTP/JSON service that makes the robot's recommendations for live sessions.
+
+Every session holds one robot and its model of the participant. A session follows the loop of Simulation.run:
+    POST   /sessions                       create a session, returns its id
+    POST   /sessions/<id>/recommendation   {"threat_level": d} -> {"recommendation": 0 or 1, "tier": ...}
+    POST   /sessions/<id>/observation      {"threat": 0 or 1, "action": 0 or 1, "trust_feedback": t}
+                                           (trust_feedback is optional, without it the trust parameters are refit
+                                           at the next feedback)
+    GET    /sessions/<id>                  the state of the session
+    DELETE /sessions/<id>                  ends the session
+    GET    /metrics                        latency, queue depth and batching statistics
+
+Recommendation requests that arrive within a short window are solved together in one call to a worker pool, and
+requests with the same solve key (e.g. two sessions in the same state) are solved once. A session created with a
+time_budget gets anytime recommendations (see Robot.get_recommendation), and the response names the tier that
+answered.
+"""
+import _context
+import argparse
+import asyncio
+import importlib
+import json
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from time import perf_counter
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.RobotModel import Robot
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.SpecialFunctions import expit
+from classes.RewardModels import StateDependentWeights, ConstantWeights
+from classes.ParamsUpdater import Estimator, ParticleEstimator
+from classes.State import RobotInfo, Observation
+from run_simulation import KAPPA, STATE_DEP_TRUST_PARAMS, CONST_TRUST_PARAMS
+
+DEFAULT_SESSION = {
+    'strategy': 'state_dep',        # 'state_dep' or the constant health reward weight
+    'num_sites': 10,
+    'start_health': 100,
+    'start_time': 100,
+    'prior_threat_level': 0.7,
+    'discount_factor': 0.7,
+    'kappa': KAPPA,
+    'trust_params': None,           # default: STATE_DEP_TRUST_PARAMS or CONST_TRUST_PARAMS
+    'estimator': 'optimizer',
+    'seed': None,
+    'time_budget': None,            # seconds per recommendation, default: solve exactly however long it takes
+}
+
+BATCH_WINDOW = 0.005
+MAX_BATCH_SIZE = 64
+CACHE_SIZE = 100000
+LATENCY_SAMPLES = 10000
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def create_robot(config: Dict) -> Robot:
+    """
+    Creates the robot of a session the same way SimRunner creates its robots
+    :param config: the session configuration (see DEFAULT_SESSION)
+    """
+    rng = np.random.default_rng(config['seed'])
+    settings = SimSettings(config['num_sites'], config['start_health'], config['start_time'],
+                           config['prior_threat_level'], config['discount_factor'],
+                           threat_seed=rng.integers(2 ** 32))
+    if config['strategy'] == 'state_dep':
+        reward_model = StateDependentWeights(add_noise=False)
+        parameters = STATE_DEP_TRUST_PARAMS
+    else:
+        reward_model = ConstantWeights(wh=float(config['strategy']))
+        parameters = CONST_TRUST_PARAMS
+    if config['trust_params'] is not None:
+        parameters = config['trust_params']
+    if config['estimator'] == 'particle':
+        estimator = ParticleEstimator(seed=rng.integers(2 ** 32))
+    elif config['estimator'] == 'optimizer':
+        estimator = Estimator()
+    else:
+        raise ValueError(f"Unknown estimator {config['estimator']}")
+
+    trust_model = BetaDistributionModel(list(parameters), ObservedReward(), seed=rng.integers(2 ** 32))
+    decision_model = BoundedRationalityDisuse(kappa=config['kappa'], seed=rng.integers(2 ** 32))
+    human_model = HumanModel(trust_model, decision_model, reward_model, estimator)
+    robot = Robot(human_model, reward_model, settings)
+    robot.time_budget = config['time_budget']
+    return robot
+
+
+def warm_up():
+    """Loads the lazily imported modules used by the solver and the estimator"""
+    # Estimator.update_model imports the optimizer on first use, which is loaded here so that the first request
+    # does not pay for it
+    importlib.import_module('scipy.optimize')
+    expit(0.)
+
+
+def solve_batch(requests: List[Tuple[Robot, RobotInfo, float | None]]) -> List[Tuple[int, str]]:
+    """
+    Solves a batch of recommendation requests in a worker
+    :param requests: the robot, the information, and the time left of the budget of every request
+    :return: the recommendation of every request and the tier that made it
+    """
+    results = []
+    for robot, info, time_budget in requests:
+        if time_budget is None:
+            results.append((int(robot.solve(info)), 'exact'))
+        else:
+            results.append((int(robot.get_recommendation(info, time_budget)), robot.last_tier))
+    return results
+
+
+class Session:
+    """The state of one live session"""
+
+    def __init__(self, config: Dict):
+        self.config = config
+        self.robot = create_robot(config)
+        self.health = config['start_health']
+        self.time = config['start_time']
+        self.site_idx = 0
+        self.info = None
+        self.lock = asyncio.Lock()
+
+    def to_dict(self) -> Dict:
+        return {'health': self.health, 'time': self.time, 'site_idx': self.site_idx,
+                'num_sites': self.config['num_sites'],
+                'trust_params': [float(p) for p in self.robot.human_model.trust_model.parameters]}
+
+
+class Metrics:
+    """Request latencies, queue depth, and batching statistics of the server"""
+
+    def __init__(self):
+        self.started = perf_counter()
+        self.requests = {}
+        self.errors = 0
+        self.latencies = {}
+        self.queue_depth = 0
+        self.max_queue_depth = 0
+        self.batches = 0
+        self.batched_requests = 0
+        self.solves = 0
+        self.cache_hits = 0
+        self.tiers = {}
+        self.solve_time = 0.
+
+    def add_request(self, endpoint: str, latency: float):
+        self.requests[endpoint] = self.requests.get(endpoint, 0) + 1
+        self.latencies.setdefault(endpoint, deque(maxlen=LATENCY_SAMPLES)).append(latency)
+
+    def set_queue_depth(self, depth: int):
+        self.queue_depth = depth
+        self.max_queue_depth = max(self.max_queue_depth, depth)
+
+    def to_dict(self) -> Dict:
+        latencies = {}
+        for endpoint, samples in self.latencies.items():
+            ms = np.array(samples) * 1000
+            latencies[endpoint] = {'p50_ms': float(np.percentile(ms, 50)), 'p95_ms': float(np.percentile(ms, 95)),
+                                   'p99_ms': float(np.percentile(ms, 99)), 'max_ms': float(ms.max())}
+        return {'uptime_s': perf_counter() - self.started,
+                'requests': self.requests,
+                'errors': self.errors,
+                'latency': latencies,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'batches': self.batches,
+                'mean_batch_size': self.batched_requests / self.batches if self.batches > 0 else 0.,
+                'solves': self.solves,
+                'cache_hits': self.cache_hits,
+                'tiers': self.tiers,
+                'solve_time_s': self.solve_time}
+
+
+class RecommendationBatcher:
+    """
+    Coalesces the recommendation requests that arrive within a window into one batch. The unique requests of a
+    batch are split over the workers of the pool, and solved recommendations are kept in an LRU cache
+    """
+
+    def __init__(self, executor: Executor, num_workers: int, metrics: Metrics, window: float = BATCH_WINDOW,
+                 max_batch_size: int = MAX_BATCH_SIZE, cache_size: int = CACHE_SIZE):
+        """
+        :param executor: the worker pool that runs the solves
+        :param num_workers: the number of workers of the pool
+        :param metrics: the metrics of the server
+        :param window: how long to wait for more requests after the first one of a batch, in seconds
+        :param max_batch_size: the number of requests at which a batch is sent without waiting for the window
+        :param cache_size: the number of recommendations to keep in the cache
+        """
+        self.executor = executor
+        self.num_workers = num_workers
+        self.metrics = metrics
+        self.window = window
+        self.max_batch_size = max_batch_size
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.pending: List[Tuple[object, Robot, RobotInfo, asyncio.Future, float]] = []
+        self.flush_handle = None
+
+    async def get_recommendation(self, robot: Robot, info: RobotInfo) -> Tuple[int, str]:
+        """Returns the recommendation and the tier that made it"""
+        key = robot.get_solve_key(info)
+        if key is not None and key in self.cache:
+            self.cache.move_to_end(key)
+            self.metrics.cache_hits += 1
+            return self.cache[key], 'cache'
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self.pending.append((key, robot, info, future, perf_counter()))
+        self.metrics.set_queue_depth(len(self.pending))
+        if len(self.pending) >= self.max_batch_size:
+            self.flush()
+        elif self.flush_handle is None:
+            self.flush_handle = loop.call_later(self.window, self.flush)
+        return await future
+
+    def flush(self):
+        if self.flush_handle is not None:
+            self.flush_handle.cancel()
+            self.flush_handle = None
+        batch, self.pending = self.pending, []
+        self.metrics.set_queue_depth(0)
+        if len(batch) > 0:
+            asyncio.get_running_loop().create_task(self.solve(batch))
+
+    async def solve(self, batch):
+        # Requests with the same key are solved once. Requests without a key cannot be shared, so they are
+        # grouped by their position in the batch instead
+        groups = OrderedDict()
+        for i, (key, robot, info, future, arrival) in enumerate(batch):
+            groups.setdefault(i if key is None else key, []).append((robot, info, future, arrival))
+        keys = list(groups.keys())
+        # The time spent waiting for the batch counts against the budget
+        now = perf_counter()
+        requests = []
+        for key in keys:
+            robot, info, _, arrival = groups[key][0]
+            time_budget = None if robot.time_budget is None else max(0., robot.time_budget - (now - arrival))
+            requests.append((robot, info, time_budget))
+
+        loop = asyncio.get_running_loop()
+        num_chunks = min(self.num_workers, len(requests))
+        chunks = [requests[i::num_chunks] for i in range(num_chunks)]
+        start = perf_counter()
+        try:
+            chunk_results = await asyncio.gather(*[loop.run_in_executor(self.executor, solve_batch, chunk)
+                                                   for chunk in chunks])
+        except Exception as e:
+            for _, _, _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.metrics.solve_time += perf_counter() - start
+        self.metrics.batches += 1
+        self.metrics.batched_requests += len(batch)
+        self.metrics.solves += len(requests)
+
+        results = [None] * len(requests)
+        for i, chunk_result in enumerate(chunk_results):
+            results[i::num_chunks] = chunk_result
+        for key, (recommendation, tier) in zip(keys, results):
+            self.metrics.tiers[tier] = self.metrics.tiers.get(tier, 0) + 1
+            # Only exact solves are cached, the answers of the other tiers depend on the time there was
+            if not isinstance(key, int) and tier == 'exact':
+                self.cache[key] = recommendation
+                if len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            for _, _, future, _ in groups[key]:
+                if not future.done():
+                    future.set_result((recommendation, tier))
+
+
+class RecommendationServer:
+    """Holds the sessions and serves the HTTP API"""
+
+    def __init__(self, num_workers: int = 4, use_processes: bool = True, window: float = BATCH_WINDOW,
+                 max_batch_size: int = MAX_BATCH_SIZE):
+        """
+        :param num_workers: the number of solver workers
+        :param use_processes: whether the solvers run in worker processes rather than threads (default: True)
+        :param window: the micro-batching window in seconds
+        :param max_batch_size: the largest batch of recommendation requests
+        """
+        self.sessions: Dict[str, Session] = {}
+        self.metrics = Metrics()
+        if use_processes:
+            self.executor = ProcessPoolExecutor(max_workers=num_workers)
+        else:
+            self.executor = ThreadPoolExecutor(max_workers=num_workers)
+        self.num_workers = num_workers
+        self.batcher = RecommendationBatcher(self.executor, num_workers, self.metrics, window, max_batch_size)
+        self.server = None
+
+    async def start(self, host: str = '127.0.0.1', port: int = 8080) -> int:
+        """Starts the workers and the server, and returns the port the server listens on"""
+        # Start the workers up front so that the first requests do not wait for them
+        loop = asyncio.get_running_loop()
+        warm_up()
+        await asyncio.gather(*[loop.run_in_executor(self.executor, warm_up) for _ in range(self.num_workers)])
+        self.server = await asyncio.start_server(self.handle_connection, host, port)
+        return self.server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.server is not None:
+            self.server.close()
+            await self.server.wait_closed()
+        self.executor.shutdown(wait=True)
+
+    def get_session(self, session_id: str) -> Session:
+        if session_id not in self.sessions:
+            raise HTTPError(404, f"Unknown session {session_id}")
+        return self.sessions[session_id]
+
+    async def create_session(self, body: Dict) -> Dict:
+        unknown = set(body.keys()) - set(DEFAULT_SESSION.keys())
+        if len(unknown) > 0:
+            raise HTTPError(400, f"Unknown session parameters {sorted(unknown)}")
+        config = dict(DEFAULT_SESSION)
+        config.update(body)
+        try:
+            session = Session(config)
+        except (ValueError, TypeError) as e:
+            raise HTTPError(400, str(e))
+        session_id = uuid.uuid4().hex
+        self.sessions[session_id] = session
+        return {'session_id': session_id, **session.to_dict()}
+
+    async def recommend(self, session: Session, body: Dict) -> Dict:
+        async with session.lock:
+            if session.site_idx >= session.config['num_sites']:
+                raise HTTPError(409, "The mission is over")
+            threat_level = float(get_field(body, 'threat_level'))
+            session.info = RobotInfo(session.health, session.time, threat_level,
+                                     session.config['prior_threat_level'], session.site_idx)
+            recommendation, tier = await self.batcher.get_recommendation(session.robot, session.info)
+            session.robot.recommendation = recommendation
+            return {'recommendation': recommendation, 'tier': tier, 'site_idx': session.site_idx}
+
+    async def observe(self, session: Session, body: Dict) -> Dict:
+        async with session.lock:
+            if session.info is None:
+                raise HTTPError(409, "No recommendation has been made at this site")
+            obs = Observation(int(get_field(body, 'threat')), int(get_field(body, 'action')))
+            if body.get('trust_feedback') is not None:
+                obs.add_trust_feedback(float(body['trust_feedback']))
+            # Updating the model of the human runs an optimizer, so it is kept off the event loop
+            await asyncio.get_running_loop().run_in_executor(None, session.robot.forward, session.info, obs)
+            session.health = session.info.health
+            session.time = session.info.time
+            session.site_idx += 1
+            session.info = None
+            return session.to_dict()
+
+    async def route(self, method: str, target: str, body: Dict) -> Tuple[str, Dict]:
+        parts = [part for part in target.split('?')[0].split('/') if part != '']
+        if method == 'GET' and parts == ['metrics']:
+            return 'metrics', {**self.metrics.to_dict(), 'sessions': len(self.sessions),
+                               'cache_size': len(self.batcher.cache)}
+        if method == 'POST' and parts == ['sessions']:
+            return 'create', await self.create_session(body)
+        if len(parts) >= 2 and parts[0] == 'sessions':
+            session = self.get_session(parts[1])
+            if len(parts) == 2 and method == 'GET':
+                return 'state', session.to_dict()
+            if len(parts) == 2 and method == 'DELETE':
+                del self.sessions[parts[1]]
+                return 'delete', {}
+            if parts[2:] == ['recommendation'] and method == 'POST':
+                return 'recommendation', await self.recommend(session, body)
+            if parts[2:] == ['observation'] and method == 'POST':
+                return 'observation', await self.observe(session, body)
+        raise HTTPError(404, f"No route for {method} {target}")
+
+    async def handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            while True:
+                request_line = await reader.readline()
+                if request_line == b'':
+                    break
+                start = perf_counter()
+                method, target, _ = request_line.decode().split(' ', 2)
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, value = line.decode().split(':', 1)
+                    headers[name.strip().lower()] = value.strip()
+                data = await reader.readexactly(int(headers.get('content-length', 0)))
+
+                try:
+                    try:
+                        body = json.loads(data) if len(data) > 0 else {}
+                    except json.JSONDecodeError:
+                        raise HTTPError(400, "The body is not valid json")
+                    endpoint, response = await self.route(method, target, body)
+                    status = 200
+                except HTTPError as e:
+                    endpoint, status, response = 'error', e.status, {'error': e.message}
+                except (ValueError, TypeError) as e:
+                    endpoint, status, response = 'error', 400, {'error': str(e)}
+                except Exception as e:
+                    endpoint, status, response = 'error', 500, {'error': repr(e)}
+                if status != 200:
+                    self.metrics.errors += 1
+
+                write_response(writer, status, response)
+                await writer.drain()
+                self.metrics.add_request(endpoint, perf_counter() - start)
+                if headers.get('connection', '').lower() == 'close':
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            writer.close()
+
+
+def get_field(body: Dict, name: str):
+    if name not in body:
+        raise HTTPError(400, f"Missing field {name}")
+    return body[name]
+
+
+STATUS_TEXT = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 409: 'Conflict', 500: 'Internal Server Error'}
+
+
+def write_response(writer: asyncio.StreamWriter, status: int, response: Dict):
+    data = json.dumps(response).encode()
+    writer.write(f"HTTP/1.1 {status} {STATUS_TEXT[status]}\r\n"
+                 f"Content-Type: application/json\r\n"
+                 f"Content-Length: {len(data)}\r\n\r\n".encode() + data)
+
+
+async def serve(host: str, port: int, num_workers: int, use_processes: bool, window: float, max_batch_size: int):
+    server = RecommendationServer(num_workers, use_processes, window, max_batch_size)
+    port = await server.start(host, port)
+    print(f"Serving recommendations on http://{host}:{port}")
+    try:
+        await server.server.serve_forever()
+    finally:
+        await server.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Serve the robot recommendations of live sessions')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--workers', type=int, default=4, help='the number of solver workers')
+    parser.add_argument('--threads', action='store_true', help='run the solvers in threads instead of processes')
+    parser.add_argument('--window', type=float, default=BATCH_WINDOW, help='the batching window in seconds')
+    parser.add_argument('--max-batch-size', type=int, default=MAX_BATCH_SIZE)
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.workers, not args.threads, args.window, args.max_batch_size))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+"""Renders all the figures of the saved runs to files, without opening any windows:
+
+    python render_figures.py --data-dir data --out figures --formats png svg
+
+The runs are loaded once, in parallel, and reduced to the aggregates the figures are drawn from (the means and 95%
+confidence intervals of trust, health and time, and the counts of the states visited). The figures are then rendered
+with the non-interactive Agg backend across a process pool. A manifest in the output directory records the hash of
+the aggregates of every figure, and figures whose aggregates have not changed since the last render are skipped.
+"""
+import argparse
+import hashlib
+import json
+import os
+import os.path as path
+import pickle
+import re
+from concurrent.futures import ProcessPoolExecutor
+from time import time
+from typing import Dict, List, Tuple
+import numpy as np
+from run_manifest import atomic_write_bytes
+from adaptive_sampling import get_strategy_key
+
+FIGURES_MANIFEST_FILE = 'figures.json'
+# Increase when the drawing of the figures changes, so that all figures are rendered again
+FIGURES_VERSION = 1
+# The bins of the heatmaps of the states visited
+HEALTH_BINS = list(range(0, 110, 10))
+TIME_BINS = list(range(0, 110, 10))
+
+RUN_FILE_PATTERN = re.compile(r'run_(\d+)_(\d+)\.pkl$')
+
+
+def load_histories(file: str) -> Dict:
+    """
+    Loads a saved run and returns the trust, health and time histories of all its strategies, keyed by the
+    strategy key ('state_dep' or the constant health reward weight)
+    """
+    with open(file, 'rb') as f:
+        data = pickle.load(f)
+    sim_runner = data['sim_runner']
+    match = RUN_FILE_PATTERN.search(path.basename(file))
+    strategies = {}
+    for sim in [sim_runner.state_dep_sim] + sim_runner.const_sims:
+        strategies[get_strategy_key(sim)] = {'trust': [float(t) for t in sim.trust_history],
+                                             'health': [int(h) for h in sim.health_history],
+                                             'time': [int(t) for t in sim.time_history]}
+    return {'condition': None if match is None else int(match.group(1)),
+            'starting_condition': list(data.get('starting_condition', [])),
+            'strategies': strategies}
+
+
+def get_mean_ci(histories: List[List[float]]) -> Dict[str, List[float]]:
+    """Returns the mean and the half width of the 95% confidence interval of the histories at every site"""
+    values = np.array(histories, dtype=float)
+    mean = values.mean(axis=0)
+    ci = 1.96 * values.std(axis=0) / np.sqrt(values.shape[0])
+    return {'mean': mean.tolist(), 'ci': ci.tolist()}
+
+
+def get_state_counts(runs: List[Dict], key: str) -> List[List[int]]:
+    """Returns the number of visits of every (health, time) bin by a strategy over all the runs"""
+    counts = np.zeros((len(HEALTH_BINS), len(TIME_BINS)), dtype=int)
+    for run in runs:
+        history = run['strategies'][key]
+        for health, _time in zip(history['health'], history['time']):
+            if health in HEALTH_BINS and _time in TIME_BINS:
+                counts[HEALTH_BINS.index(health), TIME_BINS.index(_time)] += 1
+    return counts.tolist()
+
+
+def get_aggregates(runs: List[Dict]) -> Dict:
+    """
+    Reduces the histories of the runs to the aggregates of the figures
+    :param runs: the outputs of load_histories
+    """
+    if len(runs) == 0:
+        raise ValueError("There are no runs to aggregate")
+    keys = list(runs[0]['strategies'].keys())
+    aggregates = {'strategies': keys, 'trust': {}, 'health': {}, 'time': {}, 'states_visited': {},
+                  'conditions': {}}
+    for key in keys:
+        for name in ['trust', 'health', 'time']:
+            aggregates[name][key] = get_mean_ci([run['strategies'][key][name] for run in runs])
+        aggregates['states_visited'][key] = get_state_counts(runs, key)
+
+    conditions = sorted({run['condition'] for run in runs if run['condition'] is not None})
+    for i in conditions:
+        condition_runs = [run for run in runs if run['condition'] == i]
+        aggregates['conditions'][str(i)] = {
+            'starting_condition': condition_runs[0]['starting_condition'],
+            'trust': {key: get_mean_ci([run['strategies'][key]['trust'] for run in condition_runs])
+                      for key in keys}}
+    return aggregates
+
+
+def get_figure_jobs(aggregates: Dict) -> List[Tuple[str, str, Dict]]:
+    """Returns the name, the kind, and the input aggregates of every figure"""
+    jobs = [('trust', 'trust', {'trust': aggregates['trust']}),
+            ('health_and_time', 'health_and_time', {'health': aggregates['health'], 'time': aggregates['time']})]
+    for key in aggregates['strategies']:
+        jobs.append((f'states_visited_{key}', 'states_visited',
+                     {'key': key, 'counts': aggregates['states_visited'][key]}))
+    for i, condition in aggregates['conditions'].items():
+        jobs.append((f'trust_condition_{i}', 'trust', {'trust': condition['trust'],
+                                                       'starting_condition': condition['starting_condition']}))
+    return jobs
+
+
+def get_input_hash(kind: str, inputs: Dict, formats: List[str]) -> str:
+    record = {'version': FIGURES_VERSION, 'kind': kind, 'inputs': inputs, 'formats': sorted(formats)}
+    return hashlib.sha256(json.dumps(record, sort_keys=True).encode()).hexdigest()
+
+
+def plot_mean_ci(ax, data: Dict[str, Dict], ylabel: str):
+    """Plots the mean and the 95% confidence interval of every strategy"""
+    import seaborn as sns
+    palette = sns.color_palette('deep')
+    markers = ['o', 'v', 's', 'P', 'X', '*']
+    for i, (key, values) in enumerate(data.items()):
+        mean, ci = np.array(values['mean']), np.array(values['ci'])
+        x = np.arange(1, len(mean) + 1)
+        ax.plot(x, mean, lw=2, label=key, c=palette[i], marker=markers[i])
+        ax.fill_between(x, mean - ci, mean + ci, color=palette[i], alpha=0.5)
+    ax.set_xlabel('Interactions')
+    ax.set_ylabel(ylabel)
+    ax.legend()
+    ax.grid('y')
+
+
+def render_figure(job: Tuple[str, str, Dict, str, List[str]]) -> List[str]:
+    """
+    Renders one figure in a worker with the Agg backend
+    :param job: the name, kind and inputs of the figure, the output directory, and the file formats
+    :return: the paths of the written files
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    from experiment_design import get_pyplot
+    plt = get_pyplot()
+
+    name, kind, inputs, out_dir, formats = job
+    if kind == 'trust':
+        fig, ax = plt.subplots(figsize=(13, 9))
+        plot_mean_ci(ax, inputs['trust'], 'Trust')
+        ax.set_ylim([0.3, 1.0])
+        if 'starting_condition' in inputs:
+            health, _time = inputs['starting_condition']
+            ax.set_title(f'Starting Health: {health}, Time: {_time}')
+    elif kind == 'health_and_time':
+        fig, (ax1, ax2) = plt.subplots(nrows=1, ncols=2, figsize=(13, 10))
+        plot_mean_ci(ax1, inputs['health'], 'Health')
+        ax1.set_ylim([0, 105])
+        plot_mean_ci(ax2, inputs['time'], 'Time')
+        ax2.set_ylim([0, 105])
+    elif kind == 'states_visited':
+        fig, ax = plt.subplots()
+        im = ax.imshow(np.array(inputs['counts']), origin='lower')
+        ax.set_yticks(np.arange(len(HEALTH_BINS)), labels=HEALTH_BINS)
+        ax.set_xticks(np.arange(len(TIME_BINS)), labels=TIME_BINS)
+        ax.set_title(inputs['key'])
+        ax.set_xlabel('Time remaining')
+        ax.set_ylabel('Health remaining')
+        fig.colorbar(im, ax=ax)
+    else:
+        raise ValueError(f"Unknown figure kind {kind}")
+
+    fig.tight_layout()
+    files = []
+    for fmt in formats:
+        file = path.join(out_dir, f'{name}.{fmt}')
+        fig.savefig(file, format=fmt)
+        files.append(file)
+    plt.close(fig)
+    return files
+
+
+def render_all(data_dir: str = 'data', out_dir: str = 'figures', formats: List[str] | None = None,
+               num_workers: int | None = None, force: bool = False) -> Dict:
+    """
+    Renders all the figures of the runs saved in a directory
+    :param data_dir: the directory of the run_<condition>_<participant>.pkl files
+    :param out_dir: the directory of the figures and their manifest
+    :param formats: the file formats of the figures (default: png and svg)
+    :param num_workers: the number of worker processes (default: the number of CPUs)
+    :param force: whether to render the figures whose aggregates have not changed too (default: False)
+    :return: the manifest, with the names of the figures rendered and skipped in this call
+    """
+    formats = ['png', 'svg'] if formats is None else list(formats)
+    os.makedirs(out_dir, exist_ok=True)
+    manifest_file = path.join(out_dir, FIGURES_MANIFEST_FILE)
+    figures = {}
+    if path.exists(manifest_file):
+        with open(manifest_file, 'r') as f:
+            figures = json.load(f)['figures']
+
+    files = sorted(path.join(data_dir, file) for file in os.listdir(data_dir) if file.endswith('.pkl'))
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        runs = list(executor.map(load_histories, files, chunksize=max(len(files) // 64, 1)))
+        aggregates = get_aggregates(runs)
+
+        pending, skipped = [], []
+        for name, kind, inputs in get_figure_jobs(aggregates):
+            input_hash = get_input_hash(kind, inputs, formats)
+            previous = figures.get(name)
+            if (not force and previous is not None and previous['hash'] == input_hash and
+                    all(path.exists(file) for file in previous['files'])):
+                skipped.append(name)
+                continue
+            pending.append((name, kind, inputs, input_hash))
+
+        jobs = [(name, kind, inputs, out_dir, formats) for name, kind, inputs, _ in pending]
+        for (name, _, _, input_hash), written in zip(pending, executor.map(render_figure, jobs)):
+            figures[name] = {'hash': input_hash, 'files': written, 'rendered': time()}
+
+    manifest = {'data_dir': data_dir, 'num_runs': len(runs), 'figures': figures}
+    atomic_write_bytes(manifest_file, json.dumps(manifest, indent=1).encode())
+    manifest['rendered'] = [name for name, _, _, _ in pending]
+    manifest['skipped'] = skipped
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Render the figures of the saved runs to files')
+    parser.add_argument('--data-dir', default='data', help='the directory of the saved runs')
+    parser.add_argument('--out', default='figures', help='the directory of the figures')
+    parser.add_argument('--formats', nargs='+', default=['png', 'svg'])
+    parser.add_argument('--workers', type=int, default=None, help='the number of worker processes')
+    parser.add_argument('--force', action='store_true', help='render the unchanged figures too')
+    args = parser.parse_args()
+
+    manifest = render_all(args.data_dir, args.out, args.formats, args.workers, args.force)
+    print(f"Rendered {len(manifest['rendered'])} figures from {manifest['num_runs']} runs to {args.out}, "
+          f"skipped {len(manifest['skipped'])} unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,249 @@
+"""A SQLite catalog of the saved runs, with one row per run and strategy and the summaries of its outcome, so that
+runs can be filtered without unpickling every file:
+
+    python run_catalog.py data/catalog.sqlite --filter start_health=70 --filter start_time=40 \\
+        --filter strategy=0.81 --filter final_health__lt=30
+
+The trajectories of the matching runs are only loaded from their files when asked for (see RunHandle).
+"""
+import argparse
+import os
+import os.path as path
+import pickle
+import sqlite3
+from time import time
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.Simulation import Simulation
+from adaptive_sampling import get_outcome_metrics, get_strategy_key
+
+# The columns of the catalog and their SQLite types. A run is identified by its task and strategy
+COLUMNS = {
+    'task': 'TEXT',
+    'strategy': 'TEXT',
+    'condition': 'INTEGER',
+    'participant': 'INTEGER',
+    'start_health': 'INTEGER',
+    'start_time': 'INTEGER',
+    'num_sites': 'INTEGER',
+    'seed': 'TEXT',
+    'config_hash': 'TEXT',
+    'file': 'TEXT',
+    'sha256': 'TEXT',
+    'final_health': 'REAL',
+    'final_time': 'REAL',
+    'mean_trust': 'REAL',
+    'min_trust': 'REAL',
+    'acceptance_rate': 'REAL',
+    'num_threats': 'INTEGER',
+    'created': 'REAL',
+}
+# The comparison operators of the filters, given as a suffix of the column name, e.g. final_health__lt=30
+OPERATORS = {'eq': '=', 'ne': '!=', 'lt': '<', 'le': '<=', 'gt': '>', 'ge': '>='}
+
+
+def get_summary(sim: Simulation) -> Dict:
+    """Returns the summaries of the outcome of a simulation that are stored in the catalog"""
+    summary = get_outcome_metrics(sim)
+    summary['min_trust'] = float(np.min(sim.trust_history))
+    summary['num_threats'] = int(np.sum(sim.threat_history))
+    return summary
+
+
+class RunHandle:
+    """
+    A row of the catalog. The trajectory of the run is loaded from its file on first use
+    """
+
+    def __init__(self, row: Dict):
+        self.row = row
+        self._sim = None
+
+    def __getitem__(self, column: str):
+        return self.row[column]
+
+    def __repr__(self):
+        return f"RunHandle(task={self.row['task']!r}, strategy={self.row['strategy']!r}, file={self.row['file']!r})"
+
+    def load(self) -> Simulation:
+        """Returns the simulation of this run and strategy from the saved SimRunner"""
+        if self._sim is None:
+            with open(self.row['file'], 'rb') as f:
+                sim_runner = pickle.load(f)['sim_runner']
+            for sim in [sim_runner.state_dep_sim] + sim_runner.const_sims:
+                if get_strategy_key(sim) == self.row['strategy']:
+                    self._sim = sim
+                    break
+            else:
+                raise KeyError(f"{self.row['file']} has no strategy {self.row['strategy']}")
+        return self._sim
+
+    def get_history(self) -> Dict[str, List]:
+        """Returns the histories of the simulation, see Simulation.get_history"""
+        return self.load().get_history()
+
+
+class RunCatalog:
+    """
+    One row per run and strategy, updated as the runs finish. Rewriting a run replaces its rows
+    """
+
+    def __init__(self, file: str):
+        """
+        :param file: the path of the SQLite database, created if it does not exist
+        """
+        self.file = file
+        directory = path.dirname(path.abspath(file))
+        os.makedirs(directory, exist_ok=True)
+        # Several processes may add runs, so a writer waits for the lock instead of failing
+        self.connection = sqlite3.connect(file, timeout=60.)
+        self.connection.row_factory = sqlite3.Row
+        columns = ', '.join(f'{name} {sql_type}' for name, sql_type in COLUMNS.items())
+        with self.connection:
+            self.connection.execute(f'CREATE TABLE IF NOT EXISTS runs ({columns}, PRIMARY KEY (task, strategy))')
+            for name in ['start_health, start_time', 'strategy', 'config_hash']:
+                index = name.replace(', ', '_')
+                self.connection.execute(f'CREATE INDEX IF NOT EXISTS runs_{index} ON runs ({name})')
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def add_run(self, task: str, sim_runner, file: str, seed: int | None = None, config_hash: str | None = None,
+                sha256: str | None = None, condition: int | None = None, participant: int | None = None):
+        """
+        Adds the rows of all the strategies of a run
+        :param task: the id of the run, e.g. '<condition>_<participant>'
+        :param sim_runner: the SimRunner that has been run
+        :param file: the path of the pickle the run was saved to
+        :param seed: the seed of the run
+        :param config_hash: the hash of the configuration of the run
+        :param sha256: the hash of the saved file
+        """
+        settings = sim_runner.sim_settings
+        rows = []
+        for sim in [sim_runner.state_dep_sim] + sim_runner.const_sims:
+            row = {'task': task, 'strategy': get_strategy_key(sim), 'condition': condition,
+                   'participant': participant, 'start_health': settings.start_health,
+                   'start_time': settings.start_time, 'num_sites': settings.num_sites,
+                   # The seeds are 128-bit integers, which SQLite cannot store as integers
+                   'seed': None if seed is None else str(seed), 'config_hash': config_hash, 'file': file,
+                   'sha256': sha256, 'created': time()}
+            row.update(get_summary(sim))
+            rows.append(tuple(row[name] for name in COLUMNS))
+
+        placeholders = ', '.join('?' for _ in COLUMNS)
+        with self.connection:
+            self.connection.executemany(f'INSERT OR REPLACE INTO runs VALUES ({placeholders})', rows)
+
+    def add_manifest(self, manifest, config_hash: str | None = None) -> int:
+        """
+        Adds the completed runs of a RunManifest that are not in the catalog yet, e.g. of sweeps saved before the
+        catalog existed
+        :return: the number of runs added
+        """
+        known = {row[0] for row in self.connection.execute('SELECT DISTINCT task FROM runs')}
+        num_added = 0
+        for task in manifest.completed_tasks():
+            key = manifest.get_key(task['condition'], task['participant'])
+            if key in known:
+                continue
+            with open(task['path'], 'rb') as f:
+                sim_runner = pickle.load(f)['sim_runner']
+            self.add_run(key, sim_runner, task['path'], seed=task['seed'], config_hash=config_hash,
+                         sha256=task['sha256'], condition=task['condition'], participant=task['participant'])
+            num_added += 1
+        return num_added
+
+    @staticmethod
+    def get_where(filters: Dict) -> Tuple[str, List]:
+        """Returns the WHERE clause and its parameters of the filters of query"""
+        clauses, params = [], []
+        for key, value in filters.items():
+            name, _, op = key.partition('__')
+            if name not in COLUMNS or (op != '' and op != 'in' and op not in OPERATORS):
+                raise ValueError(f"Unknown filter {key}")
+            if name == 'seed' and value is not None:
+                value = [str(v) for v in value] if op == 'in' else str(value)
+            if op == 'in':
+                clauses.append(f"{name} IN ({', '.join('?' for _ in value)})")
+                params.extend(value)
+            elif value is None:
+                clauses.append(f"{name} IS {'NOT ' if op == 'ne' else ''}NULL")
+            else:
+                clauses.append(f"{name} {OPERATORS[op or 'eq']} ?")
+                params.append(value)
+        return ' AND '.join(clauses) if len(clauses) > 0 else '1', params
+
+    def query(self, order_by: str | None = None, limit: int | None = None, **filters) -> List[RunHandle]:
+        """
+        Returns the runs that match all the filters, e.g.
+            catalog.query(start_health=70, start_time=40, strategy='0.81', final_health__lt=30)
+        :param order_by: the column to sort by, descending if prefixed with '-' (default: None, the insertion order)
+        :param limit: the largest number of runs to return (default: None, all)
+        :param filters: column=value for equality, column__<op>=value with op one of eq, ne, lt, le, gt, ge, or
+                        column__in=[values]
+        """
+        where, params = self.get_where(filters)
+        sql = f'SELECT * FROM runs WHERE {where}'
+        if order_by is not None:
+            name = order_by.lstrip('-')
+            if name not in COLUMNS:
+                raise ValueError(f"Unknown column {name}")
+            sql += f" ORDER BY {name} {'DESC' if order_by.startswith('-') else 'ASC'}"
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return [RunHandle(dict(row)) for row in self.connection.execute(sql, params)]
+
+    def count(self, **filters) -> int:
+        """Returns the number of runs that match all the filters of query"""
+        where, params = self.get_where(filters)
+        return self.connection.execute(f'SELECT COUNT(*) FROM runs WHERE {where}', params).fetchone()[0]
+
+
+def parse_filter(text: str) -> Tuple[str, object]:
+    """Parses a filter of the command line, e.g. final_health__lt=30"""
+    key, _, value = text.partition('=')
+    name = key.partition('__')[0]
+    if name not in COLUMNS:
+        raise argparse.ArgumentTypeError(f"Unknown column {name}")
+    if COLUMNS[name] == 'INTEGER':
+        return key, int(value)
+    if COLUMNS[name] == 'REAL':
+        return key, float(value)
+    return key, value
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query the catalog of saved runs')
+    parser.add_argument('file', help='the SQLite catalog')
+    parser.add_argument('--filter', type=parse_filter, action='append', default=[],
+                        help='a filter such as start_health=70 or final_health__lt=30, may be repeated')
+    parser.add_argument('--order-by', default=None, help='the column to sort by, prefix with - for descending')
+    parser.add_argument('--limit', type=int, default=None)
+    parser.add_argument('--add-manifest', default=None, metavar='MANIFEST',
+                        help='first add the completed runs of a manifest that are not in the catalog')
+    args = parser.parse_args()
+
+    with RunCatalog(args.file) as catalog:
+        if args.add_manifest is not None:
+            from run_manifest import RunManifest
+            num_added = catalog.add_manifest(RunManifest(args.add_manifest, resume=True))
+            print(f"Added {num_added} runs from {args.add_manifest}")
+        handles = catalog.query(order_by=args.order_by, limit=args.limit, **dict(args.filter))
+        columns = ['task', 'strategy', 'start_health', 'start_time', 'final_health', 'final_time', 'mean_trust',
+                   'acceptance_rate', 'file']
+        print('\t'.join(columns))
+        for handle in handles:
+            print('\t'.join(f'{handle[c]:.3f}' if isinstance(handle[c], float) else str(handle[c])
+                            for c in columns))
+        print(f"{len(handles)} runs")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+import hashlib
+import json
+import os
+import os.path as path
+import pickle
+import tempfile
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.Serialization import slim_state
+
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+
+
+def atomic_write_bytes(file: str, data: bytes):
+    """
+    Writes the data to a temporary file in the same directory and renames it to the target, so that the target
+    is either the old file or the complete new one, never a partial file
+    """
+    directory = path.dirname(path.abspath(file))
+    fd, tmp_file = tempfile.mkstemp(dir=directory, prefix=f'.{path.basename(file)}.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+    except BaseException:
+        if path.exists(tmp_file):
+            os.remove(tmp_file)
+        raise
+
+
+def atomic_pickle_dump(obj, file: str, slim: bool = False) -> str:
+    """
+    Pickles the object to the file atomically
+    :param slim: whether to leave out the state that is only needed to continue a run (see slim_state)
+    :return: the sha256 hash of the written file
+    """
+    if slim:
+        with slim_state():
+            data = pickle.dumps(obj)
+    else:
+        data = pickle.dumps(obj)
+    atomic_write_bytes(file, data)
+    return hashlib.sha256(data).hexdigest()
+
+
+def get_config_hash(config: Dict) -> str:
+    """Returns the sha256 hash of a json-serializable configuration"""
+    return hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+
+
+def file_hash(file: str) -> str:
+    sha = hashlib.sha256()
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+class RunManifest:
+    """
+    Keeps track of the status, seed, and output file of every (starting condition, participant) task of a sweep,
+    so that an interrupted sweep can be resumed.
+    The file is a journal of JSON lines: a header with the base seed, then one record per change of a task, which
+    is appended so that the cost of an update does not grow with the length of the sweep. save compacts it to one
+    line per task. Manifests saved as a single JSON object by earlier versions are still loaded
+    """
+
+    def __init__(self, file: str, base_seed: int | None = None, resume: bool = False):
+        """
+        :param file: the path of the manifest json file
+        :param base_seed: the seed from which all the task seeds are derived. Ignored when resuming
+        :param resume: whether to load the existing manifest to resume the sweep (default: False)
+        """
+        self.file = file
+        self.tasks: Dict[str, Dict] = {}
+        # Whether the file holds the header of this manifest, so that records can be appended to it
+        self.saved = False
+        if resume and path.exists(file):
+            self.load()
+            self.saved = True
+        else:
+            self.base_seed = np.random.SeedSequence(base_seed).entropy
+
+    def load(self):
+        with open(self.file, 'r') as f:
+            text = f.read()
+        try:
+            data = json.loads(text)
+        except json.JSONDecodeError:
+            data = None
+        if isinstance(data, dict) and 'tasks' in data:
+            self.base_seed = data['base_seed']
+            self.tasks = data['tasks']
+            return
+
+        lines = text.splitlines()
+        self.base_seed = json.loads(lines[0])['base_seed']
+        for line in lines[1:]:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # The last record of an interrupted append, its task is treated as not started
+                continue
+            key = record.pop('key')
+            # A start record has the whole task, the others only the changes
+            if 'condition' in record:
+                self.tasks[key] = record
+            task = self.tasks[key]
+            task.update(record)
+            if task['status'] != FAILED:
+                task.pop('error', None)
+
+    @staticmethod
+    def get_key(condition_idx: int, participant_idx: int) -> str:
+        return f'{condition_idx}_{participant_idx}'
+
+    def get_seed(self, condition_idx: int, participant_idx: int) -> int:
+        """Returns the seed of a task, derived deterministically from the base seed"""
+        seed_sequence = np.random.SeedSequence(self.base_seed, spawn_key=(condition_idx, participant_idx))
+        return int(seed_sequence.generate_state(1, dtype=np.uint64)[0])
+
+    def save(self):
+        """Writes the whole manifest, with one line per task"""
+        lines = [json.dumps({'base_seed': self.base_seed})]
+        lines.extend(json.dumps({'key': key, **task}) for key, task in self.tasks.items())
+        atomic_write_bytes(self.file, ('\n'.join(lines) + '\n').encode())
+        self.saved = True
+
+    def append(self, key: str, record: Dict):
+        """Appends the change of a task to the file"""
+        if not self.saved:
+            self.save()
+            return
+        with open(self.file, 'a') as f:
+            f.write(json.dumps({'key': key, **record}) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    def start(self, condition_idx: int, participant_idx: int, starting_condition: Tuple[int, int],
+              output_file: str) -> int:
+        """
+        Marks a task as running
+        :return: the seed of the task
+        """
+        seed = self.get_seed(condition_idx, participant_idx)
+        key = self.get_key(condition_idx, participant_idx)
+        self.tasks[key] = {
+            'condition': condition_idx,
+            'participant': participant_idx,
+            'starting_condition': list(starting_condition),
+            'seed': seed,
+            'path': output_file,
+            'status': RUNNING,
+        }
+        self.append(key, self.tasks[key])
+        return seed
+
+    def finish(self, condition_idx: int, participant_idx: int, sha256: str):
+        key = self.get_key(condition_idx, participant_idx)
+        task = self.tasks[key]
+        task['status'] = DONE
+        task['sha256'] = sha256
+        task.pop('error', None)
+        self.append(key, {'status': DONE, 'sha256': sha256})
+
+    def fail(self, condition_idx: int, participant_idx: int, error: BaseException):
+        key = self.get_key(condition_idx, participant_idx)
+        task = self.tasks[key]
+        task['status'] = FAILED
+        task['error'] = repr(error)
+        self.append(key, {'status': FAILED, 'error': task['error']})
+
+    def is_complete(self, condition_idx: int, participant_idx: int) -> bool:
+        """
+        A task is complete if it finished and its output file is present and has not been corrupted
+        """
+        task = self.tasks.get(self.get_key(condition_idx, participant_idx))
+        if task is None or task['status'] != DONE or not path.exists(task['path']):
+            return False
+        return file_hash(task['path']) == task['sha256']
+
+    def completed_tasks(self) -> List[Dict]:
+        return [task for task in self.tasks.values()
+                if self.is_complete(task['condition'], task['participant'])]
@@ -2,13 +2,17 @@
 #        and one with the learnt state-dependent reward weights (still non-adaptive)
 from time import perf_counter
 import sys
+from concurrent.futures import Executor
+from contextlib import nullcontext
 from copy import deepcopy
-from typing import List
+from typing import Dict, List
 import numpy as np
-import pandas as pd
 from classes.SimSettings import SimSettings
 from classes.Simulation import Simulation
 from classes.RobotModel import Robot
+from classes.GlobalPolicy import GlobalPolicyCache
+from classes.Surrogate import SurrogateRecommender
+from classes.FeedbackSchedules import FeedbackScheduleBase
 from classes.HumanModels import Human, HumanModel
 from classes.TrustModels import BetaDistributionModel
 from classes.PerformanceMetrics import ObservedReward
@@ -16,13 +20,96 @@ from classes.DecisionModels import BoundedRationalityDisuse
 from classes.RewardModels import StateDependentWeights, ConstantWeights
 from classes.ParamsGenerator import TrustParamsGenerator
 from classes.State import HumanInfo
+from classes.CommonRandomNumbers import CommonRandomNumbers
+from classes.ThreatSetter import SmartThreatChooser
+from classes.ParamsUpdater import Estimator, ParticleEstimator
+from classes.Serialization import get_state, set_state
+
+# Rationality coefficient of the humans and the human models
+KAPPA = 0.2
+# Initial trust parameters [alpha0, beta0, ws, wf] of the robots' human models
+STATE_DEP_TRUST_PARAMS = [10., 10., 10., 20.]
+CONST_TRUST_PARAMS = [10., 10., 20., 30.]
+
+
+# The global policy cache of the robots run in a worker process
+_worker_policy_cache = None
+
+
+def run_sim(sim: Simulation, use_policy_cache: bool = False) -> Simulation:
+    """
+    Runs a simulation in a worker and returns it
+    :param use_policy_cache: whether to give the robot the policy cache of the worker process if it has none, as
+                             the cache of a runner is not pickled with its robots
+    """
+    global _worker_policy_cache
+    if use_policy_cache and sim.robot.policy_cache is None:
+        if _worker_policy_cache is None:
+            _worker_policy_cache = GlobalPolicyCache()
+        sim.robot.policy_cache = _worker_policy_cache
+    sim.run()
+    return sim
 
 
 class SimRunner:
     """
     Sets up and runs the simulation
     """
-    def __init__(self, settings: SimSettings, wh_const: List[float]):
+    def __init__(self, settings: SimSettings, wh_const: List[float], seed: int | None = None,
+                 common_random_numbers: bool = False, kappa: float = KAPPA,
+                 state_dep_trust_params: List[float] | None = None,
+                 const_trust_params: List[float] | None = None,
+                 recommendation_cache: Dict | None = None,
+                 policy_cache: GlobalPolicyCache | None = None,
+                 surrogate: SurrogateRecommender | None = None,
+                 estimator: str = 'optimizer',
+                 feedback_schedule: FeedbackScheduleBase | None = None,
+                 scenario: str = 'adaptive'):
+        """
+        :param settings: the simulation settings
+        :param wh_const: the health reward weights of the robots using constant weights
+        :param seed: the seed from which the seeds of all the random number generators are derived (default: None)
+        :param common_random_numbers: whether the human's copies for all strategies draw their decisions and trust
+                                      samples from the same per-site random numbers (default: False)
+        :param kappa: the rationality coefficient of the humans and the human models (default: KAPPA)
+        :param state_dep_trust_params: the initial trust parameters of the state dependent robot's human model
+                                       (default: STATE_DEP_TRUST_PARAMS)
+        :param const_trust_params: the initial trust parameters of the constant weights robots' human models
+                                   (default: CONST_TRUST_PARAMS)
+        :param recommendation_cache: a dict of recommendations shared by all the robots (default: None)
+        :param policy_cache: a cache of the global policies of whole missions shared by all the robots, to look the
+                             recommendations up instead of solving every query (default: None)
+        :param surrogate: a surrogate recommender of the robots, for fast approximate runs (default: None)
+        :param estimator: the estimator of the trust parameters used by the robots, 'optimizer' for the maximum
+                          likelihood estimate or 'particle' for the particle filter (default: 'optimizer')
+        :param feedback_schedule: the schedule of the sites after which the robots get the human's trust feedback
+                                  and refit the trust parameters (default: None, after every site)
+        :param scenario: how the threats of the smartly chosen sites are decided. 'adaptive' chooses them during the
+                         state dependent simulation from the robot's state at each site, so the other strategies
+                         wait for it to copy its threats. 'upfront' chooses them before the run from the state at
+                         the start of the mission, so all the strategies can run at the same time (default:
+                         'adaptive')
+        """
+        if estimator not in ('optimizer', 'particle'):
+            raise ValueError(f"Unknown estimator {estimator}")
+        if scenario not in ('adaptive', 'upfront'):
+            raise ValueError(f"Unknown scenario {scenario}")
+        self.scenario = scenario
+        self.estimator = estimator
+        self.common_random_numbers = common_random_numbers
+        self.kappa = kappa
+        self.state_dep_trust_params = list(STATE_DEP_TRUST_PARAMS if state_dep_trust_params is None
+                                           else state_dep_trust_params)
+        self.const_trust_params = list(CONST_TRUST_PARAMS if const_trust_params is None else const_trust_params)
+        self.recommendation_cache = recommendation_cache
+        self.policy_cache = policy_cache
+        self.surrogate = surrogate
+        self.feedback_schedule = feedback_schedule
+        # Record the entropy so that a run started without a seed can still be reproduced
+        seed_sequence = np.random.SeedSequence(seed)
+        self.seed = seed_sequence.entropy
+        self.robots_seed, self.humans_seed, self.sims_seed = [int(s) for s in seed_sequence.generate_state(3)]
+
         self.state_dep_sim = None
         self.const_sims = None
         self.sim_settings = settings
@@ -35,15 +122,34 @@ class SimRunner:
         self.state_dep_human = None
         self.const_humans = None
 
+    def __getstate__(self):
+        # The caches may be shared with other runs, so they are not saved with this one
+        return get_state(self, rng_attributes=(), drop=('recommendation_cache', 'policy_cache'))
+
+    def __setstate__(self, state):
+        set_state(self, state, rng_attributes=(),
+                  defaults={'estimator': 'optimizer', 'common_random_numbers': False, 'kappa': KAPPA,
+                            'state_dep_trust_params': list(STATE_DEP_TRUST_PARAMS),
+                            'const_trust_params': list(CONST_TRUST_PARAMS), 'recommendation_cache': None,
+                            'policy_cache': None, 'surrogate': None, 'feedback_schedule': None,
+                            'scenario': 'adaptive',
+                            'seed': None, 'robots_seed': None, 'humans_seed': None, 'sims_seed': None})
+
+    def get_estimator(self, rng: np.random.Generator):
+        if self.estimator == 'particle':
+            return ParticleEstimator(seed=rng.integers(2 ** 32))
+        return Estimator()
+
     def init_robots(self):
+        rng = np.random.default_rng(self.robots_seed)
 
         # Trust model
-        parameters = [10., 10., 10., 20.]
+        parameters = list(self.state_dep_trust_params)
         performance_metric = ObservedReward()
-        trust_model = BetaDistributionModel(parameters, performance_metric, seed=None)
+        trust_model = BetaDistributionModel(parameters, performance_metric, seed=rng.integers(2 ** 32))
 
         # Decision model
-        decision_model = BoundedRationalityDisuse(kappa=0.2, seed=None)
+        decision_model = BoundedRationalityDisuse(kappa=self.kappa, seed=rng.integers(2 ** 32))
 
         # Reward model
         reward_model = StateDependentWeights(add_noise=False)
@@ -51,7 +157,8 @@ class SimRunner:
         # Human model
         human_model = HumanModel(deepcopy(trust_model),
                                  deepcopy(decision_model),
-                                 deepcopy(reward_model))
+                                 deepcopy(reward_model),
+                                 self.get_estimator(rng))
 
         # Robot with state dependent reward weights
         self.state_dep_robot = Robot(deepcopy(human_model),
@@ -61,13 +168,13 @@ class SimRunner:
 
         for wh in self.wh_const:
             # Trust model
-            parameters = [10., 10., 20., 30.]
+            parameters = list(self.const_trust_params)
             performance_metric = ObservedReward()
             trust_model = BetaDistributionModel(deepcopy(parameters),
-                                                deepcopy(performance_metric), seed=None)
+                                                deepcopy(performance_metric), seed=rng.integers(2 ** 32))
 
             # Decision model
-            decision_model = BoundedRationalityDisuse(kappa=0.2, seed=None)
+            decision_model = BoundedRationalityDisuse(kappa=self.kappa, seed=rng.integers(2 ** 32))
 
             # Reward model
             reward_model = ConstantWeights(wh=wh)
@@ -75,23 +182,29 @@ class SimRunner:
             # Human model
             human_model = HumanModel(deepcopy(trust_model),
                                      deepcopy(decision_model),
-                                     deepcopy(reward_model))
+                                     deepcopy(reward_model),
+                                     self.get_estimator(rng))
 
             # Robot
             self.const_robots.append(Robot(deepcopy(human_model),
                                            deepcopy(reward_model),
                                            deepcopy(self.sim_settings)))
 
+        for robot in [self.state_dep_robot] + self.const_robots:
+            robot.recommendation_cache = self.recommendation_cache
+            robot.policy_cache = self.policy_cache
+
     def init_humans(self):
+        rng = np.random.default_rng(self.humans_seed)
 
-        params_generator = TrustParamsGenerator(seed=None, add_noise=True)
+        params_generator = TrustParamsGenerator(seed=rng.integers(2 ** 32), add_noise=True)
         params_list = params_generator.generate()
         performance_metric = ObservedReward()
         trust_model = BetaDistributionModel(deepcopy(params_list),
-                                            deepcopy(performance_metric), seed=None)
+                                            deepcopy(performance_metric), seed=rng.integers(2 ** 32))
 
         # Decision model
-        decision_model = BoundedRationalityDisuse(kappa=0.2, seed=None)
+        decision_model = BoundedRationalityDisuse(kappa=self.kappa, seed=rng.integers(2 ** 32))
 
         # Reward model
         reward_model = StateDependentWeights(add_noise=False)
@@ -107,30 +220,117 @@ class SimRunner:
                                            deepcopy(decision_model),
                                            deepcopy(reward_model)))
 
+        if self.common_random_numbers:
+            crn = CommonRandomNumbers(self.sim_settings.num_sites, seed=rng.integers(2 ** 32))
+            for human in [self.state_dep_human] + self.const_humans:
+                human.use_common_random_numbers(crn)
+
+    def get_feedback_schedule(self) -> FeedbackScheduleBase | None:
+        if self.feedback_schedule is None:
+            return None
+        return self.feedback_schedule.for_run(self.seed)
+
+    def set_upfront_scenario(self, seed: int):
+        """
+        Decides the threats and threat levels of all the sites before the run. The smartly chosen sites use the
+        health reward weight of the state dependent strategy at the start of the mission
+        """
+        settings = self.sim_settings
+        threat_setter = settings.threat_setter
+        wh_state_dep = [self.state_dep_robot.reward_model.get_wh(
+            HumanInfo(settings.start_health, settings.start_time, 0, 0, site_idx))
+            for site_idx in range(settings.num_sites)]
+        threat_setter.threats, threat_setter.after_scan = SmartThreatChooser(seed).choose_scenario(
+            threat_setter.threats, threat_setter.after_scan, wh_state_dep)
+
     def init_sim(self):
         self.init_robots()
         self.init_humans()
+        rng = np.random.default_rng(self.sims_seed)
+        if self.scenario == 'upfront':
+            # A separate stream, so that the simulations get the same seeds as in an adaptive run
+            scenario_rng = np.random.default_rng(np.random.SeedSequence(self.sims_seed, spawn_key=(0,)))
+            self.set_upfront_scenario(scenario_rng.integers(2 ** 32))
         self.state_dep_sim = Simulation(deepcopy(self.sim_settings),
                                         self.state_dep_robot,
                                         self.state_dep_human,
-                                        choose_smartly=True)
+                                        choose_smartly=self.scenario == 'adaptive',
+                                        seed=rng.integers(2 ** 32),
+                                        surrogate=self.surrogate,
+                                        feedback_schedule=self.get_feedback_schedule())
         self.const_sims = []
         for i in range(len(self.wh_const)):
             self.const_sims.append(Simulation(self.sim_settings, self.const_robots[i], self.const_humans[i],
-                                              choose_smartly=False))
+                                              choose_smartly=False, seed=rng.integers(2 ** 32),
+                                              surrogate=self.surrogate,
+                                              feedback_schedule=self.get_feedback_schedule()))
+
+    def run(self, timer=None, executor: Executor | None = None):
+        """
+        :param timer: an optional telemetry PhaseTimer to record the time of the 'init', 'state_dep' and 'const'
+                      phases in, or the 'init' and 'sims' phases of an upfront scenario (default: None)
+        :param executor: a thread or process pool to run the simulations that do not wait for each other in
+                         (default: None, run them one after another)
+        """
+        def phase(name: str):
+            return nullcontext() if timer is None else timer.phase(name)
+
+        with phase('init'):
+            self.init_sim()
+
+        if self.scenario == 'upfront':
+            # All the strategies see the same threats from the start
+            with phase('sims'):
+                self.run_sims([self.state_dep_sim] + self.const_sims, executor)
+            return
 
-    def run(self):
-        self.init_sim()
         # The below takes about 10 seconds
-        self.state_dep_sim.run()
+        with phase('state_dep'):
+            self.state_dep_sim.run()
 
         # One constant sim takes about 4 seconds
-        for const_sim in self.const_sims:
-            settings = const_sim.settings
-            settings.threat_setter.after_scan = np.array(self.state_dep_sim.threat_level_history)
-            settings.threat_setter.threats = np.array(self.state_dep_sim.threat_history)
-            const_sim.update_settings(settings)
-            const_sim.run()
+        with phase('const'):
+            for const_sim in self.const_sims:
+                settings = const_sim.settings
+                settings.threat_setter.after_scan = np.array(self.state_dep_sim.threat_level_history)
+                settings.threat_setter.threats = np.array(self.state_dep_sim.threat_history)
+                const_sim.update_settings(settings)
+            self.run_sims(self.const_sims, executor)
+
+    def run_sims(self, sims: List[Simulation], executor: Executor | None = None):
+        """
+        Runs the simulations, in the executor if given. A process pool returns copies of the simulations, which
+        replace the ones of this runner
+        """
+        if executor is None:
+            for sim in sims:
+                sim.run()
+            return
+
+        done = list(executor.map(run_sim, sims, [self.policy_cache is not None] * len(sims)))
+        for sim, done_sim in zip(sims, done):
+            if done_sim is sim:
+                continue
+            # The caches of the robots are not pickled with them
+            done_sim.robot.recommendation_cache = self.recommendation_cache
+            done_sim.robot.policy_cache = self.policy_cache
+            if sim is self.state_dep_sim:
+                self.state_dep_sim = done_sim
+                self.state_dep_robot, self.state_dep_human = done_sim.robot, done_sim.human
+            else:
+                i = self.const_sims.index(sim)
+                self.const_sims[i] = done_sim
+                self.const_robots[i], self.const_humans[i] = done_sim.robot, done_sim.human
+
+    def get_results(self):
+        """
+        Returns the histories of all the simulations, keyed by strategy ('state_dep' or the constant weight)
+        """
+        results = {'state_dep': self.state_dep_sim.get_history()}
+        for wh, sim in zip(self.wh_const, self.const_sims):
+            results[f'{wh:.2f}'] = sim.get_history()
+
+        return results
 
     def __print_helper(self, sim):
         health_history = sim.health_history
@@ -150,6 +350,7 @@ class SimRunner:
                 'Trust': sim.trust_history, 'Action': sim.action_history,
                 'wh': wh_list}
 
+        import pandas as pd
         df = pd.DataFrame(data)
         print(df)
 
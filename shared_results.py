@@ -0,0 +1,144 @@
+"""A block of shared memory that worker processes write the histories of their runs into, so that only a small
+completion message travels back to the parent instead of the pickled results.
+
+The block holds one record per (task, strategy) slot with the histories of Simulation.get_history, padded to the
+largest number of sites of the tasks. The parent creates the block, passes its small handle to the workers, and reads
+the histories back, or works on the arrays of the block directly.
+"""
+import io
+from multiprocessing import shared_memory
+from typing import Dict, List, Tuple
+import numpy as np
+from run_manifest import atomic_write_bytes
+
+# The histories of a run and their dtypes. The histories of the site outcomes have one entry per site, the health and
+# time have one more for the start of the mission
+SITE_HISTORIES = {'threat': np.int64, 'threat_level': np.float64, 'recommendation': np.int64, 'action': np.int64,
+                  'trust': np.float64, 'feedback': np.bool_}
+STATE_HISTORIES = {'health': np.int64, 'time': np.int64}
+
+
+def get_record_dtype(num_sites: int) -> np.dtype:
+    """Returns the structured dtype of the histories of one strategy of a run of up to num_sites sites"""
+    fields = [('num_sites', np.int64), ('has_feedback', np.bool_)]
+    fields += [(name, dtype, (num_sites + 1,)) for name, dtype in STATE_HISTORIES.items()]
+    fields += [(name, dtype, (num_sites,)) for name, dtype in SITE_HISTORIES.items()]
+    return np.dtype(fields)
+
+
+def read_record(array: np.ndarray, task_idx: int, strategies: List[str]) -> Dict[str, Dict[str, List]]:
+    """
+    Returns the histories of a run in the format of SimRunner.get_results
+    :param array: the records of a SharedResults block, or of a block saved with SharedResults.save
+    :param task_idx: the index of the run
+    :param strategies: the strategies that SharedResults.write returned for the run
+    """
+    results = {}
+    for slot, strategy in enumerate(strategies):
+        record = array[task_idx, slot]
+        num_sites = int(record['num_sites'])
+        if num_sites < 0:
+            raise ValueError(f"Task {task_idx} has not been written")
+        history = {name: record[name][:num_sites + 1].tolist() for name in STATE_HISTORIES}
+        for name in SITE_HISTORIES:
+            if name != 'feedback' or record['has_feedback']:
+                history[name] = record[name][:num_sites].tolist()
+        results[strategy] = history
+    return results
+
+
+def load_block(file: str) -> np.ndarray:
+    """Maps the records of a block saved with SharedResults.save"""
+    return np.load(file, mmap_mode='r')
+
+
+class SharedResults:
+    """
+    The histories of num_tasks runs with up to num_strategies strategies and num_sites sites each, in shared memory
+    """
+
+    def __init__(self, num_tasks: int, num_strategies: int, num_sites: int, name: str | None = None):
+        """
+        Creates the block, or attaches to the existing block of that name
+        :param num_tasks: the number of runs
+        :param num_strategies: the largest number of strategies of a run
+        :param num_sites: the largest number of sites of a run
+        :param name: the name of an existing block to attach to (default: None, create a new block)
+        """
+        self.num_tasks = num_tasks
+        self.num_strategies = num_strategies
+        self.num_sites = num_sites
+        dtype = get_record_dtype(num_sites)
+        shape = (num_tasks, num_strategies)
+        self.owner = name is None
+        if self.owner:
+            self.shm = shared_memory.SharedMemory(create=True, size=max(int(np.prod(shape)) * dtype.itemsize, 1))
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+        self.array = np.ndarray(shape, dtype=dtype, buffer=self.shm.buf)
+        if self.owner:
+            self.array['num_sites'] = -1
+
+    @property
+    def handle(self) -> Tuple[int, int, int, str]:
+        """The small picklable handle that a worker attaches to the block with, see attach"""
+        return self.num_tasks, self.num_strategies, self.num_sites, self.shm.name
+
+    @classmethod
+    def attach(cls, handle: Tuple[int, int, int, str]):
+        num_tasks, num_strategies, num_sites, name = handle
+        return cls(num_tasks, num_strategies, num_sites, name=name)
+
+    def close(self):
+        """Detaches from the block, and frees it if this is the block's creator"""
+        # The views of the buffer must be released before the memory is closed
+        self.array = None
+        self.shm.close()
+        if self.owner:
+            self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def write(self, task_idx: int, results: Dict[str, Dict[str, List]]) -> List[str]:
+        """
+        Writes the histories of the strategies of a run to its slots
+        :param task_idx: the index of the run
+        :param results: the histories of every strategy, as SimRunner.get_results returns them
+        :return: the strategies in the order of their slots
+        """
+        if len(results) > self.num_strategies:
+            raise ValueError(f"The run has {len(results)} strategies, the block has room for {self.num_strategies}")
+        strategies = list(results.keys())
+        for slot, strategy in enumerate(strategies):
+            history = results[strategy]
+            num_sites = len(history['threat'])
+            if num_sites > self.num_sites:
+                raise ValueError(f"The run has {num_sites} sites, the block has room for {self.num_sites}")
+            record = self.array[task_idx, slot]
+            for name in STATE_HISTORIES:
+                record[name][:num_sites + 1] = history[name]
+            has_feedback = 'feedback' in history
+            for name in SITE_HISTORIES:
+                if name != 'feedback' or has_feedback:
+                    record[name][:num_sites] = history[name]
+            record['has_feedback'] = has_feedback
+            record['num_sites'] = num_sites
+        return strategies
+
+    def read(self, task_idx: int, strategies: List[str]) -> Dict[str, Dict[str, List]]:
+        """
+        Returns the histories of a run in the format of SimRunner.get_results
+        :param task_idx: the index of the run
+        :param strategies: the strategies that write returned for the run
+        """
+        return read_record(self.array, task_idx, strategies)
+
+    def save(self, file: str):
+        """Saves the records of the block to an .npy file in one write, see load_block"""
+        buffer = io.BytesIO()
+        np.save(buffer, self.array)
+        atomic_write_bytes(file, buffer.getvalue())
@@ -0,0 +1,248 @@
+"""A JSONL event log of the tasks of long-running sweeps, and a summarizer of the log.
+
+Every line is a json object with the 'event' ('sweep_start', 'task_start', 'task_finish', 'task_fail', 'heartbeat',
+'sweep_finish'), the unix 'time', and the 'worker' that wrote it. The log can be summarized while the sweep is
+running:
+
+    python telemetry.py data/events.jsonl --watch 30
+"""
+import argparse
+import json
+import os
+import socket
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter, sleep, time
+from typing import Callable, Dict, List
+import numpy as np
+
+# The number of seconds between the heartbeats of a sweep
+HEARTBEAT_INTERVAL = 30.
+# The number of seconds of the recent throughput that the ETA is computed from
+RATE_WINDOW = 300.
+
+
+def get_worker_id() -> str:
+    return f'{socket.gethostname()}:{os.getpid()}'
+
+
+def get_peak_rss_mb() -> float | None:
+    """Returns the peak resident set size of this process in MB, or None where it is not available"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return peak / (1 << 20) if sys.platform == 'darwin' else peak / (1 << 10)
+
+
+class EventLog:
+    """
+    Appends events to a JSONL file. Every event is written with a single call and flushed, so the processes of a
+    sweep can share the file and the lines can be read while it is written
+    """
+
+    def __init__(self, file: str):
+        self.file = file
+        self.worker = get_worker_id()
+        self.lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(file))
+        os.makedirs(directory, exist_ok=True)
+
+    def emit(self, event: str, **fields):
+        record = {'event': event, 'time': time(), 'worker': self.worker}
+        record.update(fields)
+        line = json.dumps(record, default=str) + '\n'
+        with self.lock:
+            with open(self.file, 'a') as f:
+                f.write(line)
+
+    @contextmanager
+    def task(self, task_id: str, seed: int, config_hash: str, **fields):
+        """
+        Emits the start of a task, and its finish with the duration, the peak RSS and the phase timings, or its
+        failure with the error. Yields the PhaseTimer of the task
+        """
+        timer = PhaseTimer()
+        self.emit('task_start', task=task_id, seed=seed, config_hash=config_hash, **fields)
+        start = perf_counter()
+        try:
+            yield timer
+        except BaseException as e:
+            self.emit('task_fail', task=task_id, seed=seed, config_hash=config_hash,
+                      duration=perf_counter() - start, error=repr(e), phases=timer.phases, **fields)
+            raise
+        self.emit('task_finish', task=task_id, seed=seed, config_hash=config_hash,
+                  duration=perf_counter() - start, peak_rss_mb=get_peak_rss_mb(), phases=timer.phases, **fields)
+
+
+class PhaseTimer:
+    """Accumulates the time spent in the named phases of a task"""
+
+    def __init__(self):
+        self.phases: Dict[str, float] = {}
+
+    @contextmanager
+    def phase(self, name: str):
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self.phases[name] = self.phases.get(name, 0.) + perf_counter() - start
+
+
+class Heartbeat:
+    """
+    Emits a heartbeat with the progress of a sweep every interval from a background thread, so that a stalled
+    sweep can be told from a slow one
+    """
+
+    def __init__(self, log: EventLog, get_progress: Callable[[], Dict], interval: float = HEARTBEAT_INTERVAL):
+        """
+        :param log: the event log
+        :param get_progress: returns the fields of a heartbeat, e.g. the numbers of finished and failed tasks
+        :param interval: the number of seconds between heartbeats
+        """
+        self.log = log
+        self.get_progress = get_progress
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+
+    def __run(self):
+        while not self.stopped.wait(self.interval):
+            self.log.emit('heartbeat', peak_rss_mb=get_peak_rss_mb(), **self.get_progress())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.stopped.set()
+        self.thread.join()
+
+
+def read_events(file: str) -> List[Dict]:
+    """Reads the events of a log, skipping a last line that is still being written"""
+    events = []
+    with open(file, 'r') as f:
+        for line in f:
+            try:
+                events.append(json.loads(line))
+            except json.JSONDecodeError:
+                continue
+    return events
+
+
+def summarize(events: List[Dict], now: float | None = None, window: float = RATE_WINDOW) -> Dict:
+    """
+    Summarizes the last sweep of a log
+    :param events: the events of the log
+    :param now: the current unix time (default: the time of the sweep's finish, or the time now if it is running)
+    :param window: the number of seconds of recent throughput that the ETA is computed from
+    :return: a dict of the progress, throughput, ETA, tail latencies, per-worker throughput, slowest tasks, and
+             failures
+    """
+    starts = [i for i, e in enumerate(events) if e['event'] == 'sweep_start']
+    if len(starts) > 0:
+        events = events[starts[-1]:]
+    if len(events) == 0:
+        raise ValueError("The log has no events")
+    sweep_start = events[0] if events[0]['event'] == 'sweep_start' else None
+    finished = [e for e in events if e['event'] == 'task_finish']
+    failed = [e for e in events if e['event'] == 'task_fail']
+    ended = {e['task'] for e in finished + failed}
+    running = {e['task'] for e in events if e['event'] == 'task_start'} - ended
+    sweep_finished = any(e['event'] == 'sweep_finish' for e in events)
+    if now is None:
+        now = events[-1]['time'] if sweep_finished else time()
+
+    start_time = events[0]['time']
+    elapsed = max(now - start_time, 1e-9)
+    total = None if sweep_start is None else sweep_start.get('total')
+    recent = [e for e in finished if e['time'] >= now - window]
+    recent_rate = len(recent) / min(window, elapsed)
+    remaining = None if total is None else max(total - len(finished) - len(failed), 0)
+    eta = None
+    if remaining is not None and recent_rate > 0:
+        eta = remaining / recent_rate
+
+    durations = np.array([e['duration'] for e in finished])
+    latencies = {}
+    if len(durations) > 0:
+        for q in [50, 90, 99]:
+            latencies[f'p{q}'] = float(np.percentile(durations, q))
+        latencies['max'] = float(durations.max())
+
+    workers = {}
+    for e in finished:
+        worker = workers.setdefault(e['worker'], {'finished': 0, 'busy': 0., 'peak_rss_mb': None})
+        worker['finished'] += 1
+        worker['busy'] += e['duration']
+        if e.get('peak_rss_mb') is not None:
+            worker['peak_rss_mb'] = max(worker['peak_rss_mb'] or 0., e['peak_rss_mb'])
+    for worker in workers.values():
+        worker['runs_per_sec'] = worker['finished'] / elapsed
+        worker['mean_duration'] = worker['busy'] / worker['finished']
+
+    slowest = sorted(finished, key=lambda e: e['duration'], reverse=True)[:5]
+    return {'total': total, 'finished': len(finished), 'failed': len(failed), 'running': sorted(running),
+            'done': sweep_finished, 'elapsed': elapsed, 'runs_per_sec': len(finished) / elapsed,
+            'recent_runs_per_sec': recent_rate, 'eta': eta, 'latencies': latencies, 'workers': workers,
+            'slowest': [{'task': e['task'], 'duration': e['duration'], 'phases': e.get('phases', {})}
+                        for e in slowest],
+            'failures': [{'task': e['task'], 'error': e.get('error')} for e in failed],
+            'last_event_age': now - events[-1]['time']}
+
+
+def format_duration(seconds: float | None) -> str:
+    if seconds is None:
+        return '-'
+    hours, rest = divmod(int(seconds), 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+def print_summary(summary: Dict):
+    total = '?' if summary['total'] is None else summary['total']
+    status = 'finished' if summary['done'] else 'running'
+    print(f"Sweep {status}: {summary['finished']}/{total} tasks finished, {summary['failed']} failed, "
+          f"{len(summary['running'])} running, elapsed {format_duration(summary['elapsed'])}")
+    print(f"Throughput: {summary['runs_per_sec']:.3f} runs/s overall, {summary['recent_runs_per_sec']:.3f} runs/s "
+          f"recently, ETA {format_duration(summary['eta'])}")
+    if len(summary['latencies']) > 0:
+        print('Task duration: ' + ', '.join(f"{name} {value:.2f} s" for name, value in summary['latencies'].items()))
+    for worker, stats in sorted(summary['workers'].items()):
+        rss = '-' if stats['peak_rss_mb'] is None else f"{stats['peak_rss_mb']:.0f} MB"
+        print(f"  {worker}: {stats['finished']} tasks, {stats['runs_per_sec']:.3f} runs/s, "
+              f"mean {stats['mean_duration']:.2f} s, peak RSS {rss}")
+    if len(summary['slowest']) > 0:
+        print('Slowest tasks: ' + ', '.join(f"{e['task']} ({e['duration']:.2f} s)" for e in summary['slowest']))
+    for failure in summary['failures']:
+        print(f"Failed {failure['task']}: {failure['error']}")
+    if not summary['done'] and summary['last_event_age'] > 3 * HEARTBEAT_INTERVAL:
+        print(f"No events for {format_duration(summary['last_event_age'])}, the sweep may have stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Summarize the event log of a sweep')
+    parser.add_argument('file', help='the JSONL event log')
+    parser.add_argument('--window', type=float, default=RATE_WINDOW,
+                        help='the number of seconds of recent throughput that the ETA is computed from')
+    parser.add_argument('--watch', type=float, default=None, metavar='SECONDS',
+                        help='print the summary again every SECONDS until the sweep finishes')
+    args = parser.parse_args()
+
+    while True:
+        summary = summarize(read_events(args.file), window=args.window)
+        print_summary(summary)
+        if args.watch is None or summary['done']:
+            break
+        print()
+        sleep(args.watch)
+
+
+if __name__ == "__main__":
+    main()
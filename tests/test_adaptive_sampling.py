@@ -0,0 +1,49 @@
+import _context
+import math
+from types import SimpleNamespace
+import numpy as np
+import pytest
+from classes.RewardModels import ConstantWeights
+from adaptive_sampling import RunningStatistics, SequentialSampler, Z_95
+
+
+def get_sim(final_health: int, trust: float):
+    """A stand-in for a simulation that has been run, with the histories the outcome metrics are computed from"""
+    return SimpleNamespace(robot=SimpleNamespace(reward_model=ConstantWeights(0.8)),
+                           health_history=[100, final_health], time_history=[100, 90], trust_history=[trust],
+                           action_history=[1], rec_history=[1])
+
+
+def test_running_statistics_match_numpy():
+    values = np.random.default_rng(1).normal(3., 2., size=500)
+    stats = RunningStatistics()
+    assert stats.std == math.inf and stats.ci_width == math.inf
+    for value in values:
+        stats.add(value)
+    assert stats.n == 500
+    assert stats.mean == pytest.approx(values.mean())
+    assert stats.std == pytest.approx(values.std(ddof=1))
+    assert stats.ci_width == pytest.approx(2 * Z_95 * values.std(ddof=1) / math.sqrt(500))
+
+
+def test_allocation_stops_at_the_target_width():
+    sampler = SequentialSampler(2, budget=1000, batch_size=10)
+    assert sampler.allocate() == {0: 10, 1: 10}
+    rng = np.random.default_rng(2)
+    for _ in range(10):
+        # Condition 0 has almost no spread and converges, condition 1 does not
+        sampler.add(0, [get_sim(50, 0.5)])
+        sampler.add(1, [get_sim(int(rng.integers(0, 101)), float(rng.uniform()))])
+    assert sampler.is_converged(0) and not sampler.is_converged(1)
+    assert sampler.allocate() == {1: 10}
+
+
+def test_allocation_respects_the_budget():
+    sampler = SequentialSampler(3, budget=15, batch_size=10)
+    allocation = sampler.allocate()
+    assert sum(allocation.values()) == 15
+    for i, num_runs in allocation.items():
+        for j in range(num_runs):
+            sampler.add(i, [get_sim(10 * j, 0.1 * j)])
+    assert sampler.remaining_budget == 0
+    assert sampler.allocate() == {}
@@ -0,0 +1,44 @@
+import _context
+from time import perf_counter
+from classes.RobotModel import Robot
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.SimSettings import SimSettings
+from classes.PerformanceMetrics import ObservedReward
+from classes.RewardModels import ConstantWeights
+from classes.State import RobotInfo
+
+
+def get_robot(num_sites: int) -> Robot:
+    settings = SimSettings(num_sites, 100, 100, 0.7, 0.7, threat_seed=1)
+    reward_model = ConstantWeights(wh=0.8)
+    trust_model = BetaDistributionModel([10., 10., 20., 30.], ObservedReward(), seed=1)
+    human_model = HumanModel(trust_model, BoundedRationalityDisuse(kappa=0.2, seed=1), reward_model)
+    return Robot(human_model, reward_model, settings)
+
+
+def test_large_budget_is_exact():
+    robot = get_robot(5)
+    info = RobotInfo(100, 100, 0.3, 0.7, 0)
+    assert robot.get_recommendation(info, time_budget=60.) == robot.solve(info)
+    assert robot.last_tier == 'exact'
+    assert robot.last_horizon == 5
+
+
+def test_zero_budget_is_myopic():
+    robot = get_robot(5)
+    for threat_level in [0.1, 0.5]:
+        info = RobotInfo(100, 100, threat_level, 0.7, 0)
+        assert robot.get_recommendation(info, time_budget=0.) == int(threat_level >= 0.25)
+        assert robot.last_tier == 'myopic'
+
+
+def test_budget_is_respected():
+    robot = get_robot(30)
+    info = RobotInfo(100, 100, 0.3, 0.7, 0)
+    start = perf_counter()
+    robot.get_recommendation(info, time_budget=0.2)
+    assert perf_counter() - start < 0.4
+    assert robot.last_tier in ('lookahead', 'myopic')
+    assert len(robot.tier_history) == 1
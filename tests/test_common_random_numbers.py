@@ -0,0 +1,63 @@
+import _context
+from copy import deepcopy
+import numpy as np
+from classes.CommonRandomNumbers import CommonRandomNumbers
+from classes.HumanModels import Human
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.RewardModels import ConstantWeights
+from classes.SimSettings import SimSettings
+from classes.State import HumanInfo, Observation
+from run_simulation import SimRunner
+
+
+def make_human(seed):
+    trust_model = BetaDistributionModel([20., 10., 10., 20.], ObservedReward(), seed=seed)
+    decision_model = BoundedRationalityDisuse(kappa=0.2, seed=seed)
+    return Human(trust_model, decision_model, ConstantWeights(wh=0.8))
+
+
+def test_decisions_do_not_depend_on_number_of_draws():
+    crn = CommonRandomNumbers(num_sites=5, seed=1)
+    human_1 = make_human(seed=1)
+    human_2 = make_human(seed=2)
+    human_1.use_common_random_numbers(crn)
+    human_2.use_common_random_numbers(crn)
+    assert human_1.get_trust_sample() == human_2.get_trust_sample()
+
+    for site_idx in range(5):
+        info = HumanInfo(100, 100, 0.6, 1, site_idx)
+        # Extra calls on one copy must not shift the stream of the other
+        for _ in range(site_idx):
+            human_2.choose_action(info)
+        action_1 = human_1.choose_action(info)
+        action_2 = human_2.choose_action(info)
+        assert action_1 == action_2
+        obs = Observation(1, action_1)
+        human_1.forward(info, obs)
+        human_2.forward(info, obs)
+        assert human_1.get_trust_sample() == human_2.get_trust_sample()
+
+
+def test_trust_samples_follow_beta_distribution():
+    samples = []
+    for seed in range(2000):
+        human = make_human(seed=None)
+        human.use_common_random_numbers(CommonRandomNumbers(num_sites=1, seed=seed))
+        samples.append(human.get_trust_sample())
+    assert abs(np.mean(samples) - 20. / 30.) < 0.01
+
+
+def test_sim_runner_replays_streams_across_strategies():
+    settings = SimSettings(3, 100, 100, 0.7, 0.7, threat_seed=3)
+    sim_runner = SimRunner(settings, wh_const=[0.8], seed=4, common_random_numbers=True)
+    sim_runner.init_sim()
+    humans = [sim_runner.state_dep_human] + sim_runner.const_humans
+    assert humans[0].decision_model.crn is humans[1].decision_model.crn
+    assert humans[0].get_trust_sample() == humans[1].get_trust_sample()
+
+    sim_runner_copy = SimRunner(deepcopy(settings), wh_const=[0.8], seed=4, common_random_numbers=True)
+    sim_runner.run()
+    sim_runner_copy.run()
+    assert sim_runner.state_dep_sim.trust_history == sim_runner_copy.state_dep_sim.trust_history
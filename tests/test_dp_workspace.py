@@ -0,0 +1,101 @@
+import _context
+import pickle
+import numpy as np
+from classes.RobotModel import Robot, DPWorkspace
+from classes.RewardModels import StateDependentWeights, ConstantWeights
+from classes.TerminalValues import MyopicTerminalValue
+from classes.State import RobotInfo
+from test_anytime_recommendations import get_robot
+
+
+def test_workspace_reuse_matches_fresh_solves():
+    robot = get_robot(6)
+    infos = [RobotInfo(100, 100, d, 0.7, site_idx) for site_idx in [0, 3, 1, 5] for d in [0.1, 0.3, 0.6]]
+    for info in infos:
+        assert robot.solve(info) == get_robot(6).solve(info)
+    # The buffers are sized to the largest horizon seen and are not pickled
+    assert robot.workspace.buffers[0].shape == (7, 7, 7)
+    assert pickle.loads(pickle.dumps(robot)).workspace.buffers is None
+
+
+def test_float32_workspace():
+    robot = get_robot(6)
+    robot_32 = Robot(robot.human_model, robot.reward_model, robot.settings, dtype=np.float32)
+    info = RobotInfo(100, 100, 0.3, 0.7, 0)
+    assert robot_32.solve(info) == robot.solve(info)
+    assert robot_32.workspace.buffers[0].dtype == np.float32
+    assert robot_32.get_solve_key(info) != robot.get_solve_key(info)
+
+
+def test_float32_stages_rarely_change_recommendations():
+    robot = get_robot(8)
+    robot_64 = Robot(robot.human_model, robot.reward_model, robot.settings, num_threads=2)
+    robot_32 = Robot(robot.human_model, robot.reward_model, robot.settings, num_threads=2, dtype=np.float32)
+    # The stages are computed in float32, not only stored in it
+    value_0, value_1 = robot_32.get_stage_values(np.float32(0.3), np.full((3, 1, 1), 0.5, dtype=np.float32),
+                                                 np.full((3, 3), 0.8, dtype=np.float32),
+                                                 np.zeros((4, 4, 4), dtype=np.float32))
+    assert value_0.dtype == value_1.dtype == np.float32
+    rng = np.random.default_rng(0)
+    infos = [RobotInfo(10 * int(rng.integers(11)), 10 * int(rng.integers(11)), float(rng.uniform()),
+                       float(rng.uniform(0.2, 0.9)), int(rng.integers(8))) for _ in range(200)]
+    mismatches = sum(robot_32.solve(info) != robot_64.solve(info) for info in infos)
+    assert mismatches / len(infos) <= 0.02
+    assert robot_32.workspace.buffers[0].dtype == np.float32
+    robot_64.workspace.executor.shutdown()
+    robot_32.workspace.executor.shutdown()
+
+
+def test_stage_parallel_solve_matches():
+    for reward_model in [None, StateDependentWeights()]:
+        robot = get_robot(7)
+        if reward_model is not None:
+            robot.reward_model = reward_model
+        parallel_robot = Robot(robot.human_model, robot.reward_model, robot.settings, num_threads=3)
+        for site_idx in [0, 2, 6]:
+            for d in [0.1, 0.3, 0.6, 0.9]:
+                info = RobotInfo(90, 80, d, 0.7, site_idx)
+                assert parallel_robot.solve(info) == robot.solve(info)
+                assert np.array_equal(parallel_robot.workspace.buffers[0], robot.workspace.buffers[0])
+
+
+def test_stacked_solve_matches_separate_solves():
+    robot = get_robot(6)
+    reward_models = [ConstantWeights(wh) for wh in [0.6, 0.7, 0.8, 0.9]] + [StateDependentWeights()]
+    trust_parameters = [None, [5., 20., 2., 40.], None, [30., 5., 40., 1.], None]
+    for site_idx in [0, 3]:
+        for d in [0.1, 0.3, 0.6]:
+            info = RobotInfo(90, 80, d, 0.7, site_idx)
+            expected = []
+            for reward_model, parameters in zip(reward_models, trust_parameters):
+                single = get_robot(6)
+                single.reward_model = reward_model
+                if parameters is not None:
+                    single.human_model.trust_model.update_parameters(parameters)
+                expected.append(single.solve(info))
+            assert robot.solve_strategies(info, reward_models, trust_parameters) == expected
+    # The robot's own trust model is left as it was
+    assert list(robot.human_model.trust_model.parameters) == list(get_robot(6).human_model.trust_model.parameters)
+
+
+def test_stacked_solve_with_a_lookahead():
+    robot = Robot(get_robot(8).human_model, ConstantWeights(0.8), get_robot(8).settings, lookahead=3,
+                  terminal_value=MyopicTerminalValue())
+    reward_models = [ConstantWeights(0.7), StateDependentWeights()]
+    info = RobotInfo(100, 100, 0.25, 0.7, 1)
+    expected = []
+    for reward_model in reward_models:
+        robot.reward_model = reward_model
+        expected.append(robot.solve(info))
+    assert robot.solve_strategies(info, reward_models) == expected
+
+
+def test_executor_is_kept_for_the_same_thread_count():
+    workspace = DPWorkspace()
+    executor = workspace.get_executor(2)
+    assert workspace.get_executor(2) is executor
+    other = workspace.get_executor(3)
+    assert other is not executor and workspace.executor_threads == 3
+    copied = pickle.loads(pickle.dumps(workspace))
+    assert copied.executor is None and copied.executor_threads is None
+    other.shutdown()
@@ -0,0 +1,50 @@
+import _context
+import numpy as np
+from equivalence_harness import (REFERENCES, TARGETS, generate_cases, compare, freeze, record_runs, save_cases,
+                                 load_cases)
+
+
+def test_reference_matches_itself():
+    for target in TARGETS:
+        cases = generate_cases(target, 2 if target == 'simulation' else 20, seed=1)
+        report = compare(target, REFERENCES[target], cases)
+        assert report['num_cases'] == len(cases)
+        assert report['mismatches'] == 0 and report['max_deviation'] == 0.
+
+    # The edge cases are drawn too
+    inputs = [case['inputs'] for case in generate_cases('recommendation', 100, seed=1)]
+    assert any(i['health'] == 0 for i in inputs) and any(i['time'] == 0 for i in inputs)
+    assert any(i['trust_params'][0] == 1 for i in inputs) and any(i['trust_params'][3] == 200 for i in inputs)
+
+
+def test_differences_are_reported():
+    def flipped(robot, info):
+        return 1 - REFERENCES['recommendation'](robot, info)
+
+    report = compare('recommendation', flipped, generate_cases('recommendation', 10, seed=2))
+    assert report['mismatches'] == report['action_mismatches'] == 10
+    assert len(report['failures']) == 10
+
+    def shifted(estimator, trust, performance):
+        return REFERENCES['estimator'](estimator, trust, performance) + 1e-3
+
+    report = compare('estimator', shifted, generate_cases('estimator', 5, seed=2))
+    assert report['mismatches'] == 5
+    assert np.isclose(report['max_deviation'], 1e-3)
+    assert compare('estimator', shifted, generate_cases('estimator', 5, seed=2), atol=1e-2)['mismatches'] == 0
+
+
+def test_recorded_cases_replay_against_frozen_outputs(tmp_path):
+    cases = record_runs(1, 2, seed=3)
+    assert {case['target'] for case in cases} == {'recommendation', 'estimator', 'simulation'}
+    file = str(tmp_path / 'cases.jsonl')
+    save_cases(file, freeze(cases))
+    cases = load_cases(file)
+    for target in ['recommendation', 'estimator', 'simulation']:
+        assert compare(target, REFERENCES[target], cases)['mismatches'] == 0
+
+    # The frozen outputs are compared against, unless the reference is run again
+    case = next(case for case in cases if case['target'] == 'recommendation')
+    case['expected']['action'] = 1 - case['expected']['action']
+    assert compare('recommendation', REFERENCES['recommendation'], [case])['mismatches'] == 1
+    assert compare('recommendation', REFERENCES['recommendation'], [case], recompute=True)['mismatches'] == 0
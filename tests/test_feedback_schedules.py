@@ -0,0 +1,61 @@
+import _context
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.ParamsUpdater import Estimator
+from classes.FeedbackSchedules import EveryKSites, RandomFeedback, AdaptiveFeedback
+from run_simulation import SimRunner
+
+
+def test_skipped_feedback_only_counts_performance():
+    x = np.array([5., 3., 2., 4.])
+    estimator = Estimator()
+    estimator.add_performance(1)
+    args = ([None, 0.6], [1, 0])
+    assert estimator.trust_feedback == [None] and estimator.perf_history == [1]
+    # The skipped site adds no likelihood term, but its success still raises alpha at the queried site
+    shifted = np.array([x[0] + x[2], x[1], x[2], x[3]])
+    assert np.isclose(Estimator.neg_log_likelihood(x, *args), Estimator.neg_log_likelihood(shifted, [0.6], [0]))
+
+    eps = 1e-6
+    numerical = [(Estimator.neg_log_likelihood(x + eps * e, *args) -
+                  Estimator.neg_log_likelihood(x - eps * e, *args)) / (2 * eps) for e in np.eye(4)]
+    assert np.allclose(Estimator.gradients(x, *args), numerical, atol=1e-5)
+
+
+def test_every_k_sites_refits_less(monkeypatch):
+    refits = []
+    update_model = Estimator.update_model
+
+    def counting_update_model(self, trust, performance):
+        refits.append(len(self.perf_history))
+        return update_model(self, trust, performance)
+
+    monkeypatch.setattr(Estimator, 'update_model', counting_update_model)
+    runner = SimRunner(SimSettings(6, 100, 100, 0.7, 0.7, threat_seed=2), [0.8], seed=2,
+                       feedback_schedule=EveryKSites(3))
+    runner.run()
+    results = runner.get_results()
+    for history in results.values():
+        assert history['feedback'] == [False, False, True] * 2
+        assert len(history['trust']) == 6
+    # Two refits for each of the two robots, each after counting the two skipped sites
+    assert refits == [2, 5, 2, 5]
+    estimator = runner.state_dep_robot.human_model.trust_model_updater
+    assert estimator.trust_feedback[:2] == [None, None]
+    assert len(estimator.perf_history) == 6
+
+
+def test_random_feedback_is_shared_by_the_strategies():
+    runner = SimRunner(SimSettings(8, 100, 100, 0.7, 0.7, threat_seed=4), [0.8, 0.6], seed=4,
+                       feedback_schedule=RandomFeedback(0.5))
+    runner.run()
+    feedback = [history['feedback'] for history in runner.get_results().values()]
+    assert feedback[0] == feedback[1] == feedback[2]
+    assert feedback[0] == [RandomFeedback(0.5, runner.seed).should_query(i, None) for i in range(8)]
+
+
+def test_adaptive_feedback_respects_the_max_gap():
+    runner = SimRunner(SimSettings(6, 100, 100, 0.7, 0.7, threat_seed=5), [0.8], seed=5,
+                       feedback_schedule=AdaptiveFeedback(threshold=1., max_gap=2))
+    runner.run()
+    assert runner.get_results()['state_dep']['feedback'] == [False, False, True] * 2
@@ -0,0 +1,53 @@
+import _context
+import pickle
+from classes.RobotModel import Robot, RobotOnly
+from classes.RewardModels import StateDependentWeights
+from classes.GlobalPolicy import GlobalPolicyCache
+from classes.State import RobotInfo
+from test_anytime_recommendations import get_robot
+
+
+def test_robot_policy_matches_solves():
+    robot = get_robot(6)
+    robot.reward_model = StateDependentWeights()
+    policy_robot = Robot(robot.human_model, robot.reward_model, robot.settings)
+    policy_robot.policy_cache = GlobalPolicyCache()
+    for site_idx in [0, 4]:
+        for health in range(0, 101, 20):
+            for time in range(0, 101, 30):
+                for d in [0.2, 0.5, 0.9]:
+                    info = RobotInfo(health, time, d, 0.7, site_idx)
+                    assert policy_robot.solve(info) == robot.solve(info)
+    # One policy per number of sites to go, whatever the start state and threat level
+    assert len(policy_robot.policy_cache) == 2
+    assert pickle.loads(pickle.dumps(policy_robot)).policy_cache is None
+
+
+def test_robot_only_policy_matches_solves():
+    robot = get_robot(5)
+    robot_only = RobotOnly(robot.reward_model, robot.settings)
+    policy_robot_only = RobotOnly(robot.reward_model, robot.settings)
+    policy_robot_only.policy_cache = GlobalPolicyCache()
+    for health in range(0, 101, 10):
+        for time in range(0, 101, 10):
+            for d in [0.2, 0.5, 0.9]:
+                info = RobotInfo(health, time, d, 0.7, 1)
+                assert policy_robot_only.choose_action(info) == robot_only.choose_action(info)
+    assert len(policy_robot_only.policy_cache) == 3
+
+
+def test_states_off_the_grid_are_solved():
+    robot = get_robot(4)
+    robot.policy_cache = GlobalPolicyCache()
+    info = RobotInfo(95, 120, 0.5, 0.7, 0)
+    assert robot.lookup_global_policy(info) is None
+    assert robot.solve(info) == get_robot(4).solve(info)
+
+
+def test_policy_key_has_the_failures():
+    robot = get_robot(4)
+    info = RobotInfo(100, 100, 0.5, 0.7, 1)
+    key = robot.get_policy_key(info)
+    # A failure changes beta but not alpha
+    robot.human_model.trust_model.population.add_performance([0])
+    assert robot.get_policy_key(info) != key
@@ -0,0 +1,36 @@
+import _context
+import json
+import os
+import subprocess
+import sys
+
+# Cold-start budget of a headless worker that only simulates
+IMPORT_BUDGET_SECONDS = 1.0
+HEAVY_MODULES = ['scipy', 'pandas', 'matplotlib', 'seaborn', 'tqdm', 'statsmodels', 'sklearn']
+WORKER_MODULES = ['run_simulation', 'parameter_sweep', 'experiment_design', 'classes.Simulation']
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+
+def measure_cold_import(module: str):
+    """Imports a module in a fresh interpreter and returns the import time and the heavy modules it loaded"""
+    code = (f"import sys, time, json\n"
+            f"start = time.perf_counter()\n"
+            f"import {module}\n"
+            f"elapsed = time.perf_counter() - start\n"
+            f"loaded = sorted({{m.split('.')[0] for m in sys.modules}} & set({HEAVY_MODULES!r}))\n"
+            f"print(json.dumps({{'elapsed': elapsed, 'loaded': loaded}}))\n")
+    output = subprocess.run([sys.executable, '-c', code], cwd=ROOT, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def test_worker_imports_only_numpy():
+    for module in WORKER_MODULES:
+        result = measure_cold_import(module)
+        assert result['loaded'] == [], f"{module} imports {result['loaded']} at module load"
+
+
+def test_worker_import_budget():
+    for module in WORKER_MODULES:
+        result = measure_cold_import(module)
+        assert result['elapsed'] < IMPORT_BUDGET_SECONDS
@@ -0,0 +1,124 @@
+import _context
+import pytest
+import json
+import sys
+from parameter_sweep import (SweepSpec, SweepScheduler, TaskPayload, DEFAULT_CONFIG, run_task, run_shard,
+                             merge_shards, main)
+from run_simulation import SimRunner
+from telemetry import read_events, summarize
+
+
+def test_expand_grid():
+    spec = SweepSpec({'kappa': [0.1, 0.2], 'discount_factor': [0.6, 0.7, 0.8]}, num_participants=2, base_seed=1,
+                     fixed={'num_sites': 3})
+    tasks = spec.expand()
+    assert len(tasks) == 12
+    assert len({task.hash for task in tasks}) == 12
+    assert all(task.config['num_sites'] == 3 for task in tasks)
+    assert all(task.config['prior_threat_level'] == DEFAULT_CONFIG['prior_threat_level'] for task in tasks)
+    # A participant has the same seed in every configuration
+    assert len({task.seed for task in tasks if task.participant_idx == 0}) == 1
+
+
+def test_duplicate_configs_share_hash():
+    spec = SweepSpec({'kappa': [0.2, 0.2]}, num_participants=1, base_seed=1)
+    tasks = spec.expand()
+    assert tasks[0].hash == tasks[1].hash
+
+
+def test_run_task_is_reproducible():
+    spec = SweepSpec({'kappa': [0.2]}, num_participants=1, base_seed=2, fixed={'num_sites': 3})
+    task = spec.expand()[0]
+    result_1 = run_task(TaskPayload(task, task.get_settings(), {}))
+    result_2 = run_task(TaskPayload(task, task.get_settings(), {}))
+    assert result_1['results'] == result_2['results']
+
+
+def test_shards_partition_tasks():
+    spec = SweepSpec({'kappa': [0.1, 0.2, 0.2]}, num_participants=3, base_seed=1)
+    shards = [spec.get_shard(i, 4) for i in range(4)]
+    hashes = [task.hash for shard in shards for task in shard]
+    assert len(hashes) == len(set(hashes)) == len({task.hash for task in spec.expand()})
+
+
+def test_merge_shards(tmp_path):
+    spec = SweepSpec({'kappa': [0.1, 0.2]}, num_participants=2, base_seed=3, fixed={'num_sites': 2})
+    files = [run_shard(spec, i, 3, str(tmp_path / 'shards'), cache_dir=str(tmp_path / 'cache'), num_workers=1)
+             for i in range(3)]
+    merged = merge_shards(spec, files)
+    assert [result['hash'] for result in merged['results']] == [task.hash for task in spec.expand()]
+
+    with pytest.raises(ValueError, match='missing'):
+        merge_shards(spec, files[:2])
+    with pytest.raises(ValueError, match='duplicated'):
+        merge_shards(spec, files + files[:1])
+    other_spec = SweepSpec({'kappa': [0.1, 0.2]}, num_participants=2, base_seed=4, fixed={'num_sites': 2})
+    with pytest.raises(ValueError, match='different sweep spec'):
+        merge_shards(other_spec, files)
+
+
+def test_shared_memory_results_match_pickled(tmp_path):
+    spec = SweepSpec({'wh_const': [[0.8], [0.8, 0.6]], 'num_sites': [2, 3]}, num_participants=1, base_seed=5)
+    shared = SweepScheduler(spec, cache_dir=str(tmp_path / 'shared'), num_workers=1).run()
+    pickled = SweepScheduler(spec, cache_dir=str(tmp_path / 'pickled'), num_workers=1, shared_memory=False).run()
+    assert shared == pickled
+    assert [len(result['results']) for result in shared] == [2, 2, 3, 3]
+    # The block is cached in one file, and read back on the next run
+    assert sorted(file.suffix for file in (tmp_path / 'shared').glob('block_*')) == ['.json', '.npy']
+    assert not list((tmp_path / 'shared').glob('*.pkl'))
+    assert SweepScheduler(spec, cache_dir=str(tmp_path / 'shared'), num_workers=1).run() == pickled
+
+
+def test_results_are_not_cached_without_cache(tmp_path):
+    spec = SweepSpec({'kappa': [0.2]}, num_participants=1, base_seed=6, fixed={'num_sites': 2})
+    SweepScheduler(spec, cache_dir=str(tmp_path / 'cache'), num_workers=1, cache=False).run()
+    assert not (tmp_path / 'cache').exists()
+
+
+def test_finished_tasks_are_cached_when_a_task_fails(tmp_path, monkeypatch):
+    spec = SweepSpec({'kappa': [0.1, 0.2, 0.3]}, num_participants=1, base_seed=7, fixed={'num_sites': 2})
+    tasks = spec.expand()
+    run = SimRunner.run
+
+    def fail_last_task(self, *args, **kwargs):
+        if self.kappa == 0.3:
+            raise RuntimeError("The task failed")
+        return run(self, *args, **kwargs)
+
+    # The workers are forked, so they see the failing run
+    monkeypatch.setattr(SimRunner, 'run', fail_last_task)
+    scheduler = SweepScheduler(spec, cache_dir=str(tmp_path / 'cache'), num_workers=1)
+    with pytest.raises(RuntimeError, match='The task failed'):
+        scheduler.run()
+    monkeypatch.undo()
+
+    rerun = SweepScheduler(spec, cache_dir=str(tmp_path / 'cache'), num_workers=1)
+    assert [rerun.load_cached(task) is not None for task in tasks] == [True, True, False]
+    fresh = SweepScheduler(spec, cache_dir=str(tmp_path / 'fresh'), num_workers=1).run()
+    assert rerun.run() == fresh
+
+
+def test_shards_write_their_own_event_logs(tmp_path, monkeypatch):
+    spec_file = tmp_path / 'spec.json'
+    spec_file.write_text(json.dumps({'base_seed': 8, 'num_participants': 2, 'fixed': {'num_sites': 2},
+                                     'grid': {'kappa': [0.1, 0.2]}}))
+    for shard_index in range(2):
+        monkeypatch.setattr(sys, 'argv', ['parameter_sweep.py', str(spec_file), '--shard-index', str(shard_index),
+                                          '--shard-count', '2', '--out', str(tmp_path / 'shards'),
+                                          '--cache-dir', str(tmp_path / 'cache'), '--workers', '1'])
+        main()
+    assert not (tmp_path / 'cache' / 'events.jsonl').exists()
+    for shard_index in range(2):
+        summary = summarize(read_events(str(tmp_path / 'cache' / f'events_shard_{shard_index:04d}_of_0002.jsonl')))
+        assert summary['total'] == summary['finished'] == 2
+        assert summary['done']
+
+
+def test_run_shard_passes_the_cache_options(tmp_path):
+    spec = SweepSpec({'kappa': [0.1, 0.2]}, num_participants=1, base_seed=9, fixed={'num_sites': 2})
+    run_shard(spec, 0, 2, str(tmp_path / 'shards'), cache_dir=str(tmp_path / 'cache'), num_workers=1, cache=False)
+    assert not (tmp_path / 'cache').exists()
+    run_shard(spec, 0, 2, str(tmp_path / 'shards'), cache_dir=str(tmp_path / 'cache'), num_workers=1,
+              shared_memory=False)
+    assert len(list((tmp_path / 'cache').glob('*.pkl'))) == 1
+    assert not list((tmp_path / 'cache').glob('block_*'))
@@ -0,0 +1,43 @@
+import _context
+import asyncio
+import os
+import sys
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'recommendation-server')))
+from server import RecommendationServer
+from load_generator import Client
+
+SESSION = {'strategy': 0.8, 'num_sites': 3, 'start_health': 100, 'start_time': 100}
+
+
+async def run_sessions():
+    server = RecommendationServer(num_workers=2, use_processes=False, window=0.05)
+    port = await server.start(port=0)
+    clients = [Client('127.0.0.1', port) for _ in range(3)]
+    try:
+        for client in clients:
+            await client.connect()
+        session_ids = [(await client.request('POST', '/sessions', dict(SESSION, seed=i)))['session_id']
+                       for i, client in enumerate(clients)]
+        # The same state in three sessions is solved once
+        recommendations = await asyncio.gather(*[
+            client.request('POST', f'/sessions/{session_id}/recommendation', {'threat_level': 0.6})
+            for client, session_id in zip(clients, session_ids)])
+        state = await clients[0].request('POST', f'/sessions/{session_ids[0]}/observation',
+                                         {'threat': 1, 'action': 0, 'trust_feedback': 0.4})
+        metrics = await clients[0].request('GET', '/metrics')
+    finally:
+        for client in clients:
+            await client.close()
+        await server.stop()
+
+    return recommendations, state, metrics
+
+
+def test_requests_are_batched():
+    recommendations, state, metrics = asyncio.run(run_sessions())
+    assert len({r['recommendation'] for r in recommendations}) == 1
+    assert metrics['batches'] == 1
+    assert metrics['solves'] == 1
+    assert state['site_idx'] == 1
+    assert state['health'] == 90
@@ -0,0 +1,36 @@
+import _context
+import os
+import pytest
+from classes.SimSettings import SimSettings
+from run_simulation import SimRunner
+from run_manifest import atomic_pickle_dump
+from render_figures import render_all
+
+
+def save_run(directory, i: int, j: int):
+    starting_condition = [(100, 100), (70, 40)][i]
+    sim_runner = SimRunner(SimSettings(3, *starting_condition, 0.7, 0.7, threat_seed=j), [0.8062], seed=j)
+    sim_runner.run()
+    atomic_pickle_dump({'sim_runner': sim_runner, 'starting_condition': starting_condition},
+                       os.path.join(directory, f'run_{i}_{j}.pkl'), slim=True)
+
+
+def test_render_skips_unchanged_figures(tmp_path):
+    pytest.importorskip('matplotlib')
+    data_dir, out_dir = tmp_path / 'data', str(tmp_path / 'figures')
+    data_dir.mkdir()
+    for j in range(2):
+        save_run(str(data_dir), 0, j)
+
+    manifest = render_all(str(data_dir), out_dir, formats=['png'], num_workers=1)
+    assert sorted(manifest['rendered']) == ['health_and_time', 'states_visited_0.81', 'states_visited_state_dep',
+                                            'trust', 'trust_condition_0']
+    assert all(os.path.exists(file) for figure in manifest['figures'].values() for file in figure['files'])
+
+    assert render_all(str(data_dir), out_dir, formats=['png'], num_workers=1)['rendered'] == []
+
+    # A new condition changes the aggregates of all the runs but not those of the existing condition
+    save_run(str(data_dir), 1, 0)
+    manifest = render_all(str(data_dir), out_dir, formats=['png'], num_workers=1)
+    assert manifest['skipped'] == ['trust_condition_0']
+    assert 'trust_condition_1' in manifest['rendered']
@@ -0,0 +1,25 @@
+import _context
+import pytest
+from classes.RewardModels import StateDependentWeights
+from classes.State import HumanInfo
+
+
+def test_artifact_matches_pickles():
+    pytest.importorskip('statsmodels')
+    pytest.importorskip('sklearn')
+    from_artifact = StateDependentWeights()
+    from_pickles = StateDependentWeights(use_pickles=True)
+    assert from_artifact.get_key() == from_pickles.get_key()
+    for health in range(0, 110, 10):
+        for time in range(0, 110, 10):
+            info = HumanInfo(health, time, 0.5, 0, 0)
+            assert from_artifact.get_wh(info) == from_pickles.get_wh(info)
+
+
+def test_corrupted_artifact_is_rejected(tmp_path):
+    import numpy as np
+    model = StateDependentWeights()
+    file = tmp_path / 'reward_model.npz'
+    np.savez(file, params=model.params + 1., mean=model.mean, scale=model.scale, sha256=np.array(model.hash))
+    with pytest.raises(ValueError):
+        StateDependentWeights(artifact_path=str(file))
@@ -0,0 +1,41 @@
+import _context
+import pytest
+from classes.SimSettings import SimSettings
+from run_simulation import SimRunner
+from run_manifest import atomic_pickle_dump
+from run_catalog import RunCatalog
+
+
+def test_catalog_filters_and_loads_lazily(tmp_path):
+    catalog = RunCatalog(str(tmp_path / 'catalog.sqlite'))
+    runners = {}
+    for i, (start_health, start_time) in enumerate([(100, 100), (70, 40)]):
+        sim_runner = SimRunner(SimSettings(3, start_health, start_time, 0.7, 0.7, threat_seed=i), [0.8062],
+                               seed=i)
+        sim_runner.run()
+        file = str(tmp_path / f'run_{i}_0.pkl')
+        sha256 = atomic_pickle_dump({'sim_runner': sim_runner}, file, slim=True)
+        catalog.add_run(f'{i}_0', sim_runner, file, seed=2 ** 100 + i, config_hash='c', sha256=sha256,
+                        condition=i, participant=0)
+        runners[i] = sim_runner
+
+    assert catalog.count() == 4
+    # Adding a run again replaces its rows
+    catalog.add_run('1_0', runners[1], str(tmp_path / 'run_1_0.pkl'), condition=1, participant=0)
+    assert catalog.count() == 4
+
+    handles = catalog.query(start_health=70, start_time=40, strategy='0.81')
+    assert len(handles) == 1
+    sim = runners[1].const_sims[0]
+    assert handles[0]['final_health'] == sim.health_history[-1]
+    assert handles[0]['min_trust'] == pytest.approx(min(sim.trust_history))
+    assert handles[0]._sim is None
+    assert handles[0].get_history() == sim.get_history()
+
+    final_health = runners[0].state_dep_sim.health_history[-1]
+    assert catalog.count(strategy='state_dep', final_health__lt=final_health + 1, start_health__gt=90) == 1
+    assert catalog.query(seed=2 ** 100)[0]['task'] == '0_0'
+    assert [h['task'] for h in catalog.query(order_by='-start_health', strategy='state_dep')] == ['0_0', '1_0']
+    with pytest.raises(ValueError):
+        catalog.query(final_health__between=1)
+    catalog.close()
@@ -0,0 +1,89 @@
+import _context
+import json
+import os
+import pytest
+import run_manifest
+from run_manifest import RunManifest, atomic_write_bytes, atomic_pickle_dump, DONE, FAILED
+
+
+def run_task(manifest: RunManifest, tmp_path, i: int, j: int) -> str:
+    file = str(tmp_path / f'run_{i}_{j}.pkl')
+    seed = manifest.start(i, j, (100, 100), file)
+    manifest.finish(i, j, atomic_pickle_dump({'seed': seed}, file))
+    return file
+
+
+def test_resume_skips_finished_tasks(tmp_path):
+    manifest = RunManifest(str(tmp_path / 'manifest.json'), base_seed=3)
+    manifest.save()
+    run_task(manifest, tmp_path, 0, 0)
+    run_task(manifest, tmp_path, 1, 0)
+    manifest.start(1, 1, (70, 40), str(tmp_path / 'run_1_1.pkl'))
+    manifest.start(2, 0, (70, 40), str(tmp_path / 'run_2_0.pkl'))
+    manifest.fail(2, 0, ValueError('boom'))
+
+    resumed = RunManifest(str(tmp_path / 'manifest.json'), resume=True)
+    assert resumed.base_seed == manifest.base_seed
+    assert resumed.tasks == manifest.tasks
+    assert [resumed.is_complete(i, j) for i, j in [(0, 0), (1, 0), (1, 1), (2, 0)]] == [True, True, False, False]
+    assert resumed.tasks['2_0']['status'] == FAILED and 'boom' in resumed.tasks['2_0']['error']
+    assert resumed.get_seed(1, 1) == manifest.get_seed(1, 1)
+    # Compacting keeps the same tasks, one line each
+    resumed.save()
+    assert len(open(tmp_path / 'manifest.json').read().splitlines()) == 5
+    assert RunManifest(str(tmp_path / 'manifest.json'), resume=True).tasks == manifest.tasks
+
+
+def test_updates_are_appended(tmp_path):
+    file = tmp_path / 'manifest.json'
+    manifest = RunManifest(str(file), base_seed=4)
+    manifest.save()
+    run_task(manifest, tmp_path, 0, 0)
+    before = file.read_text()
+    run_task(manifest, tmp_path, 0, 1)
+    after = file.read_text()
+    assert after.startswith(before) and len(after.splitlines()) == 5
+    # An append cut short is ignored, and its task is not complete
+    with open(file, 'a') as f:
+        f.write('{"key": "0_1", "status": "fail')
+    assert RunManifest(str(file), resume=True).is_complete(0, 1)
+
+
+def test_old_manifests_are_loaded(tmp_path):
+    file = tmp_path / 'manifest.json'
+    task = {'condition': 0, 'participant': 0, 'starting_condition': [100, 100], 'seed': 1, 'path': 'x.pkl',
+            'status': DONE, 'sha256': 'abc'}
+    file.write_text(json.dumps({'base_seed': 5, 'tasks': {'0_0': task}}, indent=1))
+    manifest = RunManifest(str(file), resume=True)
+    assert manifest.base_seed == 5 and manifest.tasks == {'0_0': task}
+
+
+def test_corrupted_outputs_are_rerun(tmp_path):
+    manifest = RunManifest(str(tmp_path / 'manifest.json'), base_seed=5)
+    file = run_task(manifest, tmp_path, 0, 0)
+    assert manifest.is_complete(0, 0)
+    data = open(file, 'rb').read()
+    with open(file, 'wb') as f:
+        f.write(data[:-3])
+    assert not manifest.is_complete(0, 0)
+    with open(file, 'wb') as f:
+        f.write(data[:-1] + bytes([data[-1] ^ 1]))
+    assert not manifest.is_complete(0, 0)
+    assert manifest.completed_tasks() == []
+
+    run_task(manifest, tmp_path, 0, 0)
+    assert RunManifest(str(tmp_path / 'manifest.json'), resume=True).is_complete(0, 0)
+
+
+def test_interrupted_write_keeps_the_old_file(tmp_path, monkeypatch):
+    file = str(tmp_path / 'out.pkl')
+    atomic_write_bytes(file, b'old')
+
+    def interrupt(fd):
+        raise KeyboardInterrupt
+
+    monkeypatch.setattr(run_manifest.os, 'fsync', interrupt)
+    with pytest.raises(KeyboardInterrupt):
+        atomic_write_bytes(file, b'new' * 1000)
+    assert open(file, 'rb').read() == b'old'
+    assert os.listdir(tmp_path) == ['out.pkl']
@@ -0,0 +1,46 @@
+import _context
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.ThreatSetter import SmartThreatChooser
+from run_simulation import SimRunner
+
+
+def get_runner(scenario: str, seed: int = 3) -> SimRunner:
+    return SimRunner(SimSettings(4, 100, 100, 0.7, 0.7, threat_seed=seed), [0.8062, 0.7], seed=seed,
+                     scenario=scenario)
+
+
+def test_pool_matches_serial_run():
+    for scenario in ['adaptive', 'upfront']:
+        serial = get_runner(scenario)
+        serial.run()
+        pooled = get_runner(scenario)
+        with ThreadPoolExecutor(max_workers=3) as executor:
+            pooled.run(executor=executor)
+        assert pooled.get_results() == serial.get_results()
+
+
+def test_upfront_scenario_is_shared_and_decided_before_the_run():
+    runner = get_runner('upfront')
+    runner.init_sim()
+    threats = runner.sim_settings.threat_setter.threats.copy()
+    runner = get_runner('upfront')
+    runner.run()
+    for history in runner.get_results().values():
+        assert history['threat'] == threats.tolist()
+    # The simulations get the same seeds as in an adaptive run
+    upfront, adaptive = get_runner('upfront'), get_runner('adaptive')
+    upfront.init_sim()
+    adaptive.init_sim()
+    for sim, adaptive_sim in zip([upfront.state_dep_sim] + upfront.const_sims,
+                                 [adaptive.state_dep_sim] + adaptive.const_sims):
+        assert sim.rng.bit_generator.state == adaptive_sim.rng.bit_generator.state
+    assert not upfront.state_dep_sim.choose_smartly
+
+
+def test_smart_sites_lie_between_the_thresholds():
+    threats, levels = SmartThreatChooser(0).choose_scenario(np.zeros(200), np.full(200, 2.), [0.6] * 200)
+    smart = levels != 2.
+    assert 50 < smart.sum() < 150
+    assert np.all((levels[smart] >= (1 - 0.8062) / 0.8062) & (levels[smart] <= (1 - 0.6) / 0.6))
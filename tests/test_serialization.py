@@ -0,0 +1,55 @@
+import _context
+import pickle
+from copy import deepcopy
+import numpy as np
+import pytest
+from classes.SimSettings import SimSettings
+from classes.RewardModels import StateDependentWeights
+from classes.Serialization import STATE_VERSION, slim_state
+from run_simulation import SimRunner
+
+
+def get_sim_runner() -> SimRunner:
+    sim_runner = SimRunner(SimSettings(3, 100, 100, 0.7, 0.7, threat_seed=1), [0.8], seed=1)
+    sim_runner.run()
+    return sim_runner
+
+
+def test_round_trip_keeps_the_random_state():
+    sim_runner = get_sim_runner()
+    loaded = pickle.loads(pickle.dumps(sim_runner))
+    assert loaded.get_results() == sim_runner.get_results()
+    assert loaded.state_dep_sim.rng.random() == deepcopy(sim_runner.state_dep_sim.rng).random()
+
+
+def test_slim_state():
+    sim_runner = get_sim_runner()
+    with slim_state():
+        data = pickle.dumps(sim_runner)
+    assert len(data) < len(pickle.dumps(sim_runner))
+    loaded = pickle.loads(data)
+    assert loaded.get_results() == sim_runner.get_results()
+    assert loaded.state_dep_robot.human_model.trust_model_updater is None
+    # The generators are fresh rather than restored
+    assert isinstance(loaded.state_dep_sim.rng, np.random.Generator)
+
+
+def test_newer_version_is_rejected():
+    sim_runner = get_sim_runner()
+    state = sim_runner.__getstate__()
+    assert state['version'] == STATE_VERSION
+    state['version'] = STATE_VERSION + 1
+    with pytest.raises(ValueError, match='version'):
+        SimRunner.__new__(SimRunner).__setstate__(state)
+
+
+def test_reward_model_is_stored_by_reference():
+    reward_model = StateDependentWeights()
+    state = reward_model.__getstate__()
+    assert 'params' not in state
+    assert state['artifact_path'] == 'reward_model.npz'
+    assert pickle.loads(pickle.dumps(reward_model)).hash == reward_model.hash
+
+    state['hash'] = 'another hash'
+    with pytest.raises(ValueError, match='changed'):
+        StateDependentWeights.__new__(StateDependentWeights).__setstate__(state)
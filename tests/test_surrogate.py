@@ -0,0 +1,70 @@
+import _context
+import pickle
+import numpy as np
+from classes.RewardModels import StateDependentWeights
+from classes.State import RobotInfo
+from classes.Surrogate import GradientBoostedTrees, SurrogateRecommender
+from train_surrogate import generate_training_data, train_surrogate
+from test_anytime_recommendations import get_robot
+
+
+def test_trees_fit_a_threshold_rule():
+    rng = np.random.default_rng(0)
+    x = rng.uniform(size=(2000, 3))
+    y = (x[:, 0] + 0.5 * x[:, 1] > 0.8).astype(int)
+    model = GradientBoostedTrees(num_trees=50, depth=3).fit(x, y)
+    assert np.mean((model.predict_proba(x) >= 0.5) != y) < 0.03
+
+
+def test_surrogate_recommendations_and_fallback(tmp_path):
+    x, y = generate_training_data('robot', 400, 5, seed=1)
+    surrogate = train_surrogate('robot', x, y, threshold=0.5, num_trees=30, depth=4)
+    assert surrogate.evaluate(x, y)[0]['disagreement'] < 0.1
+
+    file = str(tmp_path / 'surrogate.npz')
+    surrogate.save(file)
+    loaded = SurrogateRecommender.load(file)
+    assert np.array_equal(loaded.model.predict_proba(x), surrogate.model.predict_proba(x))
+    # A loaded surrogate is pickled as a reference to its artifact
+    assert len(pickle.dumps(loaded)) < 2000
+    assert np.array_equal(pickle.loads(pickle.dumps(loaded)).model.leaves, loaded.model.leaves)
+
+    robot = get_robot(5)
+    robot.surrogate = loaded
+    info = RobotInfo(100, 100, 0.4, 0.7, 0)
+    robot.get_recommendation(info)
+    assert robot.last_tier == 'surrogate'
+    loaded.threshold = 1.
+    assert robot.get_recommendation(info) == get_robot(5).solve(info)
+    assert robot.last_tier == 'exact'
+
+    loaded.threshold = 0.5
+    robot.reward_model = StateDependentWeights(add_noise=True)
+    robot.get_recommendation(info)
+    assert robot.last_tier == 'exact'
+
+
+def test_surrogate_does_not_extrapolate(tmp_path):
+    x, y = generate_training_data('robot', 400, 5, seed=2)
+    surrogate = train_surrogate('robot', x, y, threshold=0.5, num_trees=30, depth=4)
+    file = str(tmp_path / 'surrogate.npz')
+    surrogate.save(file)
+    loaded = SurrogateRecommender.load(file)
+    assert np.array_equal(loaded.feature_min, x.min(axis=0)) and np.array_equal(loaded.feature_max, x.max(axis=0))
+
+    info = RobotInfo(100, 100, 0.4, 0.7, 0)
+    robot = get_robot(5)
+    robot.surrogate = loaded
+    robot.get_recommendation(info)
+    assert robot.last_tier == 'surrogate'
+    # A longer mission than the training missions is solved exactly
+    robot = get_robot(7)
+    robot.surrogate = loaded
+    assert robot.get_recommendation(info) == get_robot(7).solve(info)
+    assert robot.last_tier == 'exact'
+    # And so is a robot with a lookahead
+    robot = get_robot(5)
+    robot.surrogate = loaded
+    robot.lookahead = 2
+    robot.get_recommendation(info)
+    assert robot.last_tier != 'surrogate'
@@ -0,0 +1,40 @@
+import _context
+import pytest
+from parameter_sweep import SweepSpec, run_shard
+from telemetry import EventLog, read_events, summarize
+
+
+def test_sweep_events(tmp_path):
+    spec = SweepSpec({'kappa': [0.1, 0.2]}, num_participants=2, base_seed=3, fixed={'num_sites': 2})
+    event_file = str(tmp_path / 'events.jsonl')
+    run_shard(spec, 0, 1, str(tmp_path / 'shards'), cache_dir=str(tmp_path / 'cache'), num_workers=1,
+              event_file=event_file)
+    events = read_events(event_file)
+    finishes = [e for e in events if e['event'] == 'task_finish']
+    assert len(finishes) == 4
+    assert set(finishes[0]['phases']) == {'init', 'state_dep', 'const'}
+    assert {'duration', 'seed', 'config_hash', 'worker', 'peak_rss_mb'} <= set(finishes[0])
+
+    summary = summarize(events)
+    assert summary['done'] and summary['total'] == 4 and summary['finished'] == 4
+    assert summary['eta'] == 0 and summary['running'] == []
+
+
+def test_summary_of_a_running_sweep(tmp_path):
+    log = EventLog(str(tmp_path / 'events.jsonl'))
+    log.emit('sweep_start', total=10)
+    for i in range(4):
+        with log.task(str(i), seed=i, config_hash='c'):
+            pass
+    with pytest.raises(RuntimeError):
+        with log.task('4', seed=4, config_hash='c'):
+            raise RuntimeError('diverged')
+    log.emit('task_start', task='5', seed=5, config_hash='c')
+
+    events = read_events(log.file)
+    summary = summarize(events, now=events[0]['time'] + 10., window=100.)
+    assert (summary['finished'], summary['failed'], summary['running']) == (4, 1, ['5'])
+    # 4 runs in 10 s leave 5 runs for 12.5 s
+    assert summary['runs_per_sec'] == pytest.approx(0.4, rel=1e-3)
+    assert summary['eta'] == pytest.approx(12.5, rel=1e-3)
+    assert summary['failures'] == [{'task': '4', 'error': "RuntimeError('diverged')"}]
@@ -0,0 +1,37 @@
+import _context
+from classes.RobotModel import RobotOnly
+from classes.RewardModels import ConstantWeights
+from classes.SimSettings import SimSettings
+from classes.State import RobotInfo
+from classes.TerminalValues import MyopicTerminalValue, TableTerminalValue
+from test_anytime_recommendations import get_robot
+
+
+def test_long_lookahead_is_the_full_plan():
+    robot = get_robot(4)
+    robot.lookahead = 10
+    robot.terminal_value = MyopicTerminalValue()
+    full_robot = get_robot(4)
+    for threat_level in [0.1, 0.25, 0.5]:
+        info = RobotInfo(100, 100, threat_level, 0.7, 0)
+        assert robot.solve(info) == full_robot.solve(info)
+        assert robot.get_solve_key(info) == full_robot.get_solve_key(info)
+
+
+def test_lookahead_changes_the_solve_key():
+    robot = get_robot(6)
+    info = RobotInfo(100, 100, 0.3, 0.7, 0)
+    key = robot.get_solve_key(info)
+    robot.lookahead = 2
+    assert robot.get_solve_key(info) != key
+
+
+def test_table_of_exact_values():
+    settings = SimSettings(5, 100, 100, 0.7, 0.7, threat_seed=1)
+    robot_only = RobotOnly(ConstantWeights(wh=0.8), settings)
+    table = TableTerminalValue.from_robot_only(robot_only, 100, 100, 0.7)
+    # With the full-horizon values at the horizon, the truncated plan agrees with the full plan
+    truncated = RobotOnly(ConstantWeights(wh=0.8), settings, lookahead=2, terminal_value=table)
+    for threat_level in [0.1, 0.2, 0.3, 0.9]:
+        info = RobotInfo(100, 100, threat_level, 0.7, 0)
+        assert truncated.choose_action(info) == robot_only.choose_action(info)
@@ -0,0 +1,69 @@
+import _context
+import numpy as np
+from classes.TrustModels import BetaDistributionModel, PopulationBetaModel
+from classes.PerformanceMetrics import ObservedReward, ImmediateExpectedReward
+from classes.State import HumanInfo, Observation
+
+
+def test_batch_performance_matches_scalar():
+    rng = np.random.default_rng(0)
+    for metric in [ObservedReward(), ImmediateExpectedReward()]:
+        rec = rng.integers(0, 2, size=100)
+        threat = rng.integers(0, 2, size=100)
+        threat_level = rng.uniform(size=100)
+        wh = rng.uniform(size=100)
+        batch = metric.get_performance_batch(rec, threat, threat_level, wh)
+        for i in range(100):
+            info = HumanInfo(100, 100, threat_level[i], rec[i], 0)
+            obs = Observation(threat[i], 0)
+            assert batch[i] == metric.get_performance(info, obs, wh[i])
+
+
+def test_population_matches_single_models():
+    rng = np.random.default_rng(1)
+    parameters = rng.uniform(2., 50., size=(20, 4))
+    population = PopulationBetaModel(parameters, ObservedReward(), seed=2)
+    singles = [BetaDistributionModel(list(p), ObservedReward(), seed=3) for p in parameters]
+
+    for site_idx in range(30):
+        rec = rng.integers(0, 2, size=20)
+        threat = rng.integers(0, 2, size=20)
+        threat_level = rng.uniform(size=20)
+        wh = rng.uniform(0.5, 1., size=20)
+        population.update_trust_batch(rec, threat, threat_level, wh)
+        for i, model in enumerate(singles):
+            model.update_trust(HumanInfo(100, 100, threat_level[i], rec[i], site_idx), Observation(threat[i], 0),
+                               wh[i])
+
+    for i, model in enumerate(singles):
+        assert model.alpha == population.alpha[i]
+        assert model.beta == population.beta[i]
+        assert model.performance_history == population.get_view(i).performance_history
+    assert population.performance_history.shape[1] >= 30
+
+
+def test_view_writes_through_to_population():
+    population = PopulationBetaModel(np.ones((3, 4)) * 10., ObservedReward(), seed=0)
+    view = population.get_view(1)
+    view.update_trust(HumanInfo(100, 100, 0.9, 0, 0), Observation(1, 0), 0.9)
+    assert population.num_failures.tolist() == [0, 1, 0]
+    view.parameters = [20., 10., 10., 10.]
+    assert population.parameters[1, 0] == 20.
+
+
+def test_particle_estimator_tracks_trust():
+    from classes.ParamsUpdater import ParticleEstimator
+    rng = np.random.default_rng(4)
+    trust_model = BetaDistributionModel([30., 10., 5., 15.], ObservedReward(), seed=4)
+    estimator = ParticleEstimator(seed=4)
+    initial_uncertainty = estimator.get_uncertainty()
+    for _ in range(40):
+        performance = int(rng.uniform() < 0.7)
+        trust_model.population.add_performance([performance])
+        x = estimator.update_model(trust_model.trust_sampled, performance)
+
+    assert all(low <= v <= high for v, (low, high) in zip(x, [(1, 200), (1, 200), (0.1, 200), (0.1, 200)]))
+    alpha = x[0] + trust_model.num_successes * x[2]
+    beta = x[1] + trust_model.num_failures * x[3]
+    assert abs(alpha / (alpha + beta) - trust_model.trust_mean) < 0.1
+    assert np.all(estimator.get_uncertainty() < initial_uncertainty)
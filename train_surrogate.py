@@ -0,0 +1,156 @@
+"""Trains a surrogate recommender on the answers of the exact solvers and measures how often it disagrees with them.
+
+    python train_surrogate.py --kind robot --num-samples 20000 --out models/surrogate_robot.npz
+
+The saved surrogate can be selected in a Simulation, a SimRunner, or a parameter sweep ('surrogate' in the spec).
+"""
+import argparse
+from time import perf_counter
+from typing import Dict, List, Tuple
+import numpy as np
+from classes.SimSettings import SimSettings
+from classes.RobotModel import Robot, RobotOnly, DPWorkspace
+from classes.HumanModels import HumanModel
+from classes.TrustModels import BetaDistributionModel
+from classes.PerformanceMetrics import ObservedReward
+from classes.DecisionModels import BoundedRationalityDisuse
+from classes.RewardModels import StateDependentWeights, ConstantWeights
+from classes.State import RobotInfo
+from classes.Surrogate import GradientBoostedTrees, SurrogateRecommender, get_robot_features, \
+    get_robot_only_features
+from run_simulation import KAPPA
+
+THRESHOLDS = [0.5, 0.7, 0.8, 0.9, 0.95, 0.99]
+
+
+def sample_query(kind: str, num_sites: int, state_dep_reward_model: StateDependentWeights,
+                 workspace: DPWorkspace, rng: np.random.Generator):
+    """
+    Samples the inputs of a query and returns the robot that answers it and the information at the site
+    """
+    site_idx = int(rng.integers(num_sites))
+    info = RobotInfo(10 * int(rng.integers(11)), 10 * int(rng.integers(11)), float(rng.uniform()),
+                     float(rng.uniform(0.2, 0.9)), site_idx)
+    settings = SimSettings(num_sites, 100, 100, info.prior_threat_level, float(rng.uniform(0.5, 0.95)),
+                           threat_seed=0)
+    if rng.uniform() < 0.5:
+        reward_model = state_dep_reward_model
+    else:
+        reward_model = ConstantWeights(float(rng.uniform(0.55, 0.95)))
+
+    if kind == 'robot_only':
+        return RobotOnly(reward_model, settings), info
+
+    # The alpha of the human model is the current one, after the updates of the earlier sites
+    alpha, vs, vf = np.exp(rng.uniform(np.log([2., 1., 1.]), np.log([200., 60., 60.])))
+    trust_model = BetaDistributionModel([alpha, alpha, vs, vf], ObservedReward(), seed=0)
+    human_model = HumanModel(trust_model, BoundedRationalityDisuse(kappa=KAPPA, seed=0), reward_model)
+    robot = Robot(human_model, reward_model, settings, num_threads=1)
+    robot.workspace = workspace
+    return robot, info
+
+
+def generate_training_data(kind: str, num_samples: int, num_sites: int,
+                           seed: int | None = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Samples queries and solves them exactly
+    :param kind: 'robot' for the recommendations of a Robot or 'robot_only' for the actions of a RobotOnly
+    :param num_samples: the number of queries
+    :param num_sites: the number of sites of the missions
+    :param seed: the seed of the queries
+    :return: the features and the exact answers of the queries
+    """
+    rng = np.random.default_rng(seed)
+    state_dep_reward_model = StateDependentWeights()
+    workspace = DPWorkspace()
+    x, y = [], []
+    for _ in range(num_samples):
+        robot, info = sample_query(kind, num_sites, state_dep_reward_model, workspace, rng)
+        if kind == 'robot_only':
+            x.append(get_robot_only_features(robot, info))
+            y.append(robot.choose_action(info))
+        else:
+            x.append(get_robot_features(robot, info))
+            y.append(robot.solve(info))
+    if workspace.executor is not None:
+        workspace.executor.shutdown()
+
+    return np.array(x), np.array(y, dtype=int)
+
+
+def train_surrogate(kind: str, x: np.ndarray, y: np.ndarray, threshold: float, **kwargs) -> SurrogateRecommender:
+    """Fits a surrogate to the exact answers, with the keyword arguments of GradientBoostedTrees"""
+    model = GradientBoostedTrees(**kwargs).fit(x, y)
+    decision_params = [KAPPA, 10., 10.] if kind == 'robot' else None
+    # The surrogate does not answer the queries outside of the range of the training queries
+    return SurrogateRecommender(model, kind, threshold, decision_params, StateDependentWeights().hash,
+                                x.min(axis=0), x.max(axis=0))
+
+
+def time_queries(surrogate: SurrogateRecommender, kind: str, num_sites: int, num_queries: int,
+                 seed: int | None = None) -> Dict[str, float]:
+    """Returns the mean time in seconds of a query answered by the surrogate and by the exact solver"""
+    rng = np.random.default_rng(seed)
+    state_dep_reward_model = StateDependentWeights()
+    workspace = DPWorkspace()
+    surrogate_time, exact_time = 0., 0.
+    for _ in range(num_queries):
+        robot, info = sample_query(kind, num_sites, state_dep_reward_model, workspace, rng)
+        start = perf_counter()
+        if kind == 'robot_only':
+            surrogate.predict(get_robot_only_features(robot, info))
+            surrogate_time += perf_counter() - start
+            start = perf_counter()
+            robot.choose_action(info)
+        else:
+            surrogate.predict(get_robot_features(robot, info))
+            surrogate_time += perf_counter() - start
+            start = perf_counter()
+            robot.solve(info)
+        exact_time += perf_counter() - start
+    if workspace.executor is not None:
+        workspace.executor.shutdown()
+
+    return {'surrogate': surrogate_time / num_queries, 'exact': exact_time / num_queries}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Train a surrogate recommender on the exact solvers')
+    parser.add_argument('--kind', choices=['robot', 'robot_only'], default='robot')
+    parser.add_argument('--num-samples', type=int, default=20000, help='the number of training queries')
+    parser.add_argument('--num-test', type=int, default=2000, help='the number of held out queries')
+    parser.add_argument('--num-sites', type=int, default=10)
+    parser.add_argument('--num-trees', type=int, default=100)
+    parser.add_argument('--depth', type=int, default=5)
+    parser.add_argument('--threshold', type=float, default=0.9,
+                        help='the smallest probability of a predicted answer to use it instead of solving')
+    parser.add_argument('--seed', type=int, default=None)
+    parser.add_argument('--out', default=None, help='the path of the npz artifact (default: do not save)')
+    args = parser.parse_args()
+
+    seeds = np.random.SeedSequence(args.seed).generate_state(3)
+    start = perf_counter()
+    x, y = generate_training_data(args.kind, args.num_samples, args.num_sites, seeds[0])
+    x_test, y_test = generate_training_data(args.kind, args.num_test, args.num_sites, seeds[1])
+    print(f"Solved {args.num_samples + args.num_test} queries in {perf_counter() - start:.1f} s")
+
+    start = perf_counter()
+    surrogate = train_surrogate(args.kind, x, y, args.threshold, num_trees=args.num_trees, depth=args.depth)
+    print(f"Fitted {args.num_trees} trees in {perf_counter() - start:.1f} s")
+
+    rows: List[Dict] = surrogate.evaluate(x_test, y_test, THRESHOLDS)
+    print(f"{'Threshold':>10} {'Coverage':>9} {'Disagree':>9} {'With fallback':>14}")
+    for row in rows:
+        print(f"{row['threshold']:>10.2f} {row['coverage']:>9.1%} {row['disagreement']:>9.2%} "
+              f"{row['disagreement_with_fallback']:>14.2%}")
+
+    times = time_queries(surrogate, args.kind, args.num_sites, 200, seeds[2])
+    print(f"Query time: surrogate {times['surrogate'] * 1e6:.0f} us, exact {times['exact'] * 1e6:.0f} us")
+
+    if args.out is not None:
+        artifact_hash = surrogate.save(args.out)
+        print(f"Saved {args.out} (sha256 {artifact_hash})")
+
+
+if __name__ == "__main__":
+    main()